@@ -0,0 +1,217 @@
+"""
+Выбор бэкенда инференса (torch / onnx / openvino / torchscript).
+
+Экспорт AI_MODEL_PATH в оптимизированный формат выполняется один раз и
+кэшируется в AI_EXPORT_DIR; загруженная экспортированная модель имеет тот же
+интерфейс YOLO (predict, names), поэтому детектор от бэкенда не зависит.
+
+Проверка совпадения детекций:
+    python ai_backends.py export --backend onnx
+    python ai_backends.py parity --backend onnx photo1.jpg photo2.jpg
+"""
+import argparse
+import hashlib
+import json
+import logging
+import shutil
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import settings
+
+log = logging.getLogger(__name__)
+
+SUPPORTED_BACKENDS = ("torch", "onnx", "openvino", "torchscript")
+
+# Имя артефакта, который создает model.export() для каждого формата
+EXPORT_SUFFIXES = {
+    "onnx": ".onnx",
+    "openvino": "_openvino_model",
+    "torchscript": ".torchscript",
+}
+
+# Параметры predict исходной модели, которые нужно перенести в экспортированную
+CARRIED_OVERRIDES = ("conf", "iou", "agnostic_nms", "max_det", "imgsz")
+
+
+def exported_path(source_id: str, backend: str, export_dir: Optional[str] = None) -> Path:
+    """
+    Путь к кэшированному артефакту: зависит от идентичности исходной модели.
+    """
+    fingerprint = hashlib.sha1(source_id.encode()).hexdigest()[:12]
+    return Path(export_dir or settings.AI_EXPORT_DIR) / f"model-{fingerprint}{EXPORT_SUFFIXES[backend]}"
+
+
+def export_model(model, backend: str, target: Path, imgsz: int) -> Path:
+    """
+    Экспортирует загруженную torch-модель и переносит артефакт в target.
+    """
+    log.info(f"📦 Экспорт модели в {backend} (imgsz={imgsz})...")
+    # dynamic: батчи из BatchScheduler имеют переменный размер
+    exported = Path(model.export(
+        format=backend,
+        imgsz=imgsz,
+        dynamic=backend != "torchscript",
+        half=False
+    ))
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists():
+        shutil.rmtree(target) if target.is_dir() else target.unlink()
+    shutil.move(str(exported), str(target))
+
+    overrides = getattr(model, "overrides", {}) or {}
+    meta = {k: overrides[k] for k in CARRIED_OVERRIDES if overrides.get(k) is not None}
+    target.with_name(target.name + ".json").write_text(json.dumps(meta))
+    log.info(f"✅ Модель экспортирована: {target}")
+    return target
+
+
+def load_exported(path: Path):
+    """
+    Загружает экспортированную модель через YOLO (AutoBackend).
+    """
+    from ultralytics import YOLO
+
+    model = YOLO(str(path), task="detect")
+    meta_path = path.with_name(path.name + ".json")
+    if meta_path.exists():
+        model.overrides.update(json.loads(meta_path.read_text()))
+    return model
+
+
+def load_backend(
+    backend: str,
+    load_torch_model: Callable[[], Any],
+    source_id: str,
+    export_dir: Optional[str] = None,
+    imgsz: Optional[int] = None
+):
+    """
+    Возвращает модель для выбранного бэкенда.
+    
+    Args:
+        backend: один из SUPPORTED_BACKENDS.
+        load_torch_model: загрузчик исходной torch-модели (вызывается только при необходимости).
+        source_id: идентичность исходной модели (ключ кэша экспорта).
+        export_dir: каталог кэша экспортированных моделей.
+        imgsz: размер входа для экспорта.
+    """
+    if backend not in SUPPORTED_BACKENDS:
+        raise ValueError(f"Unknown AI_BACKEND: {backend}")
+    if backend == "torch":
+        return load_torch_model()
+
+    target = exported_path(source_id, backend, export_dir)
+    if not target.exists():
+        export_model(load_torch_model(), backend, target, imgsz or settings.AI_IMGSZ)
+    model = load_exported(target)
+    log.info(f"✅ Модель загружена ({backend}): {target}")
+    return model
+
+
+def _match_detections(reference, candidate, iou_threshold: float, conf_tolerance: float) -> List[str]:
+    """
+    Сравнивает два DetectionResult; возвращает список расхождений.
+    """
+    problems = []
+    if reference.detection_count != candidate.detection_count:
+        problems.append(f"count {reference.detection_count} != {candidate.detection_count}")
+        return problems
+    if reference.category != candidate.category:
+        problems.append(f"category {reference.category} != {candidate.category}")
+    if reference.severity != candidate.severity:
+        problems.append(f"severity {reference.severity} != {candidate.severity}")
+
+    used = set()
+    for box, score in zip(reference.boxes, reference.scores):
+        if not candidate.scores.size:
+            break
+        x1 = np.maximum(box[0], candidate.boxes[:, 0])
+        y1 = np.maximum(box[1], candidate.boxes[:, 1])
+        x2 = np.minimum(box[2], candidate.boxes[:, 2])
+        y2 = np.minimum(box[3], candidate.boxes[:, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        union = (box[2] - box[0]) * (box[3] - box[1]) + candidate.areas - inter
+        ious = np.where(union > 0, inter / union, 0)
+        ious[list(used)] = -1
+        best = int(np.argmax(ious))
+        if ious[best] < iou_threshold:
+            problems.append(f"box {box.tolist()} has no match (best IoU {ious[best]:.3f})")
+            continue
+        used.add(best)
+        if abs(float(score) - float(candidate.scores[best])) > conf_tolerance:
+            problems.append(f"box {box.tolist()} conf {score:.3f} != {candidate.scores[best]:.3f}")
+    return problems
+
+
+def check_parity(
+    backend: str,
+    images: List[str],
+    model_path: Optional[str] = None,
+    iou_threshold: float = 0.9,
+    conf_tolerance: float = 0.05
+) -> Dict[str, List[str]]:
+    """
+    Прогоняет изображения через torch и выбранный бэкенд и сравнивает детекции.
+    
+    Returns:
+        Словарь {изображение: расхождения}; пустой, если все совпало.
+    """
+    from ai_processor import AIPotholeDetector
+
+    reference = AIPotholeDetector(model_path, backend="torch")
+    candidate = AIPotholeDetector(model_path, backend=backend)
+    reference.cache = candidate.cache = None
+
+    mismatches = {}
+    for image in images:
+        ref = reference.analyze(image, annotate=False)
+        cand = candidate.analyze(image, annotate=False)
+        problems = _match_detections(ref, cand, iou_threshold, conf_tolerance)
+        if problems:
+            mismatches[image] = problems
+    return mismatches
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Экспорт и проверка бэкендов инференса")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="Экспортировать AI_MODEL_PATH в кэш")
+    # AI_BACKEND=torch экспортировать нечего: тогда бэкенд обязателен
+    export_default = settings.AI_BACKEND if settings.AI_BACKEND in SUPPORTED_BACKENDS[1:] else None
+    export_parser.add_argument(
+        "--backend", choices=SUPPORTED_BACKENDS[1:], default=export_default, required=export_default is None
+    )
+
+    parity_parser = sub.add_parser("parity", help="Сравнить детекции с torch")
+    parity_parser.add_argument("--backend", choices=SUPPORTED_BACKENDS[1:], required=True)
+    parity_parser.add_argument("--iou", type=float, default=0.9)
+    parity_parser.add_argument("--conf-tolerance", type=float, default=0.05)
+    parity_parser.add_argument("images", nargs="+")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "export":
+        from ai_processor import AIPotholeDetector
+        AIPotholeDetector(settings.AI_MODEL_PATH, backend=args.backend)
+        return 0
+
+    mismatches = check_parity(
+        args.backend, args.images, settings.AI_MODEL_PATH, args.iou, args.conf_tolerance
+    )
+    for image, problems in mismatches.items():
+        print(f"❌ {image}")
+        for problem in problems:
+            print(f"   {problem}")
+    if not mismatches:
+        print(f"✅ {args.backend}: детекции совпадают на {len(args.images)} изображениях")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from ai_executor import InferenceExecutor, InferenceQueueFull, get_inference_executor
+from config import settings
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class _PendingImage:
+    image: Any
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    enqueued_at: float
+
+
+class BatchScheduler:
+    """
+    Динамический микро-батчинг запросов к детектору.
+    
+    Изображения, пришедшие в пределах window_ms от первого в батче, собираются
+    (не более max_batch_size) и уходят в пул инференса одним model.predict;
+    результаты раздаются ожидающим запросам.
+    """
+
+    def __init__(
+        self,
+        executor: InferenceExecutor,
+        window_ms: int = 10,
+        max_batch_size: int = 1
+    ):
+        self.executor = executor
+        self.window = max(0, window_ms) / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        # Сколько изображений может ждать: столько, сколько влезет в очередь пула
+        self.max_pending = (executor.workers + executor.queue_size) * self.max_batch_size
+        self._queue: "asyncio.Queue[_PendingImage]" = None
+        self._dispatcher: asyncio.Task = None
+        self._tasks = set()  # ссылки на фоновые задачи: без них задачу может собрать GC
+        self._pending = 0
+        self._rejected = 0
+        # Метрики
+        self._batches = 0
+        self._images = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    async def analyze(self, image, **kwargs):
+        """
+        Асинхронный аналог AIPotholeDetector.analyze() с батчингом.
+        
+        Raises:
+            InferenceQueueFull: если ожидающих изображений слишком много.
+        """
+        if not self.enabled:
+            return await self.executor.analyze(image, **kwargs)
+
+        if self._pending >= self.max_pending:
+            self._rejected += 1
+            raise InferenceQueueFull(self.executor.retry_after)
+
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = self._spawn(self._dispatch_loop())
+
+        item = _PendingImage(image, kwargs, loop.create_future(), loop.time())
+        self._pending += 1
+        try:
+            await self._queue.put(item)
+            return await item.future
+        finally:
+            self._pending -= 1
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"❌ Ошибка фоновой задачи батчинга: {task.exception()!r}")
+
+    async def _dispatch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            batch = [first]
+            deadline = first.enqueued_at + self.window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            dispatched_at = loop.time()
+            # Один predict возможен только для одинаковых параметров постобработки
+            groups: Dict[Tuple, List[_PendingImage]] = {}
+            for item in batch:
+                groups.setdefault(tuple(sorted(item.kwargs.items())), []).append(item)
+            for items in groups.values():
+                self._spawn(self._run_batch(items, dispatched_at))
+
+    async def _run_batch(self, items: List[_PendingImage], dispatched_at: float):
+        # Отмененные запросы не попадают ни в батч, ни в метрики
+        items = [item for item in items if not item.future.done()]
+        if not items:
+            return
+        self._batches += 1
+        self._images += len(items)
+        for item in items:
+            wait = dispatched_at - item.enqueued_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        try:
+            results = await self.executor.analyze_batch(
+                [item.image for item in items], **items[0].kwargs
+            )
+        except Exception as e:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        for item, result in zip(items, results):
+            if not item.future.done():
+                item.future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        avg_batch = self._images / self._batches if self._batches else 0.0
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "pending": self._pending,
+            "rejected": self._rejected,
+            "batches": self._batches,
+            "images": self._images,
+            "avg_batch_size": round(avg_batch, 2),
+            "avg_batch_fill": round(avg_batch / self.max_batch_size, 3),
+            "avg_queue_wait_ms": round(self._wait_total / self._images * 1000, 2) if self._images else 0.0,
+            "max_queue_wait_ms": round(self._wait_max * 1000, 2)
+        }
+
+
+_scheduler = None
+
+def get_batch_scheduler() -> BatchScheduler:
+    """
+    Получение синглтона планировщика батчей (стоит перед пулом инференса).
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = BatchScheduler(
+            get_inference_executor(),
+            window_ms=settings.AI_BATCH_WINDOW_MS,
+            max_batch_size=settings.AI_BATCH_MAX_SIZE
+        )
+    return _scheduler
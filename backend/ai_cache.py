@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from config import settings
+
+log = logging.getLogger(__name__)
+
+
+def content_hash(data) -> str:
+    """
+    SHA-256 содержимого изображения (байты файла или буфер массива).
+    
+    Для массива учитываются форма и dtype: одинаковые байты 640x480 и
+    480x640 - разные изображения.
+    """
+    digest = hashlib.sha256()
+    if hasattr(data, "shape") and hasattr(data, "dtype"):
+        digest.update(f"ndarray:{tuple(data.shape)}:{data.dtype.str}:".encode())
+        if not data.flags.c_contiguous:
+            data = data.tobytes()
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """
+    LRU/TTL-кэш результатов детекции по хэшу содержимого изображения.
+    
+    Память ограничена max_bytes (оценка размера записи); при заданном disk_dir
+    промахи памяти проверяются во втором, дисковом уровне.
+    """
+
+    def __init__(self, max_bytes: int, ttl: int, disk_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(image_hash: str, model_id: str, params: Dict[str, Any]) -> str:
+        """
+        Ключ: хэш изображения + идентичность модели + пороги/параметры.
+        """
+        params_repr = repr(sorted(params.items()))
+        return hashlib.sha256(f"{image_hash}|{model_id}|{params_repr}".encode()).hexdigest()
+
+    @staticmethod
+    def _estimate_size(result) -> int:
+        size = 512 + result.boxes.nbytes + result.scores.nbytes + result.class_ids.nbytes + result.areas.nbytes
+        if result.annotated_jpeg:
+            size += len(result.annotated_jpeg)
+        return size
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, size, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                self._drop(key)
+
+        result = self._disk_get(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._put_memory(key, result)
+        return result
+
+    def put(self, key: str, result):
+        self._put_memory(key, result)
+        self._disk_put(key, result)
+
+    def _put_memory(self, key: str, result):
+        size = self._estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, result)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.pkl"
+
+    def _disk_get(self, key: str):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"⚠️ Не удалось прочитать запись кэша {path}: {e}")
+            return None
+
+    def _disk_put(self, key: str, result):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.warning(f"⚠️ Не удалось записать запись кэша {path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+            }
+
+
+_cache = None
+
+def get_detection_cache() -> Optional[DetectionCache]:
+    """
+    Получение синглтона кэша детекций (None, если кэш выключен).
+    """
+    global _cache
+    if _cache is None and settings.AI_CACHE_ENABLED:
+        _cache = DetectionCache(
+            max_bytes=settings.AI_CACHE_MAX_BYTES,
+            ttl=settings.AI_CACHE_TTL,
+            disk_dir=settings.AI_CACHE_DIR
+        )
+    return _cache
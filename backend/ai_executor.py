@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import settings
+
+log = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(Exception):
+    """
+    Очередь инференса переполнена; клиенту нужно повторить запрос позже.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("AI inference queue is full")
+        self.retry_after = retry_after
+
+
+def _init_worker(model_path: Optional[str]) -> Dict[str, float]:
+    """
+    Инициализатор процесса пула: загружает модель один раз на процесс.
+    
+    Returns:
+        Тайминги загрузки детектора.
+    """
+    from ai_processor import get_ai_detector
+    return get_ai_detector(model_path).load_timings
+
+
+def _run_analyze(image, kwargs: Dict[str, Any]):
+    from ai_processor import get_ai_detector
+    return get_ai_detector().analyze(image, **kwargs)
+
+
+def _run_analyze_batch(images: List[Any], kwargs: Dict[str, Any]):
+    from ai_processor import get_ai_detector
+    return get_ai_detector().analyze_batch(images, **kwargs)
+
+
+class InferenceExecutor:
+    """
+    Выполняет инференс вне event loop в пуле потоков или процессов.
+    
+    Число одновременно принятых задач ограничено workers + queue_size;
+    сверх этого submit() сразу бросает InferenceQueueFull, а не блокирует loop.
+    """
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        workers: int = 1,
+        queue_size: int = 8,
+        retry_after: int = 5,
+        model_path: Optional[str] = None
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown AI_EXECUTOR: {kind}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.retry_after = retry_after
+        self.model_path = model_path
+        self._pool: Optional[Executor] = None
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._rejected = 0
+        # Готовность модели для /health
+        self.state = "not_started"
+        self.load_timings: Dict[str, float] = {}
+        self.load_error: Optional[str] = None
+
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.kind == "process":
+            # spawn: fork после инициализации torch может зависнуть
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_path,)
+            )
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="ai-inference"
+            )
+        log.info(f"✅ Пул инференса запущен: {self.kind} x{self.workers}, очередь {self.queue_size}")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def submit(self, fn: Callable, *args):
+        """
+        Выполняет fn(*args) в пуле и ожидает результат.
+        
+        Raises:
+            InferenceQueueFull: если лимит задач исчерпан.
+        """
+        if self._pool is None:
+            self.start()
+        with self._pending_lock:
+            if self._pending >= self.workers + self.queue_size:
+                self._rejected += 1
+                raise InferenceQueueFull(self.retry_after)
+            self._pending += 1
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Место освобождается, когда задача закончилась в пуле (или отменена
+        # до старта), а не когда ожидающий запрос отменен: иначе брошенная
+        # работа продолжает занимать пул сверх лимита
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, _future=None):
+        # Вызывается из потока пула
+        with self._pending_lock:
+            self._pending -= 1
+
+    async def load_model(self):
+        """
+        Загружает и прогревает модель в пуле (в режиме thread - единственный экземпляр).
+        """
+        self.state = "loading"
+        started = time.perf_counter()
+        try:
+            self.load_timings = dict(await self.submit(_init_worker, self.model_path))
+        except Exception as e:
+            self.state = "failed"
+            self.load_error = str(e)
+            raise
+        self.load_timings["total_s"] = time.perf_counter() - started
+        self.state = "ready"
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def analyze(self, image, **kwargs):
+        """
+        Асинхронный аналог AIPotholeDetector.analyze().
+        """
+        return await self.submit(_run_analyze, image, kwargs)
+
+    async def analyze_batch(self, images: List[Any], **kwargs):
+        """
+        Асинхронный аналог AIPotholeDetector.analyze_batch(); занимает одно место в очереди.
+        """
+        return await self.submit(_run_analyze_batch, images, kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "pending": self._pending,
+            "rejected": self._rejected,
+            "state": self.state,
+            "load_timings": {k: round(v, 3) for k, v in self.load_timings.items()},
+            "load_error": self.load_error
+        }
+
+
+_executor = None
+
+def get_inference_executor() -> InferenceExecutor:
+    """
+    Получение синглтона пула инференса.
+    """
+    global _executor
+    if _executor is None:
+        _executor = InferenceExecutor(
+            kind=settings.AI_EXECUTOR,
+            workers=settings.AI_WORKERS,
+            queue_size=settings.AI_QUEUE_SIZE,
+            retry_after=settings.AI_RETRY_AFTER,
+            model_path=settings.AI_MODEL_PATH
+        )
+    return _executor
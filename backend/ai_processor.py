@@ -1,40 +1,196 @@
 import cv2
-from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 from pathlib import Path
 import logging
 import base64
-from io import BytesIO
-from typing import Tuple, Optional, Dict, Any
-import torch
+import hashlib
+from typing import Tuple, Optional, Dict, Any, List, Union
+from dataclasses import dataclass, field
 import urllib.request
+import threading
+import time
+import os
+from functools import lru_cache
 
-from ultralytics.nn.tasks import DetectionModel
-from torch.nn.modules.conv import Conv2d
-from ultralytics.nn.modules import Detect
-from torch.nn.modules.container import Sequential
-from ultralytics.nn.modules.conv import Conv, Concat
-from torch.nn.modules.batchnorm import BatchNorm2d
-from torch.nn.modules.activation import SiLU
-from ultralytics.nn.modules.block import C2f
-from torch.nn.modules.container import ModuleList
-from ultralytics.nn.modules.block import Bottleneck, DFL
-from ultralytics.nn.modules.block import SPPF
-from torch.nn.modules.pooling import MaxPool2d
-from torch.nn.modules.upsampling import Upsample
-
-# Импорт из ultralyticsplus
-try:
-    from ultralyticsplus import YOLO, load_model
-    ULTRALYTICS_PLUS_AVAILABLE = True
-except ImportError:
-    from ultralytics import YOLO
-    ULTRALYTICS_PLUS_AVAILABLE = False
-    
-torch.serialization.add_safe_globals([DetectionModel, DFL, Concat, Upsample, MaxPool2d, SPPF, Bottleneck, ModuleList, C2f, Conv2d, Detect, Sequential, Conv, BatchNorm2d, SiLU])
+from ai_cache import content_hash, get_detection_cache
+from label_renderer import create_label_renderer
+from ai_backends import load_backend
+from config import settings
 
 log = logging.getLogger(__name__)
 
+# Вход детектора: путь к файлу, байты закодированного изображения или BGR-массив
+ImageSource = Union[str, Path, bytes, np.ndarray]
+
+
+@lru_cache(maxsize=None)
+def _import_ultralytics():
+    """
+    Ленивый импорт torch/ultralytics: сам импорт ai_processor их не тянет.
+    
+    Returns:
+        (YOLO, load_model) - load_model равен None без ultralyticsplus.
+    """
+    if settings.AI_OFFLINE:
+        # Должно быть выставлено до импорта huggingface_hub/ultralytics
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("YOLO_OFFLINE", "1")
+    
+    import torch
+    from ultralytics.nn.tasks import DetectionModel
+    from torch.nn.modules.conv import Conv2d
+    from ultralytics.nn.modules import Detect
+    from torch.nn.modules.container import Sequential
+    from ultralytics.nn.modules.conv import Conv, Concat
+    from torch.nn.modules.batchnorm import BatchNorm2d
+    from torch.nn.modules.activation import SiLU
+    from ultralytics.nn.modules.block import C2f
+    from torch.nn.modules.container import ModuleList
+    from ultralytics.nn.modules.block import Bottleneck, DFL
+    from ultralytics.nn.modules.block import SPPF
+    from torch.nn.modules.pooling import MaxPool2d
+    from torch.nn.modules.upsampling import Upsample
+    
+    # Импорт из ultralyticsplus
+    try:
+        from ultralyticsplus import YOLO, load_model
+    except ImportError:
+        from ultralytics import YOLO
+        load_model = None
+    
+    torch.serialization.add_safe_globals([DetectionModel, DFL, Concat, Upsample, MaxPool2d, SPPF, Bottleneck, ModuleList, C2f, Conv2d, Detect, Sequential, Conv, BatchNorm2d, SiLU])
+    return YOLO, load_model
+
+
+def _empty_boxes() -> np.ndarray:
+    return np.zeros((0, 4), dtype=np.float32)
+
+
+def tile_grid(width: int, height: int, tile: int, overlap: float, max_tiles: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Сетка перекрывающихся тайлов (x1, y1, x2, y2), покрывающая кадр.
+    
+    Если тайлов больше max_tiles, размер тайла увеличивается.
+    """
+    def positions(length: int, size: int) -> List[int]:
+        if length <= size:
+            return [0]
+        stride = max(1, int(size * (1 - overlap)))
+        starts = list(range(0, length - size, stride))
+        return starts + [length - size]
+    
+    while True:
+        xs, ys = positions(width, tile), positions(height, tile)
+        if len(xs) * len(ys) <= max(1, max_tiles):
+            break
+        tile = int(tile * 1.25) + 1
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in ys for x in xs]
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    NMS по классам (NumPy). Возвращает индексы оставленных bbox по убыванию уверенности.
+    """
+    if not scores.size:
+        return np.zeros(0, dtype=np.int64)
+    # Сдвиг по классу: bbox разных классов не пересекаются
+    shifted = boxes + (class_ids.astype(np.float32) * (boxes.max() + 1))[:, None]
+    areas = (shifted[:, 2] - shifted[:, 0]) * (shifted[:, 3] - shifted[:, 1])
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        x1 = np.maximum(shifted[i, 0], shifted[rest, 0])
+        y1 = np.maximum(shifted[i, 1], shifted[rest, 1])
+        x2 = np.minimum(shifted[i, 2], shifted[rest, 2])
+        y2 = np.minimum(shifted[i, 3], shifted[rest, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+@dataclass
+class DetectionResult:
+    """
+    Результат одного прогона детектора на изображении.
+    
+    Детекции хранятся в колоночном виде (массивы NumPy, отсортированы по
+    убыванию уверенности). detect_potholes() и get_detection_details() -
+    представления этого объекта.
+    """
+    has_problem: bool = False
+    confidence: float = 0.0
+    category: str = "unknown"
+    severity: str = "none"
+    boxes: np.ndarray = field(default_factory=_empty_boxes)  # (N, 4) xyxy
+    scores: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+    class_ids: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int32))
+    areas: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+    annotated_jpeg: Optional[bytes] = None
+    image_size: Optional[Tuple[int, int]] = None  # (ширина, высота) исходного изображения
+    model_version: Optional[str] = None  # какая модель посчитала результат
+
+    @classmethod
+    def error(cls) -> "DetectionResult":
+        return cls(category="error", severity="error")
+
+    @property
+    def annotated_image(self) -> Optional[str]:
+        """
+        Аннотированное изображение в base64 (старый формат ответа).
+        """
+        if self.annotated_jpeg is None:
+            return None
+        return base64.b64encode(self.annotated_jpeg).decode('utf-8')
+
+    @property
+    def detection_count(self) -> int:
+        return int(self.scores.size)
+
+    @property
+    def avg_confidence(self) -> float:
+        if not self.scores.size:
+            return 0
+        return float(self.scores.mean())
+
+    @property
+    def detections(self) -> List[Dict[str, Any]]:
+        """
+        Построчное представление детекций (формат API).
+        """
+        return [
+            {"id": i + 1, "confidence": confidence, "bbox": bbox, "area": area}
+            for i, (confidence, bbox, area) in enumerate(zip(
+                self.scores.tolist(), self.boxes.tolist(), self.areas.tolist()
+            ))
+        ]
+
+    def columns(self) -> Dict[str, List]:
+        """
+        Колоночное представление детекций: параллельные массивы.
+        """
+        return {
+            "confidence": self.scores.tolist(),
+            "bbox": self.boxes.tolist(),
+            "area": self.areas.tolist(),
+            "class_id": self.class_ids.tolist()
+        }
+
+    def details(self) -> Dict[str, Any]:
+        """
+        Словарь в формате get_detection_details().
+        """
+        return {
+            "detections": self.detections,
+            "total_count": self.detection_count,
+            "severity": self.severity,
+            "avg_confidence": self.avg_confidence
+        }
+
+
 class AIPotholeDetector:
     
     DEFAULT_MODEL_ID = "keremberke/yolov8s-pothole-detection"
@@ -45,40 +201,136 @@ class AIPotholeDetector:
         'manhole': 'Люк',
     }
 
-    def __init__(self, model_path: str = None):
+    LABEL_FONT_SIZE = 24
+
+    def __init__(self, model_path: str = None, backend: str = None):
         """
         Инициализация детектора ям.
         
         Args:
             model_path: путь к локальной модели. Если None, загружается модель по умолчанию из HuggingFace.
+            backend: бэкенд инференса (torch, onnx, openvino, torchscript); по умолчанию AI_BACKEND.
         """
+        self._predict_lock = threading.Lock()
+        self.backend = backend or settings.AI_BACKEND
+        self.load_timings: Dict[str, float] = {}
         try:
-            if ULTRALYTICS_PLUS_AVAILABLE:
-                if model_path and Path(model_path).exists():
-                    self.model = load_model(model_path)
-                    log.info(f"✅ Локальная модель загружена с использованием ultralyticsplus: {model_path}")
-                else:
-                    log.info(f"ℹ️ Загрузка модели по умолчанию из HuggingFace: {self.DEFAULT_MODEL_ID}")
-                    self.model = load_model(self.DEFAULT_MODEL_ID)
-                    log.info("✅ Модель загружена из HuggingFace с использованием ultralyticsplus")
-            else:
-                if model_path and Path(model_path).exists():
-                    self.model = YOLO(model_path)
-                    log.info(f"✅ Локальная модель YOLO загружена: {model_path}")
-                else:
-                    self.model = YOLO("best.pt")
-                    log.info("✅ Модель YOLO загружена (используется чистая ultralytics)")
+            started = time.perf_counter()
+            _import_ultralytics()
+            self.load_timings["imports_s"] = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            model_path = self._resolve_model_path(model_path)
+            source_id = self._model_identity(model_path)
+            self.model = load_backend(
+                self.backend,
+                lambda: self._load_torch_model(model_path),
+                source_id
+            )
+            self.load_timings["model_s"] = time.perf_counter() - started
             
             # НЕ переопределяем model.names, чтобы не сломать plot()
             # if hasattr(self.model, 'names'):
             #     ...
             
             # ⭐ НОВОЕ: Загружаем шрифт для кириллицы
+            started = time.perf_counter()
             self.font_path = self._download_cyrillic_font()
+            self.label_renderer = create_label_renderer(
+                self.font_path, self.LABEL_FONT_SIZE, self.LABEL_TRANSLATIONS.values()
+            )
+            self.load_timings["font_s"] = time.perf_counter() - started
+            
+            self.model_id = f"{source_id}|{self.backend}"
+            self.model_version = hashlib.sha1(self.model_id.encode()).hexdigest()[:16]
+            self.cache = get_detection_cache()
+            
+            # Прогрев: первый настоящий запрос не платит за ленивую инициализацию predictor
+            if settings.AI_WARMUP:
+                started = time.perf_counter()
+                self.warmup()
+                self.load_timings["warmup_s"] = time.perf_counter() - started
 
         except Exception as e:
             log.exception(f"❌ Ошибка загрузки модели: {e}")
             raise
+        
+        log.info(
+            "⏱️ Детектор готов: " +
+            ", ".join(f"{k}={v:.2f}" for k, v in self.load_timings.items())
+        )
+
+    def warmup(self):
+        """
+        Один инференс на пустом кадре.
+        """
+        dummy = np.zeros((settings.AI_IMGSZ, settings.AI_IMGSZ, 3), dtype=np.uint8)
+        with self._predict_lock:
+            self.model.predict(dummy, verbose=False)
+
+    @classmethod
+    def _artifact_model_path(cls) -> Path:
+        """
+        Локальная копия модели по умолчанию (см. prefetch_artifacts).
+        """
+        return Path(settings.AI_ARTIFACT_DIR) / "models" / cls.DEFAULT_MODEL_ID.replace("/", "--") / "best.pt"
+
+    def _resolve_model_path(self, model_path: Optional[str]) -> Optional[str]:
+        """
+        Локальный путь к модели; None - загрузить модель по умолчанию из сети.
+        """
+        if model_path and Path(model_path).exists():
+            return model_path
+        cached = self._artifact_model_path()
+        if cached.exists():
+            log.info(f"ℹ️ Используется локальная копия модели: {cached}")
+            return str(cached)
+        if settings.AI_OFFLINE:
+            raise RuntimeError(
+                f"AI_OFFLINE: модель не найдена ({model_path}, {cached}); "
+                "выполните `python ai_processor.py prefetch`"
+            )
+        return None
+
+    def _load_torch_model(self, model_path: Optional[str]):
+        """
+        Загрузка исходной PyTorch-модели (ultralyticsplus или ultralytics).
+        """
+        YOLO, load_model = _import_ultralytics()
+        if load_model is not None:
+            if model_path and Path(model_path).exists():
+                model = load_model(model_path)
+                log.info(f"✅ Локальная модель загружена с использованием ultralyticsplus: {model_path}")
+            else:
+                log.info(f"ℹ️ Загрузка модели по умолчанию из HuggingFace: {self.DEFAULT_MODEL_ID}")
+                model = load_model(self.DEFAULT_MODEL_ID)
+                log.info("✅ Модель загружена из HuggingFace с использованием ultralyticsplus")
+        else:
+            if model_path and Path(model_path).exists():
+                model = YOLO(model_path)
+                log.info(f"✅ Локальная модель YOLO загружена: {model_path}")
+            else:
+                model = YOLO("best.pt")
+                log.info("✅ Модель YOLO загружена (используется чистая ultralytics)")
+        return model
+
+    def _model_identity(self, model_path: Optional[str]) -> str:
+        """
+        Идентичность модели для ключей кэша: путь + размер + mtime локального файла.
+        """
+        if model_path and Path(model_path).exists():
+            stat = Path(model_path).stat()
+            return f"{Path(model_path).resolve()}:{stat.st_size}:{int(stat.st_mtime)}"
+        _, load_model = _import_ultralytics()
+        return self.DEFAULT_MODEL_ID if load_model is not None else "best.pt"
+
+    @property
+    def thresholds(self) -> Dict[str, Any]:
+        """
+        Параметры predict, влияющие на результат детекции.
+        """
+        overrides = getattr(self.model, "overrides", {}) or {}
+        return {k: overrides.get(k) for k in ("conf", "iou", "imgsz", "max_det", "agnostic_nms")}
 
     def _download_cyrillic_font(self) -> Optional[str]:
         """
@@ -88,22 +340,36 @@ class AIPotholeDetector:
             Путь к файлу шрифта или None
         """
         font_paths = [
+            settings.AI_FONT_PATH,
             "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
             "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
             "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
             "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",  # macOS
             "C:\\Windows\\Fonts\\arial.ttf",  # Windows
+            str(self._artifact_font_path()),
+            "./fonts/DejaVuSans-Bold.ttf",  # старое место загрузки
         ]
         
         for font_path in font_paths:
-            if Path(font_path).exists():
+            if font_path and Path(font_path).exists():
                 log.info(f"✅ Найден шрифт: {font_path}")
                 return font_path
         
+        if settings.AI_OFFLINE:
+            log.warning("⚠️ AI_OFFLINE: шрифт не найден, метки не будут отрисованы")
+            return None
+        
         # Если не найден, скачиваем
-        fonts_dir = Path("./fonts")
-        fonts_dir.mkdir(exist_ok=True)
-        font_file = fonts_dir / "DejaVuSans-Bold.ttf"
+        return self._fetch_font()
+
+    @staticmethod
+    def _artifact_font_path() -> Path:
+        return Path(settings.AI_ARTIFACT_DIR) / "fonts" / "DejaVuSans-Bold.ttf"
+
+    @classmethod
+    def _fetch_font(cls) -> Optional[str]:
+        font_file = cls._artifact_font_path()
+        font_file.parent.mkdir(parents=True, exist_ok=True)
         
         if not font_file.exists():
             try:
@@ -122,6 +388,9 @@ class AIPotholeDetector:
         ⭐ КЛЮЧЕВОЙ МЕТОД: Заменяет английские метки на русские в уже отрисованном изображении.
         Текст БЕЗ фона, только с тенью для читаемости.
         
+        Метки берутся из заранее отрисованных спрайтов и накладываются прямо
+        в BGR-массив, без конвертации кадра в PIL.
+        
         Args:
             annotated_frame: изображение с отрисованными bbox от YOLO (BGR)
             results: результаты детекции
@@ -129,218 +398,385 @@ class AIPotholeDetector:
         Returns:
             Изображение с русскими метками (BGR)
         """
-        if not self.font_path:
+        if self.label_renderer is None:
             log.warning("⚠️ Шрифт не найден, возвращаем изображение без изменений")
             return annotated_frame
         
-        # Конвертируем в RGB для PIL
-        image_rgb = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(image_rgb)
-        draw = ImageDraw.Draw(pil_image)
-        
-        # Загружаем шрифт
-        try:
-            font = ImageFont.truetype(self.font_path, 24)  # Размер шрифта
-        except Exception as e:
-            log.error(f"❌ Не удалось загрузить шрифт: {e}")
-            return annotated_frame
+        if not annotated_frame.flags.writeable:
+            annotated_frame = annotated_frame.copy()
         
         # Обрабатываем каждую детекцию
         for result in results:
-            if result.boxes is not None:
-                for box in result.boxes:
-                    # Получаем данные
-                    x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                    confidence = box.conf[0].item()
-                    class_id = int(box.cls[0].item())
-                    
-                    # Получаем оригинальное имя класса
-                    class_name = self.model.names.get(class_id, "unknown")
-                    
-                    # ⭐ Переводим на русский
-                    russian_label = self.LABEL_TRANSLATIONS.get(class_name, class_name)
-                    
-                    # Формируем полный текст
-                    text = f"{russian_label}"
-                    
-                    # Получаем размер текста
-                    bbox = draw.textbbox((0, 0), text, font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                    
-                    # Позиция текста (над bbox)
-                    text_x = x1 + 5
-                    text_y = y1 - text_height - 10
-                    
-                    # Если текст выходит за верхнюю границу, помещаем внутрь bbox
-                    if text_y < 0:
-                        text_y = y1 + 5
-                    
-                    # ⭐ Рисуем тень (черный текст со смещением)
-                    shadow_offset = 2
-                    draw.text(
-                        (text_x + shadow_offset, text_y + shadow_offset),
-                        text,
-                        fill=(0, 0, 0),  # Черная тень
-                        font=font
-                    )
-                    
-                    # ⭐ Рисуем основной текст (белый)
-                    draw.text(
-                        (text_x, text_y),
-                        text,
-                        fill=(255, 255, 255),  # Белый текст
-                        font=font
-                    )
+            xyxy, _, class_ids = self._box_arrays(result.boxes)
+            self._draw_labels(annotated_frame, xyxy, class_ids, result.names)
         
-        # Конвертируем обратно в BGR
-        result_bgr = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        return result_bgr
+        return annotated_frame
 
+    def _draw_labels(self, frame: np.ndarray, xyxy: np.ndarray, class_ids: np.ndarray, names: Dict[int, str]):
+        """
+        Накладывает русские метки на кадр на месте.
+        """
+        if self.label_renderer is None:
+            return
+        for (x1, y1, _, _), class_id in zip(xyxy.astype(np.int32).tolist(), class_ids.tolist()):
+            # Получаем оригинальное имя класса и переводим на русский
+            class_name = names.get(class_id, "unknown")
+            text = self.LABEL_TRANSLATIONS.get(class_name, class_name)
+            self.label_renderer.draw(frame, x1, y1, text)
 
-    def detect_potholes(
-        self, 
-        image_path: str,
+
+    def analyze(
+        self,
+        image: ImageSource,
         annotation_quality: int = 98,
-        use_russian_labels: bool = True
-    ) -> Tuple[bool, float, str, Optional[str]]:
+        use_russian_labels: bool = True,
+        annotate: bool = True,
+        annotation_subsampling: str = "444",
+        encode_original: bool = True
+    ) -> DetectionResult:
         """
-        Обнаружение ям на изображении.
+        Единственный прогон модели на изображении.
+        
+        Категория, уверенность, список bbox, severity и аннотированное
+        изображение считаются по одному вызову model.predict.
+        
+        Args:
+            image: путь к файлу, байты закодированного изображения или BGR-массив.
+            annotation_quality: качество JPEG для аннотированного изображения.
+            use_russian_labels: подписывать bbox русскими метками.
+            annotate: отрисовывать и кодировать аннотированное изображение.
+            annotation_subsampling: субдискретизация цвета JPEG: "444", "422" или "420".
+            encode_original: без детекций возвращать перекодированный оригинал.
+            
+        Returns:
+            DetectionResult со всеми данными детекции.
         """
-        try:
-            # Запуск детекции
-            results = self.model.predict(image_path)
+        return self.analyze_batch(
+            [image],
+            annotation_quality=annotation_quality,
+            use_russian_labels=use_russian_labels,
+            annotate=annotate,
+            annotation_subsampling=annotation_subsampling,
+            encode_original=encode_original
+        )[0]
+
+    def analyze_batch(
+        self,
+        images: List[ImageSource],
+        annotation_quality: int = 98,
+        use_russian_labels: bool = True,
+        annotate: bool = True,
+        annotation_subsampling: str = "444",
+        encode_original: bool = True
+    ) -> List[DetectionResult]:
+        """
+        Прогон модели сразу на нескольких изображениях одним вызовом model.predict.
+        
+        Args:
+            images: пути, байты или BGR-массивы изображений.
+            Остальные параметры - как у analyze().
             
-            has_problem = False
-            max_confidence = 0.0
-            category = "unknown"
-            num_detections = 0
+        Returns:
+            Список DetectionResult в порядке входных изображений.
+        """
+        if not images:
+            return []
+        
+        annotation = dict(
+            annotation_quality=annotation_quality,
+            use_russian_labels=use_russian_labels,
+            annotate=annotate,
+            annotation_subsampling=annotation_subsampling,
+            encode_original=encode_original
+        )
+        params = dict(self.thresholds, tiling=self.tiling_params, **annotation)
+        results: List[Optional[DetectionResult]] = [None] * len(images)
+        frames: Dict[int, np.ndarray] = {}
+        cache_keys: Dict[int, str] = {}
+        
+        # Каждое изображение декодируется ровно один раз (и только при промахе кэша);
+        # тот же массив идет в инференс, отрисовку и кодирование
+        for i, image in enumerate(images):
+            try:
+                data = self._read_image(image)
+                if self.cache is not None:
+                    cache_keys[i] = self.cache.make_key(content_hash(data), self.model_id, params)
+                    cached = self.cache.get(cache_keys[i])
+                    if cached is not None:
+                        results[i] = cached
+                        continue
+                frames[i] = self._load_image(data)
+            except Exception as e:
+                log.error(f"❌ Не удалось декодировать изображение: {e}")
+                results[i] = DetectionResult.error()
+        
+        if frames:
+            try:
+                # Запуск детекции (predictor ultralytics не потокобезопасен)
+                with self._predict_lock:
+                    predictions = self.model.predict(list(frames.values()))
+            except Exception as e:
+                log.exception(f"❌ Ошибка при обработке изображений: {e}")
+                predictions = None
             
-            # Анализ результатов
-            for result in results:
-                if result.boxes is not None and len(result.boxes) > 0:
-                    has_problem = True
-                    num_detections = len(result.boxes)
-                    
-                    for box in result.boxes:
-                        confidence = box.conf[0].item()
-                        if confidence > max_confidence:
-                            max_confidence = confidence
-                    
-                    if num_detections >= 3:
-                        category = "multiple_potholes"
-                    elif max_confidence > 0.8:
-                        category = "pothole"
-                    else:
-                        category = "possible_pothole"
+            for n, (i, frame) in enumerate(frames.items()):
+                if predictions is None:
+                    results[i] = DetectionResult.error()
+                    continue
+                r = predictions[n]
+                xyxy, scores, class_ids = self._box_arrays(r.boxes)
+                if self._needs_tiles(frame, scores):
+                    xyxy, scores, class_ids = self._tiled_pass(frame, xyxy, scores, class_ids)
+                results[i] = self._build_result(frame, xyxy, scores, class_ids, r.names, **annotation)
+                if i in cache_keys and results[i].category != "error":
+                    self.cache.put(cache_keys[i], results[i])
+        
+        return results
+
+    @staticmethod
+    def _read_image(image: ImageSource):
+        """
+        Возвращает закодированные байты (или массив) для хэширования и декодирования.
+        """
+        if isinstance(image, (str, Path)):
+            return Path(image).read_bytes()
+        if isinstance(image, np.ndarray):
+            return np.ascontiguousarray(image)
+        return image
+
+    @staticmethod
+    def _load_image(image: ImageSource) -> np.ndarray:
+        """
+        Приводит вход детектора к BGR-массиву.
+        """
+        if isinstance(image, np.ndarray):
+            return image
+        if isinstance(image, (str, Path)):
+            image = Path(image).read_bytes()
+        frame = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Unsupported or corrupted image")
+        return frame
+
+    @staticmethod
+    def _encode_jpeg(frame: np.ndarray, quality: int, subsampling: str = "444") -> bytes:
+        """
+        Кодирует BGR-массив в JPEG без промежуточной конвертации в PIL.
+        """
+        sampling_factors = {
+            "444": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+            "422": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+            "420": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+        }
+        ok, encoded = cv2.imencode(".jpg", frame, [
+            cv2.IMWRITE_JPEG_QUALITY, quality,
+            cv2.IMWRITE_JPEG_SAMPLING_FACTOR, sampling_factors[subsampling]
+        ])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return encoded.tobytes()
+
+    def _build_result(
+        self,
+        frame: np.ndarray,
+        xyxy: np.ndarray,
+        scores: np.ndarray,
+        class_ids: np.ndarray,
+        names: Dict[int, str],
+        annotation_quality: int,
+        use_russian_labels: bool,
+        annotate: bool,
+        annotation_subsampling: str,
+        encode_original: bool
+    ) -> DetectionResult:
+        """
+        Постобработка детекций для одного изображения.
+        """
+        try:
+            result = self._summarize(xyxy, scores, class_ids)
+            result.image_size = (frame.shape[1], frame.shape[0])
+            result.model_version = self.model_version
+            num_detections = result.detection_count
             
             # Создаем аннотированное изображение
-            annotated_image_base64 = None
-            if has_problem and len(results) > 0:
-                # ⭐ НОВОЕ: Отрисовываем БЕЗ меток (только bbox)
-                annotated_frame = results[0].plot(
-                    labels=False,  # ⭐ Отключаем метки!
-                    conf=False,    # ⭐ Отключаем confidence!
-                    line_width=1,  # Толщина линий bbox
-                    boxes=True     # Оставляем bbox
-                )
+            if not annotate:
+                return result
+            if result.has_problem:
+                # Отрисовываем БЕЗ меток (только bbox)
+                annotated_frame = self._draw_boxes(frame, result.boxes, result.class_ids)
                 
-                # ⭐ Добавляем русские метки
+                # Добавляем русские метки
                 if use_russian_labels:
-                    annotated_frame = self.replace_labels_with_russian(annotated_frame, results)
+                    self._draw_labels(annotated_frame, result.boxes, result.class_ids, names)
                 
-                # Конвертируем в RGB для PIL
-                annotated_frame_rgb = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
-                pil_image = Image.fromarray(annotated_frame_rgb)
-                
-                # Сохраняем с высоким качеством
-                buffered = BytesIO()
-                pil_image.save(
-                    buffered, 
-                    format="JPEG", 
-                    quality=annotation_quality,
-                    optimize=False,
-                    subsampling=0
+                result.annotated_jpeg = self._encode_jpeg(
+                    annotated_frame, annotation_quality, annotation_subsampling
                 )
-                annotated_image_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
                 
-                log.info(f"✅ Обнаружено {num_detections} ям с максимальной уверенностью {max_confidence:.2f}")
-                log.info(f"📊 Размер изображения: {len(buffered.getvalue()) / 1024:.2f} KB")
+                log.info(f"✅ Обнаружено {num_detections} ям с максимальной уверенностью {result.confidence:.2f}")
+                log.info(f"📊 Размер изображения: {len(result.annotated_jpeg) / 1024:.2f} KB")
             else:
                 # Если проблем не обнаружено, возвращаем исходное изображение
-                original_image = Image.open(image_path)
-                buffered = BytesIO()
-                original_image.save(
-                    buffered, 
-                    format="JPEG", 
-                    quality=annotation_quality,
-                    optimize=False,
-                    subsampling=0
-                )
-                annotated_image_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+                if encode_original:
+                    result.annotated_jpeg = self._encode_jpeg(
+                        frame, annotation_quality, annotation_subsampling
+                    )
                 log.info("ℹ️ Проблемы на изображении не обнаружены")
             
-            return has_problem, max_confidence, category, annotated_image_base64
+            return result
             
         except Exception as e:
             log.exception(f"❌ Ошибка при обработке изображения: {e}")
-            return False, 0.0, "error", None
+            return DetectionResult.error()
 
+    @staticmethod
+    def _box_arrays(boxes) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Переносит xyxy, conf и cls из тензоров в NumPy за один раз.
+        """
+        if boxes is None or len(boxes) == 0:
+            return _empty_boxes(), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32)
+        data = boxes.data.cpu().numpy()  # (N, 6): x1, y1, x2, y2, [track_id,] conf, cls
+        return (
+            data[:, :4].astype(np.float32),
+            data[:, -2].astype(np.float32),
+            data[:, -1].astype(np.int32)
+        )
 
-    def get_detection_details(self, image_path: str) -> Dict[str, Any]:
+    @staticmethod
+    def _draw_boxes(frame: np.ndarray, xyxy: np.ndarray, class_ids: np.ndarray) -> np.ndarray:
+        """
+        Рисует bbox на копии кадра (цвета классов как в ultralytics plot()).
+        """
+        from ultralytics.utils.plotting import colors
+        
+        annotated = frame.copy()
+        for (x1, y1, x2, y2), class_id in zip(xyxy.astype(np.int32).tolist(), class_ids.tolist()):
+            cv2.rectangle(annotated, (x1, y1), (x2, y2), colors(class_id, True), 1, cv2.LINE_AA)
+        return annotated
+
+    def _summarize(self, xyxy: np.ndarray, scores: np.ndarray, class_ids: np.ndarray) -> DetectionResult:
+        """
+        Векторизованная постобработка bbox: сортировка, площади, категория, severity.
+        """
+        order = np.argsort(-scores, kind="stable")
+        xyxy, scores, class_ids = xyxy[order], scores[order], class_ids[order]
+        areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+        
+        result = DetectionResult(boxes=xyxy, scores=scores, class_ids=class_ids, areas=areas)
+        num_detections = int(scores.size)
+        if num_detections == 0:
+            return result
+        
+        result.has_problem = True
+        result.confidence = float(scores[0])
+        
+        if num_detections >= 3:
+            result.category = "multiple_potholes"
+        elif result.confidence > 0.8:
+            result.category = "pothole"
+        else:
+            result.category = "possible_pothole"
+        
+        total_area = float(areas.sum())
+        if num_detections >= 5 or total_area > 50000:
+            result.severity = "critical"
+        elif num_detections >= 3 or total_area > 20000:
+            result.severity = "high"
+        else:
+            result.severity = "medium"
+        
+        return result
+
+    @property
+    def tiling_params(self) -> Dict[str, Any]:
+        return {
+            "mode": settings.AI_TILING,
+            "size": settings.AI_TILE_SIZE,
+            "overlap": settings.AI_TILE_OVERLAP,
+            "max": settings.AI_TILE_MAX,
+            "min_side": settings.AI_TILE_MIN_SIDE,
+            "trigger_conf": settings.AI_TILE_TRIGGER_CONF
+        }
+
+    @staticmethod
+    def _needs_tiles(frame: np.ndarray, scores: np.ndarray) -> bool:
+        """
+        Нужен ли второй, потайловый проход после быстрого прохода по всему кадру.
+        """
+        if settings.AI_TILING == "off" or max(frame.shape[:2]) < settings.AI_TILE_MIN_SIDE:
+            return False
+        if settings.AI_TILING == "always":
+            return True
+        # auto: только если быстрый проход ничего уверенно не нашел
+        return not scores.size or float(scores.max()) < settings.AI_TILE_TRIGGER_CONF
+
+    def _tiled_pass(
+        self,
+        frame: np.ndarray,
+        xyxy: np.ndarray,
+        scores: np.ndarray,
+        class_ids: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Инференс по перекрывающимся тайлам в полном разрешении, слияние с NMS.
+        """
+        height, width = frame.shape[:2]
+        tiles = tile_grid(width, height, settings.AI_TILE_SIZE, settings.AI_TILE_OVERLAP, settings.AI_TILE_MAX)
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles]
+        try:
+            with self._predict_lock:
+                predictions = self.model.predict(crops, verbose=False)
+        except Exception as e:
+            log.exception(f"❌ Ошибка потайлового инференса: {e}")
+            return xyxy, scores, class_ids
+        
+        all_boxes, all_scores, all_classes = [xyxy], [scores], [class_ids]
+        for (x1, y1, _, _), r in zip(tiles, predictions):
+            tile_boxes, tile_scores, tile_classes = self._box_arrays(r.boxes)
+            all_boxes.append(tile_boxes + np.array([x1, y1, x1, y1], dtype=np.float32))
+            all_scores.append(tile_scores)
+            all_classes.append(tile_classes)
+        
+        merged = (np.concatenate(all_boxes), np.concatenate(all_scores), np.concatenate(all_classes))
+        keep = nms(*merged, iou_threshold=settings.AI_TILE_NMS_IOU)
+        log.info(f"🧩 Тайлы: {len(tiles)}, детекций после NMS: {keep.size}")
+        return merged[0][keep], merged[1][keep], merged[2][keep]
+
+    def detect_potholes(
+        self, 
+        image: ImageSource,
+        annotation_quality: int = 98,
+        use_russian_labels: bool = True
+    ) -> Tuple[bool, float, str, Optional[str]]:
+        """
+        Обнаружение ям на изображении.
+        
+        Обертка над analyze(), сохранена для совместимости.
+        """
+        result = self.analyze(
+            image, annotation_quality=annotation_quality, use_russian_labels=use_russian_labels
+        )
+        return result.has_problem, result.confidence, result.category, result.annotated_image
+
+
+    def get_detection_details(self, image: ImageSource) -> Dict[str, Any]:
         """
         Получение детальной информации об обнаружениях.
         
+        Обертка над analyze(); если нужны и категория, и детали,
+        вызывайте analyze() один раз.
+        
         Args:
-            image_path: путь к изображению.
+            image: путь к файлу, байты закодированного изображения или BGR-массив.
             
         Returns:
             Словарь с детальной информацией.
         """
-        try:
-            results = self.model.predict(image_path)
-            
-            detections = []
-            for result in results:
-                if result.boxes is not None:
-                    for i, box in enumerate(result.boxes):
-                        detection = {
-                            "id": i + 1,
-                            "confidence": box.conf[0].item(),
-                            "bbox": box.xyxy[0].tolist(),
-                            "area": float((box.xyxy[0][2] - box.xyxy[0][0]) * (box.xyxy[0][3] - box.xyxy[0][1]))
-                        }
-                        detections.append(detection)
-            
-            detections.sort(key=lambda x: x["confidence"], reverse=True)
-            
-            severity = "none"
-            if detections:
-                total_area = sum(d["area"] for d in detections)
-                if len(detections) >= 5 or total_area > 50000:
-                    severity = "critical"
-                elif len(detections) >= 3 or total_area > 20000:
-                    severity = "high"
-                elif len(detections) >= 1:
-                    severity = "medium"
-            
-            return {
-                "detections": detections,
-                "total_count": len(detections),
-                "severity": severity,
-                "avg_confidence": np.mean([d["confidence"] for d in detections]) if detections else 0
-            }
-            
-        except Exception as e:
-            log.exception(f"❌ Ошибка при получении деталей: {e}")
-            return {
-                "detections": [],
-                "total_count": 0,
-                "severity": "error",
-                "avg_confidence": 0
-            }
+        return self.analyze(image, annotate=False).details()
 
 _detector = None
+_detector_lock = threading.Lock()
 
 def get_ai_detector(model_path: str = None):
     """
@@ -348,5 +784,34 @@ def get_ai_detector(model_path: str = None):
     """
     global _detector
     if _detector is None:
-        _detector = AIPotholeDetector(model_path)
-    return _detector
\ No newline at end of file
+        with _detector_lock:
+            if _detector is None:
+                _detector = AIPotholeDetector(model_path)
+    return _detector
+
+
+def prefetch_artifacts():
+    """
+    Скачивает модель по умолчанию и шрифт в AI_ARTIFACT_DIR для запуска с AI_OFFLINE=true.
+    """
+    from huggingface_hub import hf_hub_download
+    
+    target = AIPotholeDetector._artifact_model_path()
+    target.parent.mkdir(parents=True, exist_ok=True)
+    hf_hub_download(
+        repo_id=AIPotholeDetector.DEFAULT_MODEL_ID,
+        filename="best.pt",
+        local_dir=str(target.parent)
+    )
+    log.info(f"✅ Модель сохранена: {target}")
+    AIPotholeDetector._fetch_font()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Артефакты AI детектора")
+    parser.add_argument("command", choices=["prefetch"])
+    parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    prefetch_artifacts()
@@ -1,5 +1,8 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
@@ -9,7 +12,10 @@ from sqlalchemy.future import select
 from database import get_db
 from models import User
 from config import settings
+import asyncio
 import bcrypt
+import threading
+import time
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -20,6 +26,7 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Verifies a plain password against a bcrypt hash.
 
     Truncates the password to 72 bytes to comply with bcrypt limit.
+    Blocking: use check_password() from async code.
     """
     # Ограничение bcrypt: только первые 72 байта учитываются
     truncated_password = plain_password.encode('utf-8')[:72]
@@ -30,6 +37,45 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
     return bcrypt.checkpw(truncated_password, hashed_password)
 
+class PasswordHashingBusy(Exception):
+    """Слишком много ожидающих bcrypt-операций; API отвечает 503"""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Password hashing is overloaded")
+        self.retry_after = retry_after
+
+# bcrypt отпускает GIL: отдельный ограниченный пул, чтобы вход не занимал
+# event loop и не конкурировал с пулом по умолчанию (файлы, миниатюры)
+_hash_pool = ThreadPoolExecutor(max_workers=settings.AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_pending = 0
+
+async def _run_hashing(fn, *args):
+    global _hash_pending
+    if _hash_pending >= settings.AUTH_HASH_MAX_PENDING:
+        raise PasswordHashingBusy()
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, fn, *args)
+    finally:
+        _hash_pending -= 1
+
+async def hash_password(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+def needs_rehash(hashed_password) -> bool:
+    """
+    True, если хэш посчитан с другой стоимостью, чем BCRYPT_ROUNDS.
+    """
+    if isinstance(hashed_password, bytes):
+        hashed_password = hashed_password.decode('utf-8')
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -40,6 +86,77 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
+@dataclass(frozen=True)
+class Principal:
+    """Аутентифицированный пользователь: только то, что нужно для авторизации"""
+    id: int
+    username: str
+    role: str
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, username=user.username, role=user.role, is_active=bool(user.is_active))
+
+
+class PrincipalCache:
+    """
+    TTL/LRU-кэш Principal по sub токена: повторные запросы не ходят в БД.
+    
+    Кэш живет в процессе: изменения пользователя сбрасывают запись через
+    invalidate_principal(), в других процессах - не позже, чем через ttl.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at <= time.monotonic():
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return principal
+
+    def put(self, principal: Principal):
+        with self._lock:
+            self._entries[principal.username] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(principal.username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None):
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+
+_principal_cache = PrincipalCache(max_entries=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+def invalidate_principal(username: Optional[str] = None):
+    """
+    Сброс кэша после изменения пользователя (роль, активность, удаление).
+    """
+    _principal_cache.invalidate(username)
+
+def principal_claims(user: User) -> Dict[str, object]:
+    """
+    Подписанные claims uid/role для токена (AUTH_TOKEN_CLAIMS): get_current_user
+    обходится без БД. Смена роли или деактивация вступают в силу по истечении токена.
+    """
+    if not settings.AUTH_TOKEN_CLAIMS:
+        return {}
+    return {"uid": user.id, "role": user.role}
+
 async def get_user_by_username(db: AsyncSession, username: str):
     result = await db.execute(select(User).filter(User.username == username))
     return result.scalar_one_or_none()
@@ -48,8 +165,12 @@ async def authenticate_user(db: AsyncSession, username: str, password: str):
     user = await get_user_by_username(db, username)
     if user is None:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await check_password(password, user.hashed_password):
         return None
+    if needs_rehash(user.hashed_password):
+        # Стоимость bcrypt изменилась - прозрачно обновляем хэш
+        user.hashed_password = await hash_password(password)
+        await db.commit()
     return user
 
 
@@ -71,12 +192,26 @@ async def get_current_user(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = await get_user_by_username(db, username=username)
-    if user is None:
-        raise credentials_exception
-    return user
+    
+    if settings.AUTH_TOKEN_CLAIMS and "uid" in payload and "role" in payload:
+        # Токен выдан с подписанными claims - БД не нужна
+        return Principal(id=payload["uid"], username=username, role=payload["role"], is_active=True)
+    
+    principal = _principal_cache.get(username)
+    if principal is None:
+        user = await get_user_by_username(db, username=username)
+        if user is None:
+            raise credentials_exception
+        principal = Principal.from_user(user)
+        _principal_cache.put(principal)
+    
+    if not principal.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+    return principal
 
 # Функция для получения токена (если вам все же нужна отдельная функция)
-def get_password_hash(password: str):
-    return bcrypt.hashpw(password.encode('utf-8')[:72], bcrypt.gensalt())
+def get_password_hash(password: str) -> str:
+    """Blocking: use hash_password() from async code."""
+    hashed = bcrypt.hashpw(password.encode('utf-8')[:72], bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS))
+    return hashed.decode('utf-8')
 
@@ -0,0 +1,533 @@
+"""
+Массовый импорт обращений и пересчет AI-категорий.
+
+Импорт: манифест CSV/JSONL (колонки image, lat, lon, [description],
+[category], [user_id]) + каталог или zip с изображениями. Строки читаются
+потоково, вставляются пачками (executemany) по одной транзакции на пачку,
+AI-категоризация идет батчами. После каждой пачки пишется чекпоинт, так что
+прерванный импорт продолжается с места остановки (пачка, вставленная перед
+сбоем, но не попавшая в чекпоинт, при продолжении не дублируется).
+
+Миниатюры и варианты изображений импортированных обращений строит фоновый
+воркер (задачи kind='media', ставятся вместе с пачкой); для обращений без
+вариантов или хэша, созданных раньше, задачи ставит команда media.
+
+    python bulk_import.py import reports.csv --images photos.zip --user admin
+    python bulk_import.py rescore
+    python bulk_import.py media
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import zipfile
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import bindparam, exists, insert, or_, tuple_, update
+from sqlalchemy.future import select
+
+from ai_executor import InferenceQueueFull
+from config import settings
+from crud import complaints_changed
+from database import AsyncSessionLocal
+from dedup import perceptual_hash
+from models import Complaint, ComplaintJob, User
+from storage import read_file, safe_extension, save_content_addressed
+
+log = logging.getLogger(__name__)
+
+# async (список байтов изображений) -> список DetectionResult
+InferFn = Callable[[List[bytes]], Awaitable[List[Any]]]
+
+
+@dataclass
+class ImportProgress:
+    """Состояние импорта, сохраняемое в чекпоинт"""
+    source: str
+    rows_done: int = 0
+    inserted: int = 0
+    rescored: int = 0
+    media_queued: int = 0
+    last_id: int = 0  # для rescore: последний обработанный id
+    errors: int = 0
+    error_samples: List[str] = field(default_factory=list)
+    state: str = "running"  # running, done, failed
+    updated_at: Optional[str] = None
+
+    def error(self, message: str):
+        self.errors += 1
+        if len(self.error_samples) < 20:
+            self.error_samples.append(message)
+
+
+class Checkpoint:
+    def __init__(self, path: Optional[str]):
+        self.path = Path(path) if path else None
+
+    def load(self, source: str) -> ImportProgress:
+        if self.path and self.path.exists():
+            data = json.loads(self.path.read_text())
+            if data.get("source") == source and data.get("state") != "done":
+                log.info(f"↩️ Продолжаем с чекпоинта {self.path}: {data['rows_done']} строк")
+                return ImportProgress(**data)
+        return ImportProgress(source=source)
+
+    def save(self, progress: ImportProgress):
+        if not self.path:
+            return
+        progress.updated_at = datetime.utcnow().isoformat()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(asdict(progress), ensure_ascii=False))
+        os.replace(tmp_path, self.path)
+
+
+class ImageSource:
+    """
+    Изображения из каталога или zip-архива; размер изображения ограничен
+    max_bytes (по умолчанию MAX_UPLOAD_BYTES), в том числе после распаковки.
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes or settings.MAX_UPLOAD_BYTES
+        self._zip = zipfile.ZipFile(self.path) if zipfile.is_zipfile(self.path) else None
+
+    def read(self, name: str) -> bytes:
+        if self._zip is not None:
+            info = self._zip.getinfo(name)
+            if info.file_size > self.max_bytes:
+                raise ValueError(f"Image is too large: {name}")
+            # Заголовок архива может врать: читаем не больше лимита
+            with self._zip.open(info) as f:
+                content = f.read(self.max_bytes + 1)
+        else:
+            target = (self.path / name).resolve()
+            if self.path.resolve() not in target.parents:
+                raise ValueError(f"Image path escapes image directory: {name}")
+            if target.stat().st_size > self.max_bytes:
+                raise ValueError(f"Image is too large: {name}")
+            content = target.read_bytes()
+        if len(content) > self.max_bytes:
+            raise ValueError(f"Image is too large: {name}")
+        return content
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def iter_manifest(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Потоковое чтение манифеста CSV или JSONL.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def _chunks(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _prepare_chunk(rows: List[Dict[str, Any]], images: ImageSource, default_user_id: int, progress: ImportProgress):
+    """
+    Читает изображения пачки и сохраняет их в uploads (синхронно, вызывается в потоке).
+    
+    Returns:
+        (строки для вставки, байты изображений) - только валидные строки.
+    """
+    records, contents = [], []
+    for row in rows:
+        try:
+            name = row["image"]
+            content = images.read(name)
+            extension = safe_extension(name)
+            try:
+                # Сразу кандидат поиска дубликатов (crud.find_duplicate)
+                image_hash = perceptual_hash(content)
+            except Exception:
+                image_hash = None
+            records.append({
+                "user_id": int(row.get("user_id") or default_user_id),
+                "image_path": save_content_addressed(content, settings.IMPORT_UPLOAD_DIR, extension),
+                "description": row.get("description") or None,
+                "lat": float(row["lat"]),
+                "lon": float(row["lon"]),
+                "category": row.get("category") or None,
+                "status": "pending",
+                "image_hash": image_hash,
+            })
+            contents.append(content)
+        except Exception as e:
+            progress.error(f"{row.get('image')}: {e}")
+    return records, contents
+
+
+async def _infer_in_batches(
+    infer: InferFn,
+    contents: List[bytes],
+    batch_size: int,
+    busy_retries: int = 10,
+    max_delay: float = 60.0
+) -> List[Any]:
+    """
+    Инференс батчами. Общий пул инференса может быть занят запросами API:
+    InferenceQueueFull повторяется с экспоненциальной задержкой.
+    """
+    results = []
+    for start in range(0, len(contents), batch_size):
+        batch = contents[start:start + batch_size]
+        for attempt in range(busy_retries + 1):
+            try:
+                results.extend(await infer(batch))
+                break
+            except InferenceQueueFull as e:
+                if attempt == busy_retries:
+                    raise
+                delay = min(max_delay, e.retry_after * 2 ** attempt)
+                log.info(f"⏳ Пул инференса занят, повтор через {delay:.0f} с")
+                await asyncio.sleep(delay)
+    return results
+
+
+async def _drop_already_inserted(records: List[Dict[str, Any]], since: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Убирает строки, уже вставленные до сбоя: пачка коммитится раньше, чем
+    пишется чекпоинт. Проверяется только первая пачка после продолжения,
+    среди обращений не старше предыдущего сохранения чекпоинта.
+    """
+    if not records:
+        return records
+    query = select(Complaint.image_path, Complaint.lat, Complaint.lon).where(
+        tuple_(Complaint.image_path, Complaint.lat, Complaint.lon).in_(
+            [(record["image_path"], record["lat"], record["lon"]) for record in records]
+        )
+    )
+    if since:
+        # Запас на разницу часов/часовых поясов приложения и СУБД
+        query = query.where(Complaint.created_at >= datetime.fromisoformat(since) - timedelta(days=1))
+    async with AsyncSessionLocal() as db:
+        existing = set((await db.execute(query)).all())
+    kept = [record for record in records if (record["image_path"], record["lat"], record["lon"]) not in existing]
+    if len(kept) < len(records):
+        log.info(f"↩️ Пропущено уже вставленных строк: {len(records) - len(kept)}")
+    return kept
+
+
+def _apply_ai(record: Dict[str, Any], result) -> Dict[str, Any]:
+    if result.category == "error":
+        return record
+    if not record.get("category") and result.has_problem:
+        record["category"] = result.category
+        record["ai_confidence"] = result.confidence
+    record["ai_severity"] = result.severity
+    record["ai_model"] = result.model_version
+    return record
+
+
+async def import_manifest(
+    manifest: str,
+    images_path: str,
+    user_id: int,
+    infer: Optional[InferFn],
+    chunk_size: int = 500,
+    ai_batch_size: int = 16,
+    checkpoint: Optional[str] = None
+) -> ImportProgress:
+    """
+    Импорт манифеста; resumable через чекпоинт.
+    
+    Args:
+        manifest: путь к CSV/JSONL.
+        images_path: каталог или zip с изображениями.
+        user_id: автор обращений, если в строке нет user_id.
+        infer: батчевый инференс; None - без AI-категоризации.
+        chunk_size: строк на транзакцию.
+        ai_batch_size: изображений на один вызов инференса.
+        checkpoint: путь к файлу чекпоинта.
+    """
+    store = Checkpoint(checkpoint)
+    progress = store.load(os.path.abspath(manifest))
+    # Продолжение прерванного импорта: чекпоинт уже сохранялся
+    resumed_since = progress.updated_at
+    progress.state = "running"
+    store.save(progress)
+    images = ImageSource(images_path)
+    keys = ("user_id", "image_path", "description", "lat", "lon", "category",
+            "status", "ai_confidence", "ai_severity", "ai_model", "image_hash")
+    try:
+        rows = iter_manifest(manifest)
+        # Пропускаем уже импортированные строки
+        for _ in range(progress.rows_done):
+            next(rows, None)
+        
+        for chunk in _chunks(rows, chunk_size):
+            records, contents = await asyncio.to_thread(_prepare_chunk, chunk, images, user_id, progress)
+            if resumed_since is not None:
+                kept = {id(record) for record in await _drop_already_inserted(records, resumed_since)}
+                contents = [content for record, content in zip(records, contents) if id(record) in kept]
+                records = [record for record in records if id(record) in kept]
+                resumed_since = None
+            if infer is not None and contents:
+                results = await _infer_in_batches(infer, contents, ai_batch_size)
+                records = [_apply_ai(record, result) for record, result in zip(records, results)]
+            
+            if records:
+                # executemany: одинаковый набор ключей для всех строк
+                records = [{key: record.get(key) for key in keys} for record in records]
+                async with AsyncSessionLocal() as db:
+                    complaint_ids = (await db.execute(insert(Complaint).returning(Complaint.id), records)).scalars().all()
+                    # Варианты изображений строит воркер, в той же транзакции
+                    await db.execute(insert(ComplaintJob), [
+                        {"complaint_id": complaint_id, "kind": "media", "state": "queued", "attempts": 0}
+                        for complaint_id in complaint_ids
+                    ])
+                    await db.commit()
+                progress.media_queued += len(complaint_ids)
+                complaints_changed(*((record["lat"], record["lon"]) for record in records))
+            
+            progress.rows_done += len(chunk)
+            progress.inserted += len(records)
+            store.save(progress)
+            log.info(f"📥 Импортировано {progress.inserted} (строк обработано: {progress.rows_done})")
+        
+        progress.state = "done"
+    except Exception as e:
+        progress.state = "failed"
+        progress.error(str(e))
+        raise
+    finally:
+        images.close()
+        store.save(progress)
+    return progress
+
+
+async def rescore_complaints(
+    infer: InferFn,
+    model_version: str,
+    chunk_size: int = 200,
+    ai_batch_size: int = 16,
+    rescore_all: bool = False,
+    checkpoint: Optional[str] = None
+) -> ImportProgress:
+    """
+    Пересчитывает AI-поля обращений, посчитанных другой моделью.
+    
+    Категория перезаписывается только если она была AI-шной (есть ai_confidence)
+    или отсутствовала.
+    """
+    store = Checkpoint(checkpoint)
+    progress = store.load(f"rescore:{model_version}:{rescore_all}")
+    stale = or_(Complaint.ai_model.is_(None), Complaint.ai_model != model_version)
+    
+    update_stmt = (
+        update(Complaint)
+        .where(Complaint.id == bindparam("complaint_id"))
+        .values(
+            category=bindparam("new_category"),
+            ai_confidence=bindparam("new_confidence"),
+            ai_severity=bindparam("new_severity"),
+            ai_model=bindparam("new_model")
+        )
+    )
+    
+    try:
+        while True:
+            # Keyset по id: без OFFSET и без повторной выборки обработанного
+            async with AsyncSessionLocal() as db:
+                query = (
+                    select(
+                        Complaint.id, Complaint.image_path, Complaint.category, Complaint.ai_confidence,
+                        Complaint.lat, Complaint.lon
+                    )
+                    .where(Complaint.id > progress.last_id)
+                    .order_by(Complaint.id)
+                    .limit(chunk_size)
+                )
+                if not rescore_all:
+                    query = query.where(stale)
+                rows = (await db.execute(query)).all()
+            if not rows:
+                break
+            
+            readable, contents = [], []
+            for row in rows:
+                try:
+                    contents.append(await asyncio.to_thread(read_file, row.image_path))
+                    readable.append(row)
+                except Exception as e:
+                    progress.error(f"complaint {row.id}: {e}")
+            
+            results = await _infer_in_batches(infer, contents, ai_batch_size)
+            params, changed = [], []
+            for row, result in zip(readable, results):
+                if result.category == "error":
+                    progress.error(f"complaint {row.id}: AI detection failed")
+                    continue
+                ai_owned = row.category is None or row.ai_confidence is not None
+                params.append({
+                    "complaint_id": row.id,
+                    "new_category": (result.category if result.has_problem else None) if ai_owned else row.category,
+                    "new_confidence": (result.confidence if result.has_problem else None) if ai_owned else row.ai_confidence,
+                    "new_severity": result.severity,
+                    "new_model": result.model_version,
+                })
+                if params[-1]["new_category"] != row.category:
+                    changed.append((row.lat, row.lon))
+            
+            if params:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(update_stmt, params)
+                    await db.commit()
+            # Кластеры и тайлы карты считаются по категории
+            if changed:
+                complaints_changed(*changed)
+            
+            progress.last_id = rows[-1].id
+            progress.rows_done += len(rows)
+            progress.rescored += len(params)
+            store.save(progress)
+            log.info(f"🔁 Пересчитано {progress.rescored} (последний id {progress.last_id})")
+        
+        progress.state = "done"
+    except Exception as e:
+        progress.state = "failed"
+        progress.error(str(e))
+        raise
+    finally:
+        store.save(progress)
+    return progress
+
+
+async def queue_media_jobs(chunk_size: int = 1000, checkpoint: Optional[str] = None) -> ImportProgress:
+    """
+    Ставит задачи kind='media' обращениям без вариантов изображения или
+    перцептивного хэша (созданным до появления вариантов/поиска дубликатов),
+    если у них еще нет незавершенной задачи.
+    """
+    store = Checkpoint(checkpoint)
+    progress = store.load("media")
+    # thumbnail_path заполняется вместе с image_variants (JSON null != SQL NULL)
+    missing = or_(Complaint.thumbnail_path.is_(None), Complaint.image_hash.is_(None))
+    pending_job = exists().where(
+        ComplaintJob.complaint_id == Complaint.id,
+        ComplaintJob.state.in_(["queued", "running"])
+    )
+    try:
+        while True:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(Complaint.id)
+                    .where(Complaint.id > progress.last_id, Complaint.image_path.isnot(None), missing, ~pending_job)
+                    .order_by(Complaint.id)
+                    .limit(chunk_size)
+                )).scalars().all()
+                if not rows:
+                    break
+                await db.execute(insert(ComplaintJob), [
+                    {"complaint_id": complaint_id, "kind": "media", "state": "queued", "attempts": 0}
+                    for complaint_id in rows
+                ])
+                await db.commit()
+            
+            progress.last_id = rows[-1]
+            progress.media_queued += len(rows)
+            store.save(progress)
+            log.info(f"🖼️ Поставлено задач изображений: {progress.media_queued}")
+        
+        progress.state = "done"
+    except Exception as e:
+        progress.state = "failed"
+        progress.error(str(e))
+        raise
+    finally:
+        store.save(progress)
+    return progress
+
+
+def local_detector_infer() -> InferFn:
+    """
+    Батчевый инференс в текущем процессе (для CLI).
+    """
+    from ai_processor import get_ai_detector
+    
+    detector = get_ai_detector(settings.AI_MODEL_PATH)
+    
+    async def infer(contents: List[bytes]):
+        return await asyncio.to_thread(detector.analyze_batch, contents, annotate=False)
+    
+    return infer
+
+
+async def _resolve_user_id(username: str) -> int:
+    async with AsyncSessionLocal() as db:
+        user_id = (await db.execute(select(User.id).where(User.username == username))).scalar_one_or_none()
+    if user_id is None:
+        raise SystemExit(f"User not found: {username}")
+    return user_id
+
+
+async def _main(args):
+    if args.command == "media":
+        progress = await queue_media_jobs(args.chunk_size, checkpoint=args.checkpoint)
+    elif args.command == "import":
+        infer = None if args.no_ai else local_detector_infer()
+        progress = await import_manifest(
+            args.manifest, args.images, await _resolve_user_id(args.user), infer,
+            chunk_size=args.chunk_size, ai_batch_size=args.ai_batch_size,
+            checkpoint=args.checkpoint or f"{args.manifest}.checkpoint.json"
+        )
+    else:
+        from ai_processor import get_ai_detector
+        infer = local_detector_infer()
+        progress = await rescore_complaints(
+            infer, get_ai_detector().model_version,
+            chunk_size=args.chunk_size, ai_batch_size=args.ai_batch_size,
+            rescore_all=args.all, checkpoint=args.checkpoint or "rescore.checkpoint.json"
+        )
+    print(json.dumps(asdict(progress), ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт и пересчет обращений")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    import_parser = sub.add_parser("import", help="Импорт манифеста CSV/JSONL")
+    import_parser.add_argument("manifest")
+    import_parser.add_argument("--images", required=True, help="Каталог или zip с изображениями")
+    import_parser.add_argument("--user", required=True, help="Пользователь-автор по умолчанию")
+    import_parser.add_argument("--no-ai", action="store_true", help="Без AI-категоризации")
+    
+    rescore_parser = sub.add_parser("rescore", help="Пересчитать AI-поля текущей моделью")
+    rescore_parser.add_argument("--all", action="store_true", help="Включая уже посчитанные текущей моделью")
+    
+    media_parser = sub.add_parser("media", help="Поставить построение вариантов изображений и хэша для старых обращений")
+    
+    for sub_parser in (import_parser, rescore_parser, media_parser):
+        sub_parser.add_argument("--chunk-size", type=int, default=500)
+        sub_parser.add_argument("--ai-batch-size", type=int, default=16)
+        sub_parser.add_argument("--checkpoint")
+    
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Проверка планов запросов crud и выборки задач воркером: падает, если запрос
+к complaints/complaint_jobs деградировал до сканирования таблицы или
+сортировки во временном B-дереве.
+
+Горячие запросы (списки с фильтром, карта в bbox, дельты, поиск дубликатов,
+выборка задач) не должны содержать SCAN вовсе, даже по индексу; SCAN по
+индексу допустим только для выгрузок всей таблицы (get_all_complaints, карта
+без bbox).
+
+Запускается тестом tests/test_query_plans.py на свежей SQLite-базе
+(create_all + миграции) или вручную, в том числе для PostgreSQL:
+
+    python check_query_plans.py
+    python check_query_plans.py --database-url postgresql+asyncpg://...
+
+Для PostgreSQL используется EXPLAIN с enable_seqscan=off: на маленьких
+таблицах планировщик иначе выбирает Seq Scan даже при наличии индекса.
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from database import create_engine_for
+from jobs import ComplaintJobWorker
+from migrations import run_migrations
+from geo import BBox
+from models import Base
+
+# Признаки регрессии в строках плана
+SQLITE_BAD_PLAN = [
+    re.compile(r"^SCAN (complaints|complaint_jobs)$"),  # без USING INDEX
+    re.compile(r"USE TEMP B-TREE FOR ORDER BY"),
+]
+# Для горячих запросов - любой SCAN, в том числе полный обход индекса
+SQLITE_HOT_BAD_PLAN = SQLITE_BAD_PLAN + [
+    re.compile(r"^SCAN (complaints|complaint_jobs)\b"),
+]
+POSTGRES_BAD_PLAN = [
+    re.compile(r"Seq Scan on (complaints|complaint_jobs)"),
+    re.compile(r"^\s*(->\s*)?Sort\b"),
+]
+
+
+async def run_crud_queries(db: AsyncSession, hot: List[bool]):
+    """
+    Вызывает запросы crud, планы которых проверяются; hot[0] - признак
+    горячих запросов для захваченных в этот момент выражений.
+    """
+    # Выгрузки всей таблицы: обход индекса в порядке сортировки ожидаем
+    hot[0] = False
+    await crud.get_all_complaints(db, limit=20)
+    await crud.get_complaints_for_map(db)
+    
+    hot[0] = True
+    await crud.get_user_complaints(db, user_id=1, limit=20)
+    await crud.get_admin_complaints(db, status="pending", limit=20)
+    await crud.get_admin_complaints(db, limit=20)
+    await crud.get_complaints_for_map(
+        db, BBox(37.5, 55.7, 37.7, 55.8), crud.map_filters(status=["pending"]), limit=100
+    )
+    await crud.get_map_sync_state(db)
+    await crud.get_map_delta(db, datetime(2024, 1, 1), BBox(37.5, 55.7, 37.7, 55.8), crud.map_filters(status=["pending"]))
+    await crud.find_duplicate(db, 55.75, 37.61, "0f0f0f0f0f0f0f0f")
+    await crud.get_complaint(db, 1)
+    await crud.get_complaint_job(db, 1)
+    
+    cursor = crud.encode_cursor(SimpleNamespace(created_at=datetime(2024, 1, 1), id=10))
+    await crud.get_admin_complaints(db, status="pending", limit=20, cursor=cursor)
+    await crud.get_user_complaints(db, user_id=1, limit=20, cursor=cursor)
+    
+    # Выборка задач воркером (ComplaintJobWorker._claim)
+    worker = ComplaintJobWorker()
+    now = datetime(2024, 1, 1)
+    for query in worker.claim_candidate_queries(now):
+        await db.execute(query)
+    await db.execute(worker.claim_update(1, now))
+    await db.rollback()
+
+
+async def check(database_url: str) -> List[Tuple[str, List[str]]]:
+    engine = create_engine_for(database_url, echo=False)
+    dialect = engine.dialect.name
+    captured = []
+    hot = [True]
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE")) and "complaint" in statement and "sqlite_master" not in statement:
+            captured.append((statement, parameters, hot[0]))
+    
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
+    
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    async with sessionmaker(engine, class_=AsyncSession)() as db:
+        await run_crud_queries(db, hot)
+    event.remove(engine.sync_engine, "before_cursor_execute", capture)
+    
+    failures = []
+    async with engine.connect() as conn:
+        if dialect == "postgresql":
+            await conn.execute(text("SET enable_seqscan = off"))
+        for statement, parameters, is_hot in captured:
+            prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+            rows = (await conn.exec_driver_sql(prefix + statement, parameters)).all()
+            plan = [row[-1] for row in rows]
+            if dialect == "sqlite":
+                patterns = SQLITE_HOT_BAD_PLAN if is_hot else SQLITE_BAD_PLAN
+            else:
+                patterns = POSTGRES_BAD_PLAN
+            bad = [line for line in plan if any(p.search(line) for p in patterns)]
+            if any("VIRTUAL TABLE" in line for line in plan):
+                # Выборка по R*Tree ограничена bbox: сортировка результата допустима
+                bad = [line for line in bad if "TEMP B-TREE" not in line]
+            status = "FAIL" if bad else ("ok" if is_hot else "ok, full")
+            print(f"[{status}] {' '.join(statement.split())[:120]}")
+            for line in plan:
+                print(f"       {line}")
+            if bad:
+                failures.append((statement, bad))
+    await engine.dispose()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов запросов complaints")
+    parser.add_argument("--database-url", help="По умолчанию - временная SQLite-база")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(tmp_dir, 'plans.db')}"
+        failures = asyncio.run(check(url))
+    
+    if failures:
+        print(f"❌ {len(failures)} запрос(ов) с полным сканированием")
+        sys.exit(1)
+    print("✅ Все запросы используют индексы")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,131 @@ from typing import Optional
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite+aiosqlite:///./complaints.db"
+    DB_ECHO: bool = False  # логировать каждый SQL-запрос (только для отладки)
+    # Профиль PostgreSQL (asyncpg)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800  # секунды
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100  # 0 при pgbouncer в transaction mode
+    # Профиль SQLite
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
     SECRET_KEY: str = "your-secret-key-here"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    AUTH_CACHE_TTL: float = 60  # секунды жизни записи кэша пользователей в get_current_user
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_TOKEN_CLAIMS: bool = False  # uid/role в токене, get_current_user без БД
+    BCRYPT_ROUNDS: int = 12  # при изменении хэши обновляются при следующем входе
+    AUTH_HASH_WORKERS: int = 2  # потоки bcrypt (вне event loop)
+    AUTH_HASH_MAX_PENDING: int = 64  # больше ожидающих хэширования - 503
+    LOGIN_RATE_WINDOW: float = 60  # секунды
+    LOGIN_RATE_PER_IP: int = 20  # попыток входа/регистрации с IP за окно
+    LOGIN_FAILURES_PER_USER: int = 5  # неудачных попыток на пользователя за окно
     AI_MODEL_PATH: str = "Yolov8-fintuned-on-potholes.pt"
+    MAX_UPLOAD_BYTES: int = 20 * 1024 * 1024
+    
+    # Бэкенд инференса: 'torch', 'onnx', 'openvino' или 'torchscript'.
+    # Не-torch модели экспортируются из AI_MODEL_PATH один раз и кэшируются в AI_EXPORT_DIR.
+    AI_BACKEND: str = "torch"
+    AI_EXPORT_DIR: str = "./artifacts/exported"
+    AI_IMGSZ: int = 640
+    
+    # Офлайн-старт: модель и шрифт только из локального кэша артефактов
+    # (заполняется `python ai_processor.py prefetch`), без обращений к сети
+    AI_OFFLINE: bool = False
+    AI_ARTIFACT_DIR: str = "./artifacts"
+    AI_FONT_PATH: Optional[str] = None
+    AI_WARMUP: bool = True
+    
+    # Потайловый инференс для фото высокого разрешения: 'off', 'auto'
+    # (тайлы только если быстрый проход ничего уверенно не нашел) или 'always'
+    AI_TILING: str = "off"
+    AI_TILE_SIZE: int = 640
+    AI_TILE_OVERLAP: float = 0.2
+    AI_TILE_MAX: int = 16  # потолок CPU-времени на изображение
+    AI_TILE_MIN_SIDE: int = 1600  # меньшие изображения не режутся
+    AI_TILE_TRIGGER_CONF: float = 0.5
+    AI_TILE_NMS_IOU: float = 0.5
+    
+    # Пул инференса: 'thread' или 'process' (каждый процесс загружает модель один раз)
+    AI_EXECUTOR: str = "thread"
+    AI_WORKERS: int = 1
+    AI_QUEUE_SIZE: int = 8  # Сколько задач может ждать сверх AI_WORKERS
+    AI_RETRY_AFTER: int = 5  # Секунды для заголовка Retry-After при переполнении
+    
+    # Микро-батчинг: запросы, пришедшие в пределах окна, идут одним model.predict.
+    # AI_BATCH_MAX_SIZE=1 отключает батчинг.
+    AI_BATCH_WINDOW_MS: int = 10
+    AI_BATCH_MAX_SIZE: int = 1
+    
+    # Кэш результатов детекции по хэшу содержимого
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    AI_CACHE_TTL: int = 3600  # секунды
+    AI_CACHE_DIR: Optional[str] = None  # дисковый уровень, например "./cache/detections"
+    
+    # Аннотированное изображение в /ai/detect: 'base64', 'url', 'binary' или 'none' (только bbox)
+    AI_ANNOTATION_MODE: str = "base64"
+    AI_ANNOTATION_QUALITY: int = 85
+    AI_ANNOTATION_SUBSAMPLING: str = "420"  # '444', '422' или '420'
+    AI_ANNOTATION_DIR: str = "uploads/annotated"  # логический путь в хранилище (раздается GET /uploads)
+    # Производные изображения (media.build_image_variants), строятся воркером
+    IMAGE_VARIANTS: str = "thumbnail:320,medium:1280,original:0"  # имя:макс. сторона (0 - исходный размер)
+    IMAGE_VARIANT_FORMATS: str = "webp,jpeg"
+    IMAGE_VARIANT_QUALITY: int = 80
+    IMAGE_VARIANTS_DIR: str = "uploads/variants"
+    
+    # Хранилище файлов (storage.py): 'local', 's3' (нужен boto3) или 'memory'
+    STORAGE_BACKEND: str = "local"
+    STORAGE_LOCAL_ROOT: str = "uploads"
+    STORAGE_CHUNK_SIZE: int = 1024 * 1024
+    UPLOAD_ORIGINALS_DIR: str = "uploads/originals"
+    UPLOAD_CACHE_MAX_AGE: int = 365 * 24 * 3600  # файлы content-addressed, не меняются
+    S3_BUCKET: Optional[str] = None
+    S3_PREFIX: str = ""
+    S3_ENDPOINT_URL: Optional[str] = None  # например, http://localhost:9000 для MinIO
+    S3_REGION: Optional[str] = None
+    S3_ACCESS_KEY: Optional[str] = None
+    S3_SECRET_KEY: Optional[str] = None
+    
+    # Фоновая обработка обращений (очередь complaint_jobs в БД)
+    JOB_WORKERS: int = 1
+    JOB_POLL_INTERVAL: float = 2.0  # секунды
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BASE: float = 5.0  # задержка повтора: base * 2^(попытка-1) секунд
+    JOB_LOCK_TIMEOUT: int = 300  # через сколько секунд "running" считается зависшей
+    JOB_EVENTS_TIMEOUT: int = 120  # максимальная длительность SSE-подписки
+    
+    # Повторные обращения (dedup.py): открытое обращение в радиусе с похожим фото
+    DEDUP_ENABLED: bool = True
+    DEDUP_RADIUS_M: float = 30.0
+    DEDUP_MAX_HASH_DISTANCE: int = 10  # бит из 64 у dHash
+    DEDUP_MIN_HASH_BITS: int = 12  # хэш с меньшим числом единиц (или нулей) - фото без текстуры, не сравнивается
+    
+    # Списки обращений
+    COUNT_CACHE_TTL: float = 0  # секунды кэширования total в списках; 0 - считать каждый раз
+    
+    # Карта
+    MAP_MAX_POINTS: int = 5000  # максимум точек в ответе /map/complaints
+    MAP_CLUSTER_CELL_PX: int = 64  # размер ячейки кластеров в пикселях тайла 256px
+    MAP_TILE_POINTS_ZOOM: int = 14  # с этого zoom тайлы содержат точки, ниже - кластеры
+    MAP_TILE_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    MAP_TILE_CACHE_TTL: int = 300  # секунды
+    MAP_COORD_SCALE: int = 100000  # квантование координат в компактных форматах (1e5 ~ 1.1 м)
+    MAP_SYNC_OVERLAP: int = 2  # секунды перекрытия дельт (коммиты, завершившиеся позже чтения)
+    MAP_TOMBSTONE_RETENTION_DAYS: int = 30  # более старый since получает reset=true
+    MAP_DELTA_MAX_ITEMS: int = 10000  # больше изменений - reset=true вместо дельты
+    
+    # Массовый импорт (bulk_import.py)
+    IMPORT_UPLOAD_DIR: str = "uploads/imported"  # изображения импортированных обращений
+    IMPORT_WORK_DIR: str = "imports"  # манифесты, архивы и чекпоинты загрузок
+    IMPORT_CHUNK_SIZE: int = 500  # строк на транзакцию
+    IMPORT_AI_BATCH_SIZE: int = 16
     
     class Config:
         env_file = ".env"
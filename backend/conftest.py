@@ -0,0 +1 @@
+# Модули backend импортируются по имени (как при запуске uvicorn main:app из backend/)
@@ -1,16 +1,26 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import and_, or_
-from models import User, Complaint, Organization
-from schemas import UserCreate, ComplaintCreate, ComplaintUpdate
-from auth import get_password_hash
-from typing import List, Optional
+from sqlalchemy import and_, or_, func, text, table, column, cast, delete, update, true, Integer
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Join
+from models import User, Complaint, Organization, ComplaintJob, ComplaintTombstone
+from schemas import UserCreate, UserUpdate, ComplaintCreate, ComplaintUpdate
+from auth import hash_password, invalidate_principal
+from config import settings
+from dedup import distance_m, hamming, is_informative, radius_bbox
+from geo import BBox
+from map_tiles import cluster_cell_size, get_tile_cache, merge_cluster_rows
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import base64
+import json
+import time
 
 async def create_user(db: AsyncSession, user: UserCreate):
     db_user = User(
         username=user.username,
         email=user.email,
-        hashed_password=get_password_hash(user.password),
+        hashed_password=await hash_password(user.password),
         language=user.language
     )
     db.add(db_user)
@@ -22,102 +32,499 @@ async def get_user_by_username(db: AsyncSession, username: str):
     result = await db.execute(select(User).filter(User.username == username))
     return result.scalar_one_or_none()
 
+async def update_user(db: AsyncSession, user_id: int, user_update: UserUpdate):
+    result = await db.execute(select(User).filter(User.id == user_id))
+    db_user = result.scalar_one_or_none()
+    
+    if db_user:
+        if user_update.role is not None:
+            db_user.role = user_update.role.value
+        if user_update.is_active is not None:
+            db_user.is_active = user_update.is_active
+        if user_update.language:
+            db_user.language = user_update.language
+        
+        await db.commit()
+        invalidate_principal(db_user.username)
+        await db.refresh(db_user)
+    
+    return db_user
+
 async def get_user_by_email(db: AsyncSession, email: str):
     result = await db.execute(select(User).filter(User.email == email))
     return result.scalar_one_or_none()
 
-async def create_complaint(db: AsyncSession, complaint: ComplaintCreate, user_id: int):
+async def create_complaint(
+    db: AsyncSession,
+    complaint: ComplaintCreate,
+    user_id: int,
+    process: bool = False,
+    duplicate_of: Optional[Complaint] = None
+):
+    """
+    process=True: обращение создается в статусе "processing" вместе с задачей
+    фоновой обработки (в одной транзакции).
+    
+    duplicate_of: основное обращение (find_duplicate) - новое сохраняется в
+    статусе "duplicate" со ссылкой на него и результатами AI основного, без
+    задачи обработки; cluster_size основного увеличивается.
+    """
     db_complaint = Complaint(
         user_id=user_id,
         image_path=complaint.image_path,
         description=complaint.description,
         lat=complaint.lat,
-        lon=complaint.lon
+        lon=complaint.lon,
+        category=complaint.category,
+        ai_confidence=complaint.ai_confidence,
+        image_hash=complaint.image_hash,
+        status="processing" if process else "pending"
     )
+    if duplicate_of is not None:
+        db_complaint.status = "duplicate"
+        db_complaint.duplicate_of = duplicate_of.id
+        if not db_complaint.category:
+            db_complaint.category = duplicate_of.category
+            db_complaint.ai_confidence = duplicate_of.ai_confidence
+        db_complaint.ai_severity = duplicate_of.ai_severity
+        db_complaint.ai_model = duplicate_of.ai_model
+        process = False
+        # Атомарно: параллельные дубликаты не теряют инкременты
+        await db.execute(
+            update(Complaint)
+            .where(Complaint.id == duplicate_of.id)
+            .values(cluster_size=Complaint.cluster_size + 1)
+        )
     db.add(db_complaint)
+    if process:
+        await db.flush()
+        db.add(ComplaintJob(complaint_id=db_complaint.id))
     await db.commit()
+    complaints_changed((db_complaint.lat, db_complaint.lon))
     await db.refresh(db_complaint)
     return db_complaint
 
+async def find_duplicate(db: AsyncSession, lat: float, lon: float, image_hash: str) -> Optional[Complaint]:
+    """
+    Открытое обращение с похожим фото в радиусе DEDUP_RADIUS_M.
+    
+    Кандидаты - все основные открытые обращения с хэшем в bbox радиуса
+    (пространственный индекс, within_bbox), без ограничения числа: в плотном
+    районе обрезка выборки теряла бы настоящие дубликаты. Читаются только
+    id, хэш и координаты (строки, не ORM-объекты), сравниваются по расстоянию
+    Хэмминга (не больше DEDUP_MAX_HASH_DISTANCE) и точному расстоянию на
+    местности; ORM-объект загружается только для найденного.
+    Хэши фото без текстуры (is_informative) не сравниваются.
+    
+    Returns:
+        Самое похожее (при равенстве - ближайшее, затем новейшее) обращение или None.
+    """
+    if not is_informative(image_hash, settings.DEDUP_MIN_HASH_BITS):
+        return None
+    
+    query = select(Complaint.id, Complaint.image_hash, Complaint.lat, Complaint.lon).where(
+        Complaint.status.in_(["pending", "processing", "in_progress"]),
+        Complaint.duplicate_of.is_(None),
+        Complaint.image_hash.isnot(None)
+    )
+    query = await within_bbox(db, query, radius_bbox(lat, lon, settings.DEDUP_RADIUS_M))
+    
+    best_id, best_key = None, None
+    for candidate_id, candidate_hash, candidate_lat, candidate_lon in await db.execute(query):
+        bits = hamming(image_hash, candidate_hash)
+        if bits > settings.DEDUP_MAX_HASH_DISTANCE or not is_informative(candidate_hash, settings.DEDUP_MIN_HASH_BITS):
+            continue
+        distance = distance_m(lat, lon, candidate_lat, candidate_lon)
+        key = (bits, distance, -candidate_id)
+        if distance <= settings.DEDUP_RADIUS_M and (best_key is None or key < best_key):
+            best_id, best_key = candidate_id, key
+    return await db.get(Complaint, best_id) if best_id is not None else None
+
 async def get_complaint(db: AsyncSession, complaint_id: int):
     result = await db.execute(select(Complaint).filter(Complaint.id == complaint_id))
     return result.scalar_one_or_none()
 
-async def get_user_complaints(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100):
-    result = await db.execute(
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(complaint) -> str:
+    payload = json.dumps([complaint.created_at.isoformat(), complaint.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, complaint_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(complaint_id)
+    except Exception:
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+
+# Кэш total для списков: {ключ фильтра: (время, значение)}
+_count_cache: Dict[str, Tuple[float, int]] = {}
+
+def invalidate_complaint_counts():
+    _count_cache.clear()
+
+def complaints_changed(*points: Tuple[Optional[float], Optional[float]]):
+    """
+    Сбрасывает производные кэши после изменения обращений.
+    
+    Args:
+        points: (lat, lon) измененных обращений; без аргументов - сброс всего.
+    """
+    invalidate_complaint_counts()
+    tile_cache = get_tile_cache()
+    if not points:
+        tile_cache.clear()
+    for lat, lon in points:
+        tile_cache.invalidate_point(lat, lon)
+
+async def count_complaints(db: AsyncSession, filters: list) -> int:
+    """
+    SELECT COUNT(*) с кэшированием на COUNT_CACHE_TTL секунд.
+    """
+    query = select(func.count()).select_from(Complaint).where(*filters)
+    ttl = settings.COUNT_CACHE_TTL
+    if ttl <= 0:
+        return (await db.execute(query)).scalar_one()
+    
+    key = str(query.compile(compile_kwargs={"literal_binds": True}))
+    cached = _count_cache.get(key)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    total = (await db.execute(query)).scalar_one()
+    _count_cache[key] = (time.monotonic(), total)
+    return total
+
+async def paginate_complaints(db: AsyncSession, filters: list, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    """
+    Страница обращений в стабильном порядке (created_at DESC, id DESC).
+    
+    Args:
+        filters: условия WHERE.
+        skip: OFFSET (только без cursor; оставлен для совместимости).
+        cursor: next_cursor предыдущей страницы - keyset-пагинация без OFFSET.
+    
+    Returns:
+        (обращения, total, next_cursor)
+    """
+    query = (
         select(Complaint)
-        .filter(Complaint.user_id == user_id)
-        .offset(skip)
+        .where(*filters)
+        .order_by(Complaint.created_at.desc(), Complaint.id.desc())
         .limit(limit)
     )
-    complaints = result.scalars().all()
+    if cursor:
+        # created_at всегда заполнен (server_default), id разрешает совпадения
+        created_at, complaint_id = decode_cursor(cursor)
+        query = query.where(or_(
+            Complaint.created_at < created_at,
+            and_(Complaint.created_at == created_at, Complaint.id < complaint_id)
+        ))
+    else:
+        query = query.offset(skip)
     
-    count_result = await db.execute(
-        select(Complaint)
-        .filter(Complaint.user_id == user_id)
-    )
-    total = len(count_result.scalars().all())
+    complaints = (await db.execute(query)).scalars().all()
+    total = await count_complaints(db, filters)
+    next_cursor = encode_cursor(complaints[-1]) if len(complaints) == limit else None
     
-    return complaints, total
+    return complaints, total, next_cursor
 
-async def get_all_complaints(db: AsyncSession, skip: int = 0, limit: int = 100):
-    result = await db.execute(select(Complaint).offset(skip).limit(limit))
-    complaints = result.scalars().all()
-    
-    count_result = await db.execute(select(Complaint))
-    total = len(count_result.scalars().all())
-    
-    return complaints, total
+async def get_user_complaints(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return await paginate_complaints(db, [Complaint.user_id == user_id], skip, limit, cursor)
+
+async def get_all_complaints(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return await paginate_complaints(db, [], skip, limit, cursor)
 
 async def update_complaint(db: AsyncSession, complaint_id: int, complaint_update: ComplaintUpdate):
     result = await db.execute(select(Complaint).filter(Complaint.id == complaint_id))
     db_complaint = result.scalar_one_or_none()
     
     if db_complaint:
+        duplicates_moved = []
         if complaint_update.status:
             db_complaint.status = complaint_update.status
+            if db_complaint.duplicate_of is None and db_complaint.cluster_size > 1:
+                duplicates_moved = await _sync_duplicates_status(db, db_complaint)
         if complaint_update.organization_id:
             db_complaint.organization_id = complaint_update.organization_id
         if complaint_update.description:
             db_complaint.description = complaint_update.description
             
         await db.commit()
+        complaints_changed((db_complaint.lat, db_complaint.lon), *duplicates_moved)
         await db.refresh(db_complaint)
     
     return db_complaint
 
-async def get_complaints_for_map(db: AsyncSession):
-    result = await db.execute(
-        select(Complaint.id, Complaint.lat, Complaint.lon, Complaint.category, Complaint.status, Complaint.created_at)
-    )
-    complaints = result.all()
-    
-    return [
-        {
-            "id": complaint.id,
-            "lat": complaint.lat,
-            "lon": complaint.lon,
-            "category": complaint.category,
-            "status": complaint.status,
-            "created_at": complaint.created_at
-        }
-        for complaint in complaints
-    ]
-
-async def get_admin_complaints(db: AsyncSession, status: Optional[str] = None, skip: int = 0, limit: int = 100):
-    query = select(Complaint)
+async def _sync_duplicates_status(db: AsyncSession, primary: Complaint) -> List[Tuple[float, float]]:
+    """
+    Дубликаты получают итоговый статус основного обращения (resolved,
+    rejected), чтобы их авторы видели результат; при возврате основного в
+    работу снова становятся "duplicate".
     
+    Returns:
+        Координаты дубликатов, у которых изменился статус.
+    """
+    status = primary.status if primary.status in ("resolved", "rejected") else "duplicate"
+    changed = and_(Complaint.duplicate_of == primary.id, Complaint.status != status)
+    points = (await db.execute(select(Complaint.lat, Complaint.lon).where(changed))).all()
+    if points:
+        await db.execute(update(Complaint).where(changed).values(status=status))
+    return [tuple(point) for point in points]
+
+# Есть ли R*Tree complaints_rtree (миграция 4); определяется при первом запросе
+_spatial_index: Optional[bool] = None
+
+complaints_rtree = table(
+    "complaints_rtree",
+    column("id"), column("min_lat"), column("max_lat"), column("min_lon"), column("max_lon")
+)
+
+class CrossJoin(Join):
+    """
+    JOIN с фиксированным порядком: в SQLite левая таблица CROSS JOIN всегда
+    внешняя. Без этого планировщик может выбрать индекс status/created_at и
+    проверять R*Tree для каждой строки.
+    """
+    inherit_cache = True
+
+@compiles(CrossJoin)
+def _compile_cross_join(element, compiler, **kw):
+    kw["asfrom"] = True
+    return "{} CROSS JOIN {} ON {}".format(
+        compiler.process(element.left, **kw),
+        compiler.process(element.right, **kw),
+        compiler.process(element.onclause, **kw)
+    )
+
+async def has_spatial_index(db: AsyncSession) -> bool:
+    global _spatial_index
+    if _spatial_index is None:
+        if db.bind.dialect.name == "sqlite":
+            result = await db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'complaints_rtree'"))
+            _spatial_index = result.scalar() is not None
+        else:
+            _spatial_index = False
+    return _spatial_index
+
+def map_filters(
+    status: Optional[List[str]] = None,
+    category: Optional[List[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> list:
+    filters = []
     if status:
-        query = query.filter(Complaint.status == status)
+        filters.append(Complaint.status.in_(status))
+    if category:
+        filters.append(Complaint.category.in_(category))
+    if since:
+        filters.append(Complaint.created_at >= since)
+    if until:
+        filters.append(Complaint.created_at < until)
+    return filters
+
+async def within_bbox(db: AsyncSession, query, bbox: Optional[BBox], spatial: bool = True):
+    """
+    Ограничивает запрос bbox: через R*Tree, если он есть, иначе по индексу (lat, lon).
+    
+    spatial=False - только условие на lat/lon, когда выборку ведет другой индекс.
+    """
+    if bbox is None:
+        return query
+    if spatial and await has_spatial_index(db):
+        spatial_join = CrossJoin(complaints_rtree, Complaint.__table__, complaints_rtree.c.id == Complaint.id)
+        return query.select_from(spatial_join).where(
+            complaints_rtree.c.min_lat <= bbox.max_lat,
+            complaints_rtree.c.max_lat >= bbox.min_lat,
+            complaints_rtree.c.min_lon <= bbox.max_lon,
+            complaints_rtree.c.max_lon >= bbox.min_lon
+        )
+    return query.where(
+        Complaint.lat.between(bbox.min_lat, bbox.max_lat),
+        Complaint.lon.between(bbox.min_lon, bbox.max_lon)
+    )
+
+async def get_complaints_for_map(
+    db: AsyncSession,
+    bbox: Optional[BBox] = None,
+    filters: Optional[list] = None,
+    limit: Optional[int] = None
+):
+    """
+    Точки карты в bbox (новые первыми), строки БД без ORM-объектов.
     
-    result = await db.execute(query.offset(skip).limit(limit))
-    complaints = result.scalars().all()
+    Args:
+        bbox: область просмотра; None - вся карта.
+        filters: условия из map_filters().
+        limit: максимум точек.
+    """
+    query = select(
+        Complaint.id, Complaint.lat, Complaint.lon, Complaint.category, Complaint.status, Complaint.created_at
+    ).where(*(filters or []))
+    query = await within_bbox(db, query, bbox)
+    query = query.order_by(Complaint.created_at.desc(), Complaint.id.desc())
+    if limit:
+        query = query.limit(limit)
     
-    count_query = select(Complaint)
-    if status:
-        count_query = count_query.filter(Complaint.status == status)
+    result = await db.execute(query)
+    return result.all()
+
+def _cell_index(expr, dialect: str):
+    # Координаты сдвинуты в положительную область: в SQLite CAST отбрасывает
+    # дробную часть (= floor); в других СУБД CAST округляет, поэтому floor()
+    if dialect == "sqlite":
+        return cast(expr, Integer)
+    return cast(func.floor(expr), Integer)
+
+async def get_map_clusters(db: AsyncSession, zoom: int, bbox: Optional[BBox] = None, filters: Optional[list] = None):
+    """
+    Кластеры карты: агрегация по сетке zoom в SQL (GROUP BY ячейка, статус, категория).
+    
+    Returns:
+        (размер ячейки в градусах, список кластеров)
+    """
+    cell = cluster_cell_size(zoom)
+    dialect = db.bind.dialect.name
+    gx = _cell_index((Complaint.lon + 180.0) / cell, dialect).label("gx")
+    gy = _cell_index((Complaint.lat + 90.0) / cell, dialect).label("gy")
+    query = select(
+        gx, gy, Complaint.status, Complaint.category,
+        func.count().label("count"),
+        func.sum(Complaint.lat).label("lat_sum"),
+        func.sum(Complaint.lon).label("lon_sum")
+    ).where(Complaint.lat.is_not(None), Complaint.lon.is_not(None), *(filters or []))
+    query = await within_bbox(db, query, bbox)
+    query = query.group_by(gx, gy, Complaint.status, Complaint.category)
+    
+    result = await db.execute(query)
+    return cell, merge_cluster_rows(result.all())
+
+async def get_map_sync_state(db: AsyncSession):
+    """
+    Состояние данных карты одним запросом (по индексам updated_at/deleted_at).
     
-    count_result = await db.execute(count_query)
-    total = len(count_result.scalars().all())
+    Returns:
+        (последнее изменение, последнее удаление, текущее время БД)
+    """
+    result = await db.execute(select(
+        select(func.max(Complaint.updated_at)).scalar_subquery(),
+        select(func.max(ComplaintTombstone.deleted_at)).scalar_subquery(),
+        func.now()
+    ))
+    return tuple(result.one())
+
+async def get_map_delta(
+    db: AsyncSession,
+    since: datetime,
+    bbox: Optional[BBox] = None,
+    filters: Optional[list] = None,
+    limit: Optional[int] = None
+):
+    """
+    Изменения карты с момента since (включительно).
+    
+    Returns:
+        (строки точек для добавления/обновления, id для удаления) или None, если
+        изменений больше limit и клиенту проще загрузить карту заново.
+    """
+    visible = and_(true(), *(filters or [])).label("visible")
+    query = select(
+        Complaint.id, Complaint.lat, Complaint.lon, Complaint.category, Complaint.status, Complaint.created_at,
+        visible
+    ).where(Complaint.updated_at >= since)
+    query = await within_bbox(db, query, bbox, spatial=False)
+    if limit:
+        query = query.limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    if limit and len(rows) > limit:
+        return None
+    
+    upserts, removed = [], []
+    for row in rows:
+        if row.visible:
+            upserts.append(row)
+        else:
+            # Обращение перестало подходить под фильтры (например, сменился статус)
+            removed.append(row.id)
+    
+    tombstones = select(ComplaintTombstone.id).where(ComplaintTombstone.deleted_at >= since)
+    if bbox is not None:
+        tombstones = tombstones.where(
+            ComplaintTombstone.lat.between(bbox.min_lat, bbox.max_lat),
+            ComplaintTombstone.lon.between(bbox.min_lon, bbox.max_lon)
+        )
+    removed.extend((await db.execute(tombstones)).scalars().all())
+    
+    return upserts, removed
+
+async def _detach_duplicates(db: AsyncSession, complaint_id: int):
+    """
+    Дубликаты удаляемого обращения становятся самостоятельными и ставятся
+    в очередь обработки (AI у них не запускался).
+    """
+    duplicate_ids = (await db.execute(
+        select(Complaint.id).where(Complaint.duplicate_of == complaint_id)
+    )).scalars().all()
+    if not duplicate_ids:
+        return
+    await db.execute(
+        update(Complaint)
+        .where(Complaint.id.in_(duplicate_ids))
+        .values(duplicate_of=None, cluster_size=1, status="processing")
+    )
+    db.add_all([ComplaintJob(complaint_id=duplicate_id) for duplicate_id in duplicate_ids])
+
+async def delete_complaint(db: AsyncSession, complaint_id: int):
+    """
+    Удаляет обращение с его задачами обработки и оставляет tombstone для
+    дельта-синхронизации карты. Устаревшие tombstones при этом чистятся.
     
-    return complaints, total
\ No newline at end of file
+    У удаляемого дубликата уменьшается cluster_size основного обращения;
+    дубликаты удаляемого основного отвязываются (_detach_duplicates).
+    """
+    db_complaint = await get_complaint(db, complaint_id)
+    if db_complaint is None:
+        return None
+    
+    await db.execute(delete(ComplaintJob).where(ComplaintJob.complaint_id == complaint_id))
+    if db_complaint.duplicate_of is not None:
+        await db.execute(
+            update(Complaint)
+            .where(Complaint.id == db_complaint.duplicate_of)
+            .values(cluster_size=Complaint.cluster_size - 1)
+        )
+    elif db_complaint.cluster_size > 1:
+        await _detach_duplicates(db, complaint_id)
+    await db.merge(ComplaintTombstone(id=complaint_id, lat=db_complaint.lat, lon=db_complaint.lon, deleted_at=func.now()))
+    await db.delete(db_complaint)
+    retention = datetime.utcnow() - timedelta(days=settings.MAP_TOMBSTONE_RETENTION_DAYS)
+    await db.execute(delete(ComplaintTombstone).where(ComplaintTombstone.deleted_at < retention))
+    await db.commit()
+    complaints_changed((db_complaint.lat, db_complaint.lon))
+    return db_complaint
+
+async def get_admin_complaints(
+    db: AsyncSession,
+    status: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_duplicates: bool = False
+):
+    """
+    Дубликаты по умолчанию скрыты: их число видно в cluster_size основного.
+    """
+    filters = [Complaint.status == status] if status else []
+    if not include_duplicates and status != "duplicate":
+        filters.append(Complaint.duplicate_of.is_(None))
+    return await paginate_complaints(db, filters, skip, limit, cursor)
+
+async def get_complaint_job(db: AsyncSession, complaint_id: int):
+    result = await db.execute(
+        select(ComplaintJob)
+        .filter(ComplaintJob.complaint_id == complaint_id)
+        .order_by(ComplaintJob.id.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
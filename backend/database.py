@@ -1,12 +1,76 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=True
-)
+
+def normalize_url(url: str) -> str:
+    """
+    postgres:// и postgresql:// без драйвера -> postgresql+asyncpg://
+    """
+    parsed = make_url(url)
+    if parsed.drivername in ("postgres", "postgresql"):
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+
+def sqlite_pragmas() -> dict:
+    """
+    PRAGMA профиля SQLite: WAL позволяет читать во время записи, busy_timeout
+    ждет блокировку вместо немедленного "database is locked".
+    """
+    return {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+    }
+
+
+def create_engine_for(url: str, tuned: bool = True, echo: bool = None):
+    """
+    Движок по профилю из Settings (по диалекту URL).
+    
+    Args:
+        url: DATABASE_URL.
+        tuned: False - настройки драйвера по умолчанию (для сравнения в bench_db.py).
+        echo: логирование SQL; по умолчанию DB_ECHO.
+    """
+    url = normalize_url(url)
+    dialect = make_url(url).get_backend_name()
+    options = {"echo": settings.DB_ECHO if echo is None else echo}
+    
+    if tuned and dialect == "postgresql":
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+            # Кэш подготовленных выражений asyncpg; 0 - для pgbouncer в transaction mode
+            connect_args={"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+        )
+    elif tuned and dialect == "sqlite":
+        options["connect_args"] = {"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+    
+    db_engine = create_async_engine(url, **options)
+    
+    if tuned and dialect == "sqlite":
+        pragmas = sqlite_pragmas()
+        
+        @event.listens_for(db_engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+    
+    return db_engine
+
+
+engine = create_engine_for(settings.DATABASE_URL)
 
 AsyncSessionLocal = sessionmaker(
     engine, 
@@ -18,4 +82,4 @@ Base = declarative_base()
 
 async def get_db():
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
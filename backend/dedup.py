@@ -0,0 +1,97 @@
+"""
+Поиск повторных обращений: перцептивный хэш изображения.
+
+dHash устойчив к пересжатию, масштабу и небольшим сдвигам кадра, поэтому
+два фото одной ямы дают хэши, отличающиеся на несколько бит. Кандидаты
+отбираются по радиусу через пространственный индекс (crud.find_duplicate),
+их немного, и хэши сравниваются перебором по расстоянию Хэмминга.
+"""
+import math
+from io import BytesIO
+from typing import BinaryIO, Union
+
+from PIL import Image, ImageOps
+
+from geo import BBox
+from storage import open_file
+
+HASH_SIZE = 8  # 8x8 = 64 бита
+EARTH_RADIUS_M = 6371000.0
+
+
+def perceptual_hash(source: Union[bytes, BinaryIO]) -> str:
+    """
+    dHash: знак разности яркости соседних пикселей в уменьшенном до 9x8
+    изображении в оттенках серого.
+
+    Args:
+        source: байты или файловый объект (JPEG декодируется в уменьшенном
+            масштабе, файл целиком в память не читается).
+
+    Returns:
+        64-битный хэш в hex (16 символов).
+
+    Raises:
+        PIL.UnidentifiedImageError: данные не являются изображением.
+    """
+    image = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))  # JPEG декодируется сразу в малом масштабе
+    image = ImageOps.exif_transpose(image).convert("L").resize(
+        (HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS
+    )
+    pixels = list(image.getdata())
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+
+def stored_image_hash(path: str) -> str:
+    """
+    perceptual_hash файла из хранилища по логическому пути (синхронно).
+    """
+    with open_file(path) as f:
+        return perceptual_hash(f)
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def is_informative(value: str, min_bits: int) -> bool:
+    """
+    Хэш малотекстурного фото (ночь, ровный асфальт, небо) почти весь из
+    нулей или единиц и совпадает с хэшем любого другого такого фото: такие
+    хэши для поиска дубликатов не используются.
+    """
+    ones = bin(int(value, 16)).count("1")
+    return min_bits <= ones <= HASH_SIZE * HASH_SIZE - min_bits
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Расстояние по большому кругу (haversine) в метрах.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def radius_bbox(lat: float, lon: float, radius_m: float) -> BBox:
+    """
+    bbox, описанный вокруг круга радиуса radius_m (для выборки по индексу).
+    """
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+    return BBox(
+        min_lon=max(lon - d_lon, -180.0),
+        min_lat=max(lat - d_lat, -90.0),
+        max_lon=min(lon + d_lon, 180.0),
+        max_lat=min(lat + d_lat, 90.0)
+    )
@@ -0,0 +1,71 @@
+"""
+Геометрия карты: bbox и тайлы Web Mercator (схема XYZ, как у OSM/Leaflet).
+"""
+import math
+from typing import NamedTuple
+
+MAX_LAT = 85.05112878  # предел Web Mercator
+
+
+class BBox(NamedTuple):
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+
+def parse_bbox(value: str) -> BBox:
+    """
+    Разбирает "min_lon,min_lat,max_lon,max_lat".
+    
+    Raises:
+        ValueError: неверный формат или координаты вне диапазона.
+    """
+    parts = [float(part) for part in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    bbox = BBox(*parts)
+    if not (-180 <= bbox.min_lon <= bbox.max_lon <= 180 and -90 <= bbox.min_lat <= bbox.max_lat <= 90):
+        raise ValueError("bbox is out of range or inverted")
+    return bbox
+
+
+def lon_to_tile_x(lon: float, zoom: int) -> float:
+    return (lon + 180.0) / 360.0 * (1 << zoom)
+
+
+def lat_to_tile_y(lat: float, zoom: int) -> float:
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    rad = math.radians(lat)
+    return (1.0 - math.asinh(math.tan(rad)) / math.pi) / 2.0 * (1 << zoom)
+
+
+def tile_x_to_lon(x: float, zoom: int) -> float:
+    return x / (1 << zoom) * 360.0 - 180.0
+
+
+def tile_y_to_lat(y: float, zoom: int) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / (1 << zoom)))))
+
+
+def tile_bbox(z: int, x: int, y: int) -> BBox:
+    """Границы тайла z/x/y"""
+    return BBox(tile_x_to_lon(x, z), tile_y_to_lat(y + 1, z), tile_x_to_lon(x + 1, z), tile_y_to_lat(y, z))
+
+
+def snap_bbox(bbox: BBox, zoom: int) -> BBox:
+    """
+    Расширяет bbox до границ тайлов zoom: соседние запросы при панорамировании
+    дают одинаковые bbox (кэшируемо), точки у краев экрана подгружаются заранее.
+    """
+    zoom = max(0, min(zoom, 22))
+    x0 = math.floor(lon_to_tile_x(bbox.min_lon, zoom))
+    x1 = math.ceil(lon_to_tile_x(bbox.max_lon, zoom))
+    y0 = math.floor(lat_to_tile_y(bbox.max_lat, zoom))
+    y1 = math.ceil(lat_to_tile_y(bbox.min_lat, zoom))
+    return BBox(
+        tile_x_to_lon(x0, zoom),
+        max(-90.0, tile_y_to_lat(y1, zoom)) if y1 < (1 << zoom) else -90.0,
+        tile_x_to_lon(x1, zoom),
+        min(90.0, tile_y_to_lat(y0, zoom)) if y0 > 0 else 90.0,
+    )
@@ -0,0 +1,287 @@
+"""
+Фоновая обработка обращений: durable очередь в таблице complaint_jobs.
+
+Обращение сохраняется сразу со статусом "processing", а AI-классификация,
+аннотированное изображение и миниатюра заполняются воркером. Задачи
+переживают рестарт: зависшие в "running" дольше JOB_LOCK_TIMEOUT снова
+забираются, ошибки повторяются с экспоненциальной задержкой.
+
+Задачи kind='media' строят только варианты изображения и хэш (без AI):
+их ставит импорт и бэкфилл `python bulk_import.py media`.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.future import select
+
+from ai_batcher import get_batch_scheduler
+from ai_executor import InferenceQueueFull
+from config import settings
+from crud import complaints_changed
+from dedup import perceptual_hash
+from database import AsyncSessionLocal
+from media import build_image_variants, parse_variant_specs
+from models import Complaint, ComplaintJob
+from storage import read_file, save_content_addressed
+
+log = logging.getLogger(__name__)
+
+
+async def enrich_complaint(complaint: Complaint, ai: bool = True):
+    """
+    AI-классификация, аннотированное изображение и варианты изображения
+    (миниатюра, средний, нормализованный оригинал) для обращения.
+    
+    ai=False - только изображения (задачи kind='media': импорт, бэкфилл).
+    """
+    data = await asyncio.to_thread(read_file, complaint.image_path)
+    
+    # Обращения без хэша (импорт, созданные до миграции 7) становятся
+    # кандидатами поиска дубликатов после обработки
+    if complaint.image_hash is None:
+        try:
+            complaint.image_hash = await asyncio.to_thread(perceptual_hash, data)
+        except Exception as e:
+            log.warning(f"⚠️ Хэш изображения обращения {complaint.id}: {e}")
+    
+    # Варианты не зависят от AI и нужны, даже если модель недоступна;
+    # при повторе задачи уже построенные берутся из хранилища
+    variants = await asyncio.to_thread(
+        build_image_variants,
+        data,
+        settings.IMAGE_VARIANTS_DIR,
+        parse_variant_specs(settings.IMAGE_VARIANTS),
+        settings.IMAGE_VARIANT_FORMATS.split(","),
+        settings.IMAGE_VARIANT_QUALITY
+    )
+    complaint.image_variants = variants
+    thumbnail = variants.get("thumbnail", {})
+    complaint.thumbnail_path = thumbnail.get("jpeg") or next(iter(thumbnail.values()), None)
+    if not ai:
+        return
+    
+    result = await get_batch_scheduler().analyze(
+        data,
+        annotation_quality=settings.AI_ANNOTATION_QUALITY,
+        annotation_subsampling=settings.AI_ANNOTATION_SUBSAMPLING,
+        encode_original=False
+    )
+    if result.category == "error":
+        raise RuntimeError("AI detection failed")
+    
+    # Категория от клиента приоритетнее
+    if not complaint.category and result.has_problem:
+        complaint.category = result.category
+        complaint.ai_confidence = result.confidence
+    complaint.ai_severity = result.severity
+    complaint.ai_model = result.model_version
+    
+    if result.annotated_jpeg is not None:
+        complaint.annotated_image_path = await asyncio.to_thread(
+            save_content_addressed, result.annotated_jpeg, settings.AI_ANNOTATION_DIR, "jpg"
+        )
+
+
+class ComplaintJobWorker:
+    """
+    Пул asyncio-воркеров, разбирающих complaint_jobs.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        poll_interval: float = 2.0,
+        max_attempts: int = 5,
+        retry_base: float = 5.0,
+        lock_timeout: int = 300
+    ):
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lock_timeout = lock_timeout
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        log.info(f"✅ Воркер обработки обращений запущен (x{self.concurrency})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """
+        Будит воркеры сразу после постановки задачи, не дожидаясь опроса.
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                job_id = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"❌ Ошибка выборки задачи: {e}")
+                job_id = None
+            
+            if job_id is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Например, "database is locked" на commit: задача остается
+                # "running" и будет забрана снова через JOB_LOCK_TIMEOUT
+                log.exception(f"❌ Ошибка задачи {job_id}: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def _claimable(self, now: datetime):
+        stale = now - timedelta(seconds=self.lock_timeout)
+        return or_(
+            and_(
+                ComplaintJob.state == "queued",
+                or_(ComplaintJob.run_after.is_(None), ComplaintJob.run_after <= now)
+            ),
+            # Задача воркера, упавшего посреди обработки
+            and_(ComplaintJob.state == "running", ComplaintJob.locked_at < stale)
+        )
+
+    def claim_candidate_queries(self, now: datetime):
+        """
+        Запросы кандидата: сначала очередь по порядку id, затем зависшие задачи.
+        Раздельно, чтобы каждый шел по индексу без сортировки.
+        """
+        stale = now - timedelta(seconds=self.lock_timeout)
+        return [
+            select(ComplaintJob.id)
+            .where(
+                ComplaintJob.state == "queued",
+                or_(ComplaintJob.run_after.is_(None), ComplaintJob.run_after <= now)
+            )
+            .order_by(ComplaintJob.id)
+            .limit(1),
+            select(ComplaintJob.id)
+            .where(ComplaintJob.state == "running", ComplaintJob.locked_at < stale)
+            .limit(1),
+        ]
+
+    def claim_update(self, job_id: int, now: datetime):
+        return (
+            update(ComplaintJob)
+            .where(ComplaintJob.id == job_id, self._claimable(now))
+            .values(state="running", locked_at=now, attempts=ComplaintJob.attempts + 1)
+        )
+
+    async def _claim(self) -> Optional[int]:
+        """
+        Атомарно забирает одну задачу (условный UPDATE, безопасно для нескольких процессов).
+        Планы запросов проверяются в check_query_plans.py.
+        """
+        async with AsyncSessionLocal() as db:
+            for _ in range(3):
+                now = datetime.utcnow()
+                job_id = None
+                for query in self.claim_candidate_queries(now):
+                    job_id = (await db.execute(query)).scalar_one_or_none()
+                    if job_id is not None:
+                        break
+                if job_id is None:
+                    return None
+                claimed = await db.execute(self.claim_update(job_id, now))
+                await db.commit()
+                if claimed.rowcount == 1:
+                    return job_id
+        return None
+
+    async def _finish_processing(self, db, complaint_id: int):
+        """
+        processing -> pending условным UPDATE: статус, выставленный админом
+        во время обработки, не перезаписывается загруженной до нее копией.
+        """
+        await db.execute(
+            update(Complaint)
+            .where(Complaint.id == complaint_id, Complaint.status == "processing")
+            .values(status="pending")
+            .execution_options(synchronize_session=False)
+        )
+
+    async def _process(self, job_id: int):
+        async with AsyncSessionLocal() as db:
+            job = await db.get(ComplaintJob, job_id)
+            complaint = await db.get(Complaint, job.complaint_id)
+            if complaint is None:
+                job.state = "failed"
+                job.last_error = "Complaint not found"
+                await db.commit()
+                return
+            
+            try:
+                await enrich_complaint(complaint, ai=job.kind != "media")
+                await self._finish_processing(db, complaint.id)
+                # Дубликаты, привязанные до окончания обработки, получают ее результат
+                await db.execute(
+                    update(Complaint)
+                    .where(Complaint.duplicate_of == complaint.id, Complaint.ai_model.is_(None))
+                    .values(
+                        category=func.coalesce(Complaint.category, complaint.category),
+                        ai_confidence=func.coalesce(Complaint.ai_confidence, complaint.ai_confidence),
+                        ai_severity=complaint.ai_severity,
+                        ai_model=complaint.ai_model
+                    )
+                )
+                job.state = "done"
+                job.last_error = None
+            except InferenceQueueFull as e:
+                # Перегрузка - не ошибка задачи, попытку не засчитываем
+                job.state = "queued"
+                job.attempts -= 1
+                job.run_after = datetime.utcnow() + timedelta(seconds=e.retry_after)
+            except Exception as e:
+                log.exception(f"❌ Ошибка обработки обращения {complaint.id}: {e}")
+                job.last_error = str(e)
+                if job.attempts >= self.max_attempts:
+                    job.state = "failed"
+                    # Обращение все равно попадает в работу, просто без AI-данных
+                    await self._finish_processing(db, complaint.id)
+                else:
+                    job.state = "queued"
+                    delay = self.retry_base * 2 ** (job.attempts - 1)
+                    job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+            
+            await db.commit()
+            complaints_changed((complaint.lat, complaint.lon))
+
+
+_worker = None
+
+def get_job_worker() -> ComplaintJobWorker:
+    """
+    Получение синглтона воркера фоновой обработки.
+    """
+    global _worker
+    if _worker is None:
+        _worker = ComplaintJobWorker(
+            concurrency=settings.JOB_WORKERS,
+            poll_interval=settings.JOB_POLL_INTERVAL,
+            max_attempts=settings.JOB_MAX_ATTEMPTS,
+            retry_base=settings.JOB_RETRY_BASE,
+            lock_timeout=settings.JOB_LOCK_TIMEOUT
+        )
+    return _worker
@@ -0,0 +1,116 @@
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+log = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=16)
+def load_font(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    """
+    Шрифт загружается один раз на (путь, размер).
+    """
+    return ImageFont.truetype(font_path, size)
+
+
+class LabelSprite:
+    """
+    Предварительно отрисованная метка: белый текст с черной тенью.
+    
+    Наложение на кадр: frame = frame * keep + add, где keep/add посчитаны
+    один раз из масок текста и тени. Белый и черный одинаковы в BGR и RGB,
+    поэтому кадр не нужно конвертировать.
+    """
+
+    def __init__(self, keep: np.ndarray, add: np.ndarray, text_height: int):
+        self.keep = keep  # (H, W, 1) float32: доля исходного пикселя
+        self.add = add    # (H, W, 1) float32: вклад белого текста
+        self.text_height = text_height
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.keep.shape[:2]
+
+
+class LabelRenderer:
+    """
+    Рисует подписи bbox из кэша спрайтов прямо в BGR-массив.
+    """
+
+    SHADOW_OFFSET = 2
+
+    def __init__(self, font_path: str, size: int = 24, labels: Iterable[str] = ()):
+        self.font = load_font(font_path, size)
+        self._sprites: Dict[str, LabelSprite] = {}
+        self._lock = threading.Lock()
+        for text in labels:
+            self.sprite(text)
+
+    def _render(self, text: str) -> LabelSprite:
+        bbox = self.font.getbbox(text)
+        size = (bbox[2] + self.SHADOW_OFFSET, bbox[3] + self.SHADOW_OFFSET)
+        
+        text_mask = Image.new("L", size, 0)
+        ImageDraw.Draw(text_mask).text((0, 0), text, fill=255, font=self.font)
+        shadow_mask = Image.new("L", size, 0)
+        ImageDraw.Draw(shadow_mask).text(
+            (self.SHADOW_OFFSET, self.SHADOW_OFFSET), text, fill=255, font=self.font
+        )
+        
+        text_alpha = np.asarray(text_mask, dtype=np.float32)[..., None] / 255
+        shadow_alpha = np.asarray(shadow_mask, dtype=np.float32)[..., None] / 255
+        # Сначала тень (черная), затем текст (белый) - как при последовательном draw.text
+        keep = (1 - shadow_alpha) * (1 - text_alpha)
+        add = 255 * text_alpha
+        return LabelSprite(keep, add, bbox[3] - bbox[1])
+
+    def sprite(self, text: str) -> LabelSprite:
+        sprite = self._sprites.get(text)
+        if sprite is None:
+            sprite = self._render(text)
+            with self._lock:
+                self._sprites[text] = sprite
+        return sprite
+
+    def draw(self, frame: np.ndarray, x1: int, y1: int, text: str):
+        """
+        Накладывает метку над bbox (или внутри него у верхнего края кадра).
+        """
+        sprite = self.sprite(text)
+        x = x1 + 5
+        y = y1 - sprite.text_height - 10
+        if y < 0:
+            y = y1 + 5
+        self.blit(frame, sprite, x, y)
+
+    @staticmethod
+    def blit(frame: np.ndarray, sprite: LabelSprite, x: int, y: int):
+        height, width = sprite.shape
+        # Обрезаем спрайт по границам кадра
+        fx1, fy1 = max(x, 0), max(y, 0)
+        fx2, fy2 = min(x + width, frame.shape[1]), min(y + height, frame.shape[0])
+        if fx1 >= fx2 or fy1 >= fy2:
+            return
+        sx1, sy1 = fx1 - x, fy1 - y
+        sx2, sy2 = sx1 + (fx2 - fx1), sy1 + (fy2 - fy1)
+        
+        region = frame[fy1:fy2, fx1:fx2]
+        blended = region * sprite.keep[sy1:sy2, sx1:sx2] + sprite.add[sy1:sy2, sx1:sx2]
+        region[...] = np.clip(blended, 0, 255).astype(np.uint8)
+
+
+def create_label_renderer(font_path: Optional[str], size: int, labels: Iterable[str]) -> Optional[LabelRenderer]:
+    """
+    Создает рендерер, или None если шрифт недоступен.
+    """
+    if not font_path:
+        return None
+    try:
+        return LabelRenderer(font_path, size, labels)
+    except Exception as e:
+        log.error(f"❌ Не удалось загрузить шрифт: {e}")
+        return None
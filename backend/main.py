@@ -1,25 +1,52 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi.staticfiles import StaticFiles
-from database import get_db, engine
+from database import get_db, engine, AsyncSessionLocal
 from models import Base
+from migrations import run_migrations
 from schemas import (
     UserCreate, Token, ComplaintCreate, ComplaintUpdate, 
-    ComplaintListResponse, MapPoint, UserLogin, AIDetectionResponse
+    ComplaintListResponse, MapPoint, UserLogin, AIDetectionResponse,
+    ComplaintProcessingStatus, MapClusterResponse, MapDeltaResponse,
+    UserResponse, UserUpdate
 )
 from crud import (
     create_user, get_user_by_username, create_complaint, 
     get_user_complaints, get_complaint, update_complaint, 
-    get_complaints_for_map, get_admin_complaints
+    get_complaints_for_map, get_admin_complaints, get_complaint_job,
+    InvalidCursor, map_filters, get_map_clusters, get_map_sync_state, get_map_delta,
+    delete_complaint, update_user, find_duplicate
+)
+from auth import (
+    get_current_user, create_access_token, authenticate_user, principal_claims,
+    PasswordHashingBusy
+)
+from rate_limit import RateLimited, get_login_limiters
+from ai_executor import get_inference_executor, InferenceQueueFull
+from ai_batcher import get_batch_scheduler
+from ai_cache import get_detection_cache
+from config import settings
+from storage import (
+    get_storage, save_content_addressed, save_upload, storage_key, UploadTooLarge
 )
-from auth import get_current_user, create_access_token, authenticate_user
-from ai_processor import get_ai_detector
-from datetime import timedelta
+from jobs import get_job_worker
+from bulk_import import import_manifest
+from dedup import stored_image_hash
+from geo import BBox, parse_bbox, snap_bbox, tile_bbox
+from map_tiles import encode_tile, get_tile_cache, mapbox_vector_tile
+from map_encoding import encode_points, negotiate, render
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from starlette.concurrency import iterate_in_threadpool
+import asyncio
+import hashlib
+import mimetypes
+import json
 import os
+import shutil
 import uuid
-from typing import List
+from typing import List, Optional, Union
 import logging
 
 # Настройка логирования
@@ -27,7 +54,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Complaint Management API with AI")
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -37,22 +63,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Фоновые задачи (загрузка модели, импорт): asyncio хранит на задачи только
+# слабые ссылки, без этого множества задачу может собрать GC посреди работы
+_background_tasks = set()
+
+def spawn_background(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+def _background_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"❌ Фоновая задача {task.get_name()} завершилась ошибкой: {task.exception()!r}")
+
 # Create tables
 @app.on_event("startup")
 async def startup():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
+    
+    # Инициализируем AI детектор в фоне (в пуле инференса, вне event loop):
+    # API отвечает сразу, готовность модели видна в /health
+    executor = get_inference_executor()
+    executor.start()
+    spawn_background(load_ai_detector(executor), "load_ai_detector")
     
-    # Инициализируем AI детектор при запуске
+    # Фоновая обработка обращений
+    get_job_worker().start()
+
+async def load_ai_detector(executor):
     try:
-        get_ai_detector()
+        await executor.load_model()
         logger.info("✅ AI детектор инициализирован")
     except Exception as e:
         logger.error(f"⚠️ AI детектор не удалось инициализировать: {e}")
 
+@app.on_event("shutdown")
+async def shutdown():
+    await get_job_worker().stop()
+    get_inference_executor().shutdown()
+
+async def read_upload(image: UploadFile, max_bytes: int = None) -> bytes:
+    """
+    Читает загрузку чанками, проверяя размер до полного чтения.
+    
+    Каждое чтение ограничено остатком лимита плюс один байт: превышение
+    обнаруживается до добавления куска в буфер, и в памяти никогда не
+    оказывается больше max_bytes + 1 байт.
+    """
+    max_bytes = max_bytes or settings.MAX_UPLOAD_BYTES
+    too_large = HTTPException(status_code=413, detail="File is too large")
+    if image.size is not None and image.size > max_bytes:
+        raise too_large
+    
+    buffer = bytearray()
+    while chunk := await image.read(min(settings.STORAGE_CHUNK_SIZE, max_bytes + 1 - len(buffer))):
+        if len(buffer) + len(chunk) > max_bytes:
+            raise too_large
+        buffer.extend(chunk)
+    return bytes(buffer)
+
 # Authentication endpoints
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
 @app.post("/auth/register", response_model=Token)
-async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+async def register(user: UserCreate, request: Request, db: AsyncSession = Depends(get_db)):
+    ip_limiter, _ = get_login_limiters()
+    ip_limiter.hit(client_ip(request))
+    
     existing_user = await get_user_by_username(db, user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
@@ -60,82 +142,125 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     db_user = await create_user(db, user)
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": db_user.username, **principal_claims(db_user)}, expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/auth/login", response_model=Token)
-async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
+async def login(user: UserLogin, request: Request, db: AsyncSession = Depends(get_db)):
+    # Лимиты проверяются до bcrypt: перебор не должен занимать CPU
+    ip_limiter, user_limiter = get_login_limiters()
+    ip_limiter.hit(client_ip(request))
+    user_limiter.check(user.username)
+    
     db_user = await authenticate_user(db, user.username, user.password)
     if not db_user:
+        user_limiter.hit(user.username)
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    user_limiter.reset(user.username)
     access_token = create_access_token(
-        data={"sub": db_user.username}, 
+        data={"sub": db_user.username, **principal_claims(db_user)}, 
         expires_delta=timedelta(minutes=30)
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 # User endpoints
-@app.get("/users/me")
-async def read_users_me(current_user = Depends(get_current_user)):
-    return current_user
+@app.get("/users/me", response_model=UserResponse)
+async def read_users_me(current_user = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # get_current_user отдает Principal из кэша; профиль читается из БД
+    user = await get_user_by_username(db, current_user.username)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 # AI Detection endpoint - только для обработки изображения
+ANNOTATION_MODES = ("base64", "url", "binary", "none")
+
+def multipart_response(payload: AIDetectionResponse, jpeg: bytes) -> Response:
+    """
+    multipart/mixed: JSON с детекциями + бинарный JPEG без base64.
+    """
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode(),
+        payload.model_dump_json().encode(),
+        f"\r\n--{boundary}\r\nContent-Type: image/jpeg\r\n\r\n".encode(),
+        jpeg,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return Response(content=body, media_type=f"multipart/mixed; boundary={boundary}")
+
 @app.post("/ai/detect", response_model=AIDetectionResponse)
 async def detect_potholes(
     image: UploadFile = File(...),
+    annotation: Optional[str] = None,
+    layout: str = "rows",
     current_user = Depends(get_current_user)
 ):
     """
     Обработка изображения нейросетью для обнаружения ям
     Возвращает аннотированное изображение и информацию об обнаружениях
+    
+    annotation: base64 (в JSON), url (ссылка на сохраненный файл),
+    binary (multipart/mixed с JPEG) или none (только bbox, клиент рисует сам).
+    layout: rows (список detections) или columns (параллельные массивы в columns).
     """
+    annotation = annotation or settings.AI_ANNOTATION_MODE
+    if annotation not in ANNOTATION_MODES:
+        raise HTTPException(status_code=400, detail=f"annotation must be one of {', '.join(ANNOTATION_MODES)}")
+    if layout not in ("rows", "columns"):
+        raise HTTPException(status_code=400, detail="layout must be rows or columns")
+    
     # Проверка типа файла
     if not image.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Создание временного файла
-    file_extension = image.filename.split(".")[-1]
-    temp_filename = f"temp_{uuid.uuid4()}.{file_extension}"
-    temp_path = f"uploads/temp/{temp_filename}"
-    
-    # Создаем директории если их нет
-    os.makedirs("uploads/temp", exist_ok=True)
-    
     try:
-        # Сохраняем временный файл
-        with open(temp_path, "wb") as buffer:
-            content = await image.read()
-            buffer.write(content)
-        
-        # Обработка изображения AI
-        ai_detector = get_ai_detector()
-        has_problem, confidence, category, annotated_image = ai_detector.detect_potholes(temp_path)
+        # Декодируем прямо из буфера загрузки, без временного файла
+        content = await read_upload(image)
         
-        # Получаем детальную информацию
-        details = ai_detector.get_detection_details(temp_path)
+        # Обработка изображения AI (один прогон модели, батчинг + пул инференса).
+        # Исходник без детекций перекодируем только для старого base64-режима.
+        result = await get_batch_scheduler().analyze(
+            content,
+            annotate=annotation != "none",
+            annotation_quality=settings.AI_ANNOTATION_QUALITY,
+            annotation_subsampling=settings.AI_ANNOTATION_SUBSAMPLING,
+            encode_original=annotation == "base64"
+        )
         
         # Формируем ответ
+        width, height = result.image_size or (None, None)
         response = AIDetectionResponse(
-            has_problem=has_problem,
-            confidence=float(confidence),
-            category=category,
-            annotated_image=annotated_image,
-            detection_count=details["total_count"],
-            severity=details["severity"],
-            detections=details["detections"]
+            has_problem=result.has_problem,
+            confidence=float(result.confidence),
+            category=result.category,
+            annotated_image=result.annotated_image if annotation == "base64" else None,
+            detection_count=result.detection_count,
+            severity=result.severity,
+            detections=result.detections if layout == "rows" else [],
+            columns=result.columns() if layout == "columns" else None,
+            image_width=width,
+            image_height=height
         )
         
+        if result.annotated_jpeg is not None:
+            if annotation == "url":
+                path = await asyncio.to_thread(
+                    save_content_addressed, result.annotated_jpeg, settings.AI_ANNOTATION_DIR, "jpg"
+                )
+                response.annotated_image_url = f"/{path}"
+            elif annotation == "binary":
+                return multipart_response(response, result.annotated_jpeg)
+        
         return response
         
+    except (InferenceQueueFull, HTTPException):
+        raise
     except Exception as e:
         logger.error(f"Error processing image: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
-    finally:
-        # Удаляем временный файл
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
 
 # Complaint endpoints with AI processing
 @app.post("/complaints")
@@ -144,38 +269,35 @@ async def create_new_complaint(
     description: str = Form(None),
     lat: float = Form(...),
     lon: float = Form(...),
-    ai_category: str = Form(...),  # Категория от AI
-    ai_confidence: float = Form(...),  # Уверенность от AI
+    ai_category: str = Form(None),  # Категория от AI (если клиент уже вызывал /ai/detect)
+    ai_confidence: float = Form(None),  # Уверенность от AI
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Создание обращения с возможной AI-категоризацией
+    
+    Обращение сохраняется сразу в статусе "processing"; AI-категория (если не
+    передана клиентом), аннотированное изображение и миниатюра заполняются
+    фоновым воркером. Готовность: GET /complaints/{id}/status или
+    /complaints/{id}/events (SSE).
+    
+    Повторное сообщение о той же проблеме (открытое обращение рядом с похожим
+    фото) сохраняется сразу в статусе "duplicate" с duplicate_of, без обработки.
     """
-    print("СЛОВО")
-    print(ai_category)
-    print(ai_confidence)
-    # Save uploaded image
-    file_extension = image.filename.split(".")[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    image_path = f"uploads/{unique_filename}"
-    
-    os.makedirs("uploads", exist_ok=True)
-    
-    with open(image_path, "wb") as buffer:
-        content = await image.read()
-        buffer.write(content)
-    
-    # Если категория не передана от клиента, используем AI для определения
-    if not ai_category:
+    # Save uploaded image: потоково, content-addressed (дубликаты хранятся один раз)
+    image_path, _, _ = await save_upload(image, settings.UPLOAD_ORIGINALS_DIR)
+    
+    image_hash = None
+    primary = None
+    if settings.DEDUP_ENABLED:
         try:
-            ai_detector = get_ai_detector()
-            has_problem, confidence, category, _ = ai_detector.detect_potholes(image_path)
-            if has_problem:
-                ai_category = category
-                ai_confidence = confidence
+            # Из сохраненного файла: загрузка не держится в памяти целиком
+            image_hash = await asyncio.to_thread(stored_image_hash, image_path)
         except Exception as e:
-            logger.warning(f"AI detection failed, proceeding without: {e}")
+            logger.warning(f"⚠️ Не удалось посчитать хэш изображения: {e}")
+    if image_hash:
+        primary = await find_duplicate(db, lat, lon, image_hash)
     
     # Create complaint
     complaint_data = ComplaintCreate(
@@ -183,24 +305,96 @@ async def create_new_complaint(
         description=description,
         lat=lat,
         lon=lon,
-        category=ai_category,
-        ai_confidence = ai_confidence,
-        status="pending"
+        category=ai_category or None,
+        ai_confidence=ai_confidence if ai_category else None,
+        image_hash=image_hash
     )
     
-    complaint = await create_complaint(db, complaint_data, current_user.id)
+    complaint = await create_complaint(db, complaint_data, current_user.id, process=True, duplicate_of=primary)
+    if primary is None:
+        get_job_worker().notify()
+    else:
+        logger.info(f"🔁 Обращение {complaint.id} - дубликат {primary.id}")
     
     return complaint
 
+def copy_upload(upload: UploadFile, path: str):
+    with open(path, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer, settings.STORAGE_CHUNK_SIZE)
+
+async def get_own_complaint(db: AsyncSession, complaint_id: int, current_user):
+    complaint = await get_complaint(db, complaint_id)
+    if not complaint or complaint.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Complaint not found")
+    return complaint
+
+async def get_processing_status(db: AsyncSession, complaint) -> ComplaintProcessingStatus:
+    job = await get_complaint_job(db, complaint.id)
+    return ComplaintProcessingStatus(
+        complaint_id=complaint.id,
+        status=complaint.status,
+        job_state=job.state if job else None,
+        attempts=job.attempts if job else 0,
+        last_error=job.last_error if job else None,
+        category=complaint.category,
+        ai_confidence=complaint.ai_confidence,
+        ai_severity=complaint.ai_severity,
+        annotated_image_path=complaint.annotated_image_path,
+        thumbnail_path=complaint.thumbnail_path
+    )
+
+@app.get("/complaints/{complaint_id}/status", response_model=ComplaintProcessingStatus)
+async def get_complaint_processing_status(
+    complaint_id: int,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    complaint = await get_own_complaint(db, complaint_id, current_user)
+    return await get_processing_status(db, complaint)
+
+@app.get("/complaints/{complaint_id}/events")
+async def stream_complaint_processing_status(
+    complaint_id: int,
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Server-Sent Events: статус обработки, пока задача не завершится.
+    """
+    await get_own_complaint(db, complaint_id, current_user)
+    
+    async def events():
+        last = None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.JOB_EVENTS_TIMEOUT
+        while loop.time() < deadline:
+            async with AsyncSessionLocal() as session:
+                complaint = await get_complaint(session, complaint_id)
+                if complaint is None:
+                    # Обращение удалено во время подписки
+                    yield f"event: deleted\ndata: {json.dumps({'complaint_id': complaint_id})}\n\n"
+                    return
+                status = await get_processing_status(session, complaint)
+            payload = status.model_dump_json()
+            if payload != last:
+                yield f"data: {payload}\n\n"
+                last = payload
+            if status.job_state in (None, "done", "failed"):
+                return
+            await asyncio.sleep(1)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.get("/complaints/my", response_model=ComplaintListResponse)
 async def get_my_complaints(
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    complaints, total = await get_user_complaints(db, current_user.id, skip, limit)
-    return ComplaintListResponse(complaints=complaints, total=total)
+    complaints, total, next_cursor = await get_user_complaints(db, current_user.id, skip, limit, cursor)
+    return ComplaintListResponse(complaints=complaints, total=total, next_cursor=next_cursor)
 
 @app.get("/complaints/{complaint_id}")
 async def get_complaint_by_id(
@@ -208,22 +402,26 @@ async def get_complaint_by_id(
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    complaint = await get_complaint(db, complaint_id)
-    if not complaint or complaint.user_id != current_user.id:
-        raise HTTPException(status_code=404, detail="Complaint not found")
-    return complaint
+    return await get_own_complaint(db, complaint_id, current_user)
 
 # Admin endpoints
+def require_admin(current_user = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin role required")
+    return current_user
+
 @app.get("/admin/complaints")
 async def get_all_complaints_admin(
     status: str = None,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    include_duplicates: bool = False,
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    complaints, total = await get_admin_complaints(db, status, skip, limit)
-    return ComplaintListResponse(complaints=complaints, total=total)
+    complaints, total, next_cursor = await get_admin_complaints(db, status, skip, limit, cursor, include_duplicates)
+    return ComplaintListResponse(complaints=complaints, total=total, next_cursor=next_cursor)
 
 @app.put("/admin/complaints/{complaint_id}")
 async def update_complaint_status(
@@ -238,19 +436,370 @@ async def update_complaint_status(
     
     return updated_complaint
 
+@app.put("/admin/users/{user_id}", response_model=UserResponse)
+async def update_user_admin(
+    user_id: int,
+    user_update: UserUpdate,
+    current_user = Depends(require_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    updated_user = await update_user(db, user_id, user_update)
+    if not updated_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return updated_user
+
+@app.delete("/admin/complaints/{complaint_id}", status_code=204)
+async def delete_complaint_admin(
+    complaint_id: int,
+    current_user = Depends(require_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    if not await delete_complaint(db, complaint_id):
+        raise HTTPException(status_code=404, detail="Complaint not found")
+    return Response(status_code=204)
+
+# Импорты, идущие в этом процессе: import_id -> задача
+_running_imports = {}
+
+async def run_import(manifest_path: str, images_path: str, user_id: int, checkpoint: str, use_ai: bool):
+    executor = get_inference_executor()
+    infer = executor.analyze_batch if use_ai else None
+    try:
+        await import_manifest(
+            manifest_path, images_path, user_id,
+            (lambda contents: infer(contents, annotate=False)) if infer else None,
+            chunk_size=settings.IMPORT_CHUNK_SIZE,
+            ai_batch_size=settings.IMPORT_AI_BATCH_SIZE,
+            checkpoint=checkpoint
+        )
+    except Exception as e:
+        logger.error(f"❌ Импорт {checkpoint} завершился ошибкой: {e}")
+
+def start_import(import_id: str, options: dict) -> asyncio.Task:
+    """
+    Запускает (или продолжает с чекпоинта) импорт из каталога import_id.
+    """
+    work_dir = os.path.join(settings.IMPORT_WORK_DIR, import_id)
+    task = spawn_background(
+        run_import(
+            os.path.join(work_dir, options["manifest"]),
+            os.path.join(work_dir, "images.zip"),
+            options["user_id"],
+            os.path.join(work_dir, "checkpoint.json"),
+            options["use_ai"]
+        ),
+        f"import-{import_id}"
+    )
+    _running_imports[import_id] = task
+    task.add_done_callback(lambda _: _running_imports.pop(import_id, None))
+    return task
+
+def import_work_dir(import_id: str) -> str:
+    work_dir = os.path.join(settings.IMPORT_WORK_DIR, import_id)
+    if not import_id.isalnum() or not os.path.exists(os.path.join(work_dir, "checkpoint.json")):
+        raise HTTPException(status_code=404, detail="Import not found")
+    return work_dir
+
+@app.post("/admin/complaints/import", status_code=202)
+async def import_complaints(
+    manifest: UploadFile = File(...),
+    images: UploadFile = File(...),
+    use_ai: bool = Form(True),
+    current_user = Depends(require_admin)
+):
+    """
+    Массовый импорт обращений: манифест CSV/JSONL + zip с изображениями.
+    
+    Импорт идет в фоне; прогресс: GET /admin/imports/{import_id}, продолжение
+    после сбоя или рестарта: POST /admin/imports/{import_id}/resume.
+    """
+    import_id = uuid.uuid4().hex
+    work_dir = os.path.join(settings.IMPORT_WORK_DIR, import_id)
+    os.makedirs(work_dir, exist_ok=True)
+    
+    manifest_name = "manifest.jsonl" if (manifest.filename or "").endswith((".jsonl", ".ndjson")) else "manifest.csv"
+    await asyncio.to_thread(copy_upload, manifest, os.path.join(work_dir, manifest_name))
+    await asyncio.to_thread(copy_upload, images, os.path.join(work_dir, "images.zip"))
+    
+    # Параметры нужны для продолжения импорта
+    options = {"manifest": manifest_name, "user_id": current_user.id, "use_ai": use_ai}
+    with open(os.path.join(work_dir, "options.json"), "w", encoding="utf-8") as f:
+        json.dump(options, f)
+    
+    checkpoint = os.path.join(work_dir, "checkpoint.json")
+    with open(checkpoint, "w", encoding="utf-8") as f:
+        json.dump({"state": "queued"}, f)
+    start_import(import_id, options)
+    return {"import_id": import_id, "status_url": f"/admin/imports/{import_id}"}
+
+@app.post("/admin/imports/{import_id}/resume", status_code=202)
+async def resume_import(import_id: str, current_user = Depends(require_admin)):
+    """
+    Продолжает прерванный импорт с чекпоинта (уже вставленные строки не повторяются).
+    """
+    work_dir = import_work_dir(import_id)
+    if import_id in _running_imports:
+        raise HTTPException(status_code=409, detail="Import is already running")
+    with open(os.path.join(work_dir, "checkpoint.json"), encoding="utf-8") as f:
+        if json.load(f).get("state") == "done":
+            raise HTTPException(status_code=409, detail="Import is already done")
+    with open(os.path.join(work_dir, "options.json"), encoding="utf-8") as f:
+        options = json.load(f)
+    
+    start_import(import_id, options)
+    return {"import_id": import_id, "status_url": f"/admin/imports/{import_id}"}
+
+@app.get("/admin/imports/{import_id}")
+async def get_import_status(import_id: str, current_user = Depends(require_admin)):
+    work_dir = import_work_dir(import_id)
+    with open(os.path.join(work_dir, "checkpoint.json"), encoding="utf-8") as f:
+        progress = json.load(f)
+    # state "running" без задачи в процессе - импорт прерван, его можно продолжить
+    if progress.get("state") in ("queued", "running") and import_id not in _running_imports:
+        progress["state"] = "interrupted"
+    return progress
+
 # Map endpoints
-@app.get("/map/complaints", response_model=List[MapPoint])
+def split_param(value: Optional[str]) -> Optional[List[str]]:
+    return [item for item in value.split(",") if item] if value else None
+
+def map_viewport(bbox: Optional[str], zoom: Optional[int]) -> Optional[BBox]:
+    if bbox is None:
+        return None
+    try:
+        viewport = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {e}")
+    return snap_bbox(viewport, zoom) if zoom is not None else viewport
+
+def map_etag(request: Request, media_type: Optional[str], last_change, last_delete, db_now) -> Optional[str]:
+    """
+    ETag данных карты: последнее изменение/удаление + параметры запроса и формат.
+    
+    Метки времени в SQLite секундные: пока последнее изменение моложе
+    MAP_SYNC_OVERLAP, в ту же секунду возможна еще одна запись с той же
+    меткой, поэтому ETag не выдается.
+    """
+    latest = max((value for value in (last_change, last_delete) if value is not None), default=None)
+    if latest is not None and db_now - latest < timedelta(seconds=settings.MAP_SYNC_OVERLAP):
+        return None
+    digest = hashlib.sha1(f"{last_change}|{last_delete}|{media_type}|{request.url.query}".encode()).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+def etag_matches(request: Request, etag: Optional[str]) -> bool:
+    if etag is None:
+        return False
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+@app.get("/map/complaints", response_model=Union[List[MapPoint], MapDeltaResponse])
 async def get_complaints_for_map_view(
+    request: Request,
+    response: Response,
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    zoom: Optional[int] = Query(None, ge=0, le=22),
+    status: Optional[str] = Query(None, description="Статусы через запятую"),
+    category: Optional[str] = Query(None, description="Категории через запятую"),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    since: Optional[datetime] = Query(None, description="sync_token предыдущего ответа - только изменения"),
+    limit: int = Query(settings.MAP_MAX_POINTS, ge=1, le=settings.MAP_MAX_POINTS),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Точки карты в области просмотра.
+    
+    bbox ограничивает выборку (R*Tree в SQLite), zoom выравнивает bbox по
+    границам тайлов. Если точек больше limit, возвращаются новейшие и
+    выставляется заголовок X-Map-Truncated.
+    
+    Повторные опросы: If-None-Match -> 304, пока данные не менялись;
+    ?since=<X-Sync-Token> -> MapDeltaResponse только с изменениями.
+    
+    Accept: application/vnd.viafix.columns+json или application/msgpack -
+    колоночный формат (map_encoding.py) вместо массива объектов.
+    """
+    compact = negotiate(request.headers.get("accept"))
+    last_change, last_delete, db_now = await get_map_sync_state(db)
+    etag = map_etag(request, compact, last_change, last_delete, db_now)
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Accept"}
+    if etag:
+        headers["ETag"] = etag
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    # Метка с запасом назад: следующая дельта включит записи, закоммиченные позже чтения
+    sync_token = (db_now - timedelta(seconds=settings.MAP_SYNC_OVERLAP)).isoformat()
+    headers["X-Sync-Token"] = sync_token
+    
+    filters = map_filters(split_param(status), split_param(category), created_after, created_before)
+    viewport = map_viewport(bbox, zoom)
+    
+    if since is not None:
+        if since.tzinfo is not None and db_now.tzinfo is None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        horizon = db_now - timedelta(days=settings.MAP_TOMBSTONE_RETENTION_DAYS)
+        delta = await get_map_delta(db, since, viewport, filters, settings.MAP_DELTA_MAX_ITEMS) if since >= horizon else None
+        upserts, removed = delta or ([], [])
+        if compact:
+            payload = {
+                "upserts": encode_points(upserts, settings.MAP_COORD_SCALE),
+                "removed": removed,
+                "sync_token": sync_token,
+                "reset": delta is None
+            }
+            return Response(content=render(payload, compact), media_type=compact, headers=headers)
+        response.headers.update(headers)
+        return MapDeltaResponse(
+            upserts=[row._asdict() for row in upserts], removed=removed, sync_token=sync_token, reset=delta is None
+        )
+    
+    rows = await get_complaints_for_map(db, viewport, filters, limit)
+    if len(rows) >= limit:
+        headers["X-Map-Truncated"] = "true"
+    if compact:
+        payload = {"points": encode_points(rows, settings.MAP_COORD_SCALE), "truncated": len(rows) >= limit}
+        return Response(content=render(payload, compact), media_type=compact, headers=headers)
+    response.headers.update(headers)
+    return [row._asdict() for row in rows]
+
+@app.get("/map/clusters", response_model=MapClusterResponse)
+async def get_map_clusters_view(
+    zoom: int = Query(..., ge=0, le=22),
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    status: Optional[str] = Query(None, description="Статусы через запятую"),
+    category: Optional[str] = Query(None, description="Категории через запятую"),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    complaints = await get_complaints_for_map(db)
-    return complaints
+    """
+    Кластеры по сетке уровня zoom с разбивкой по статусам и категориям.
+    """
+    filters = map_filters(split_param(status), split_param(category), created_after, created_before)
+    cell_size, clusters = await get_map_clusters(db, zoom, map_viewport(bbox, zoom), filters)
+    return MapClusterResponse(zoom=zoom, cell_size=cell_size, clusters=clusters)
+
+@app.get("/map/tiles/{z}/{x}/{y}")
+async def get_map_tile(
+    z: int,
+    x: int,
+    y: int,
+    status: Optional[str] = Query(None, description="Статусы через запятую"),
+    category: Optional[str] = Query(None, description="Категории через запятую"),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Векторный тайл (MVT): точки с zoom >= MAP_TILE_POINTS_ZOOM, ниже - кластеры.
+    """
+    if mapbox_vector_tile is None:
+        raise HTTPException(status_code=501, detail="Vector tiles require the mapbox-vector-tile package")
+    if not (0 <= z <= 22 and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    
+    cache = get_tile_cache()
+    params = f"status={status}|category={category}"
+    data = cache.get((z, x, y), params)
+    if data is None:
+        filters = map_filters(split_param(status), split_param(category))
+        bbox = tile_bbox(z, x, y)
+        points, clusters = [], []
+        if z >= settings.MAP_TILE_POINTS_ZOOM:
+            points = await get_complaints_for_map(db, bbox, filters, settings.MAP_MAX_POINTS)
+        else:
+            _, clusters = await get_map_clusters(db, z, bbox, filters)
+        data = await asyncio.to_thread(encode_tile, z, x, y, points, clusters)
+        cache.put((z, x, y), params, data)
+    
+    return Response(
+        content=data,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"Cache-Control": f"private, max-age={settings.MAP_TILE_CACHE_TTL}"}
+    )
+
+# Files
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    Один диапазон "bytes=start-end" / "bytes=start-" / "bytes=-suffix".
+    
+    Returns:
+        (start, end) включительно; None - заголовка нет или он не поддерживается.
+    
+    Raises:
+        HTTPException 416: диапазон вне файла.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            start, end = max(size - int(end_text), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+@app.get("/uploads/{path:path}")
+async def serve_upload(path: str, request: Request):
+    """
+    Файлы из хранилища с ETag, Cache-Control и поддержкой Range (206).
+    """
+    storage = get_storage()
+    try:
+        key = storage_key(path)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="File not found")
+    info = await asyncio.to_thread(storage.stat, key)
+    if info is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    etag = f'"{info.etag}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"public, max-age={settings.UPLOAD_CACHE_MAX_AGE}, immutable",
+        "Last-Modified": formatdate(info.modified, usegmt=True),
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    byte_range = parse_range(request.headers.get("range"), info.size)
+    if request.headers.get("if-range") not in (None, etag):
+        byte_range = None  # файл изменился - отдаем целиком
+    start, end = byte_range or (0, info.size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+    
+    chunks = storage.iter_range(key, start, end, settings.STORAGE_CHUNK_SIZE) if info.size else iter(())
+    return StreamingResponse(
+        iterate_in_threadpool(chunks),
+        status_code=206 if byte_range else 200,
+        media_type=media_type,
+        headers=headers
+    )
 
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "ai_enabled": True}
+    executor = get_inference_executor()
+    return {
+        "status": "healthy",
+        "ai_enabled": True,
+        "ai_ready": executor.ready,
+        "ai_executor": executor.stats(),
+        "ai_batching": get_batch_scheduler().stats(),
+        "ai_cache": get_detection_cache().stats() if get_detection_cache() else None,
+        "map_tile_cache": get_tile_cache().stats()
+    }
 
 # Exception handlers
 from fastapi import Request
@@ -258,6 +807,38 @@ from fastapi.responses import JSONResponse
 from fastapi.exception_handlers import request_validation_exception_handler
 from fastapi.exceptions import RequestValidationError
 
+@app.exception_handler(InferenceQueueFull)
+async def inference_queue_full_handler(request: Request, exc: InferenceQueueFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "AI inference is busy, retry later"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many attempts, retry later"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(PasswordHashingBusy)
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Authentication is busy, retry later"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(UploadTooLarge)
+async def upload_too_large_handler(request: Request, exc: UploadTooLarge):
+    return JSONResponse(status_code=413, content={"detail": "File is too large"})
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     return JSONResponse(
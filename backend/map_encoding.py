@@ -0,0 +1,87 @@
+"""
+Компактные форматы ответов карты, выбираемые по заголовку Accept.
+
+- application/vnd.viafix.columns+json - колоночный JSON: параллельные массивы
+  вместо массива объектов;
+- application/msgpack (application/x-msgpack) - те же колонки в MessagePack,
+  требует опционального пакета msgpack.
+
+Колонки строятся прямо из строк БД, без Pydantic на каждую точку:
+координаты квантуются в целые (coord_scale), status/category кодируются
+словарем, created_at - секунды Unix (UTC).
+"""
+import calendar
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import msgpack
+except ImportError:  # опциональная зависимость
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COLUMNS_JSON = "application/vnd.viafix.columns+json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Выбирает компактный формат по Accept (в порядке перечисления клиентом).
+    
+    Returns:
+        Media type или None - обычный JSON.
+    """
+    if not accept:
+        return None
+    for item in accept.split(","):
+        media_type = item.split(";")[0].strip().lower()
+        if media_type in MSGPACK_TYPES and msgpack is not None:
+            return MSGPACK
+        if media_type == COLUMNS_JSON:
+            return COLUMNS_JSON
+    return None
+
+
+def _epoch(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        # SQLite хранит CURRENT_TIMESTAMP в UTC без зоны
+        return calendar.timegm(value.utctimetuple())
+    return int(value.timestamp())
+
+
+def _dictionary(values: Iterable[Optional[str]]) -> Dict[str, Any]:
+    dictionary: Dict[Optional[str], int] = {}
+    codes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+    return {"values": list(dictionary), "codes": codes}
+
+
+def encode_points(rows: List[Any], coord_scale: int) -> Dict[str, Any]:
+    """
+    Колонки точек карты из строк (id, lat, lon, category, status, created_at).
+    """
+    return {
+        "count": len(rows),
+        "coord_scale": coord_scale,  # lat = lat_q / coord_scale
+        "id": [row.id for row in rows],
+        "lat_q": [round(row.lat * coord_scale) for row in rows],
+        "lon_q": [round(row.lon * coord_scale) for row in rows],
+        "status": _dictionary(row.status for row in rows),
+        "category": _dictionary(row.category for row in rows),
+        "created_at": [_epoch(row.created_at) for row in rows],
+    }
+
+
+def render(payload: Dict[str, Any], media_type: str) -> bytes:
+    if media_type == MSGPACK:
+        return msgpack.packb(payload, use_bin_type=True)
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
@@ -0,0 +1,219 @@
+"""
+Слой карты: кластеры по сетке и векторные тайлы (Mapbox Vector Tile).
+
+MVT требует опционального пакета mapbox_vector_tile (pip install
+mapbox-vector-tile); без него /map/tiles отвечает 501.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import settings
+from geo import lat_to_tile_y, lon_to_tile_x
+
+try:
+    import mapbox_vector_tile
+except ImportError:  # опциональная зависимость
+    mapbox_vector_tile = None
+
+log = logging.getLogger(__name__)
+
+TILE_EXTENT = 4096  # координатная сетка тайла MVT
+MAX_ZOOM = 22
+
+TileKey = Tuple[int, int, int]
+
+
+def cluster_cell_size(zoom: int) -> float:
+    """
+    Размер ячейки сетки кластеров в градусах: MAP_CLUSTER_CELL_PX пикселей
+    тайла 256px на уровне zoom.
+    """
+    cells_per_tile = max(1, 256 // settings.MAP_CLUSTER_CELL_PX)
+    return 360.0 / ((1 << zoom) * cells_per_tile)
+
+
+def merge_cluster_rows(rows: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    Сводит строки GROUP BY (ячейка, status, category) в кластеры по ячейкам.
+    
+    Args:
+        rows: строки с полями gx, gy, status, category, count, lat_sum, lon_sum.
+    
+    Returns:
+        Кластеры: центроид, число обращений, разбивка по статусам и категориям.
+    """
+    cells: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for row in rows:
+        cell = cells.get((row.gx, row.gy))
+        if cell is None:
+            cell = cells[(row.gx, row.gy)] = {
+                "count": 0, "lat_sum": 0.0, "lon_sum": 0.0, "statuses": {}, "categories": {}
+            }
+        cell["count"] += row.count
+        cell["lat_sum"] += row.lat_sum
+        cell["lon_sum"] += row.lon_sum
+        status = row.status or "unknown"
+        category = row.category or "unknown"
+        cell["statuses"][status] = cell["statuses"].get(status, 0) + row.count
+        cell["categories"][category] = cell["categories"].get(category, 0) + row.count
+    
+    return [
+        {
+            "lat": cell["lat_sum"] / cell["count"],
+            "lon": cell["lon_sum"] / cell["count"],
+            "count": cell["count"],
+            "statuses": cell["statuses"],
+            "categories": cell["categories"],
+        }
+        for cell in cells.values()
+    ]
+
+
+def _tile_point(lat: float, lon: float, z: int, x: int, y: int) -> str:
+    px = (lon_to_tile_x(lon, z) - x) * TILE_EXTENT
+    py = (lat_to_tile_y(lat, z) - y) * TILE_EXTENT
+    return f"POINT ({px:.0f} {py:.0f})"
+
+
+def encode_tile(z: int, x: int, y: int, points: List[Any], clusters: List[Dict[str, Any]]) -> bytes:
+    """
+    Кодирует тайл: слой "complaints" (точки) и/или "clusters" (агрегаты).
+    
+    Raises:
+        RuntimeError: mapbox_vector_tile не установлен.
+    """
+    if mapbox_vector_tile is None:
+        raise RuntimeError("mapbox_vector_tile is not installed")
+    
+    layers = []
+    if points:
+        layers.append({
+            "name": "complaints",
+            "features": [
+                {
+                    "geometry": _tile_point(point.lat, point.lon, z, x, y),
+                    "properties": {
+                        "id": point.id,
+                        "status": point.status or "",
+                        "category": point.category or "",
+                    },
+                }
+                for point in points
+            ],
+        })
+    if clusters:
+        layers.append({
+            "name": "clusters",
+            "features": [
+                {
+                    "geometry": _tile_point(cluster["lat"], cluster["lon"], z, x, y),
+                    "properties": {
+                        "count": cluster["count"],
+                        **{f"status_{key}": value for key, value in cluster["statuses"].items()},
+                        **{f"category_{key}": value for key, value in cluster["categories"].items()},
+                    },
+                }
+                for cluster in clusters
+            ],
+        })
+    return mapbox_vector_tile.encode(layers, default_options={"extents": TILE_EXTENT, "y_coord_down": True})
+
+
+class TileCache:
+    """
+    LRU/TTL-кэш готовых тайлов с точечной инвалидацией: изменение обращения
+    сбрасывает только тайлы, содержащие его координаты, на всех уровнях zoom.
+    
+    Кэш живет в процессе; при нескольких воркерах uvicorn чужие изменения
+    видны не позже, чем через ttl.
+    """
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[TileKey, str], Tuple[float, bytes]]" = OrderedDict()
+        self._by_tile: Dict[TileKey, Set[str]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, tile: TileKey, params: str) -> Optional[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((tile, params))
+            if entry is not None:
+                expires_at, data = entry
+                if expires_at > now:
+                    self._entries.move_to_end((tile, params))
+                    self.hits += 1
+                    return data
+                self._drop((tile, params))
+            self.misses += 1
+            return None
+
+    def put(self, tile: TileKey, params: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            key = (tile, params)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, data)
+            self._by_tile.setdefault(tile, set()).add(params)
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: Tuple[TileKey, str]):
+        _, data = self._entries.pop(key)
+        self._size -= len(data)
+        tile, params = key
+        variants = self._by_tile.get(tile)
+        if variants is not None:
+            variants.discard(params)
+            if not variants:
+                del self._by_tile[tile]
+
+    def invalidate_point(self, lat: Optional[float], lon: Optional[float]):
+        if lat is None or lon is None:
+            return
+        with self._lock:
+            for z in range(MAX_ZOOM + 1):
+                tile = (z, int(lon_to_tile_x(lon, z)), int(lat_to_tile_y(lat, z)))
+                for params in list(self._by_tile.get(tile, ())):
+                    self._drop((tile, params))
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_tile.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+_tile_cache = None
+
+def get_tile_cache() -> TileCache:
+    """
+    Получение синглтона кэша тайлов.
+    """
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = TileCache(max_bytes=settings.MAP_TILE_CACHE_MAX_BYTES, ttl=settings.MAP_TILE_CACHE_TTL)
+    return _tile_cache
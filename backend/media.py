@@ -0,0 +1,89 @@
+import hashlib
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageOps, features
+
+from storage import get_storage, storage_key
+
+# Формат -> (имя в PIL, расширение файла)
+VARIANT_FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg")}
+
+
+def parse_variant_specs(spec: str) -> List[Tuple[str, int]]:
+    """
+    "thumbnail:320,medium:1280,original:0" -> [(имя, максимальная сторона)];
+    0 - без уменьшения.
+    """
+    variants = []
+    for item in spec.split(","):
+        name, _, max_side = item.strip().partition(":")
+        variants.append((name, int(max_side or 0)))
+    return variants
+
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    pil_format, _ = VARIANT_FORMATS[fmt]
+    buffered = BytesIO()
+    # exif/icc_profile не передаются - метаданные (в т.ч. GPS) не попадают в вариант
+    if pil_format == "JPEG":
+        image.save(buffered, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffered, format="WEBP", quality=quality, method=4)
+    return buffered.getvalue()
+
+
+def build_image_variants(
+    data: bytes,
+    directory: str,
+    variants: List[Tuple[str, int]],
+    formats: List[str],
+    quality: int = 80
+) -> Dict[str, Dict[str, str]]:
+    """
+    Производные изображения: EXIF-ориентация применена, метаданные удалены.
+    
+    Ключи вариантов зависят от хэша исходника и параметров, поэтому уже
+    построенный вариант не строится повторно (даже при повторе задачи).
+    
+    Args:
+        data: исходное изображение.
+        directory: логический каталог вариантов (uploads/variants).
+        variants: [(имя, максимальная сторона или 0)].
+        formats: форматы из VARIANT_FORMATS; webp пропускается, если Pillow собран без него.
+        quality: качество сжатия.
+    
+    Returns:
+        {имя варианта: {формат: логический путь}}
+    """
+    formats = [fmt for fmt in formats if fmt != "webp" or features.check("webp")]
+    digest = hashlib.sha256(data).hexdigest()
+    storage = get_storage()
+    
+    paths: Dict[str, Dict[str, str]] = {}
+    missing = []
+    for name, max_side in variants:
+        for fmt in formats:
+            path = f"{directory}/{digest[:2]}/{digest}/{name}-{max_side}-q{quality}.{VARIANT_FORMATS[fmt][1]}"
+            paths.setdefault(name, {})[fmt] = path
+            if not storage.exists(storage_key(path)):
+                missing.append((name, max_side, fmt, path))
+    if not missing:
+        return paths
+    
+    image = Image.open(BytesIO(data))
+    sides = [max_side for _, max_side, _, _ in missing]
+    if 0 not in sides:
+        image.draft("RGB", (max(sides), max(sides)))  # JPEG декодируется сразу в уменьшенном масштабе
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    
+    # От большего варианта к меньшему: каждый уменьшается из предыдущего
+    current = image
+    for name, max_side in sorted(variants, key=lambda v: v[1] or float("inf"), reverse=True):
+        if max_side and max(current.size) > max_side:
+            current = current.copy()
+            current.thumbnail((max_side, max_side), Image.LANCZOS)
+        for missing_name, _, fmt, path in missing:
+            if missing_name == name:
+                storage.put_bytes(storage_key(path), _encode(current, fmt, quality))
+    return paths
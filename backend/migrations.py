@@ -0,0 +1,140 @@
+"""
+Версионные миграции схемы.
+
+Base.metadata.create_all создает только отсутствующие таблицы и не меняет
+существующие, поэтому изменения схемы описываются здесь. Каждая миграция
+идемпотентна: на новой базе create_all уже создал нужные колонки.
+"""
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+log = logging.getLogger(__name__)
+
+
+def _columns(conn: Connection, table: str) -> set:
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str):
+    if column not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _create_index(conn: Connection, name: str, table: str, columns: List[str]):
+    existing = {index["name"] for index in inspect(conn).get_indexes(table)}
+    if name not in existing:
+        conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+
+
+def _complaint_processing_columns(conn: Connection):
+    _add_column(conn, "complaints", "ai_severity", "VARCHAR(16)")
+    _add_column(conn, "complaints", "annotated_image_path", "VARCHAR(255)")
+    _add_column(conn, "complaints", "thumbnail_path", "VARCHAR(255)")
+
+
+def _complaint_ai_model_column(conn: Connection):
+    _add_column(conn, "complaints", "ai_model", "VARCHAR(64)")
+
+
+def _complaint_access_path_indexes(conn: Connection):
+    # Списки: фильтр + порядок (created_at DESC, id DESC) без сортировки во временном B-дереве
+    _create_index(conn, "ix_complaints_status_created", "complaints", ["status", "created_at", "id"])
+    _create_index(conn, "ix_complaints_user_created", "complaints", ["user_id", "created_at", "id"])
+    _create_index(conn, "ix_complaints_created", "complaints", ["created_at", "id"])
+    # Карта: покрывающий индекс по координатам с полями точки
+    _create_index(conn, "ix_complaints_geo", "complaints", ["lat", "lon", "status", "category", "created_at"])
+    # Выборка задач воркером
+    _create_index(conn, "ix_complaint_jobs_state_run_after", "complaint_jobs", ["state", "run_after"])
+
+
+def _complaint_spatial_index(conn: Connection):
+    """
+    SQLite: R*Tree по координатам, синхронизируемый триггерами.
+    Другие СУБД используют ix_complaints_geo (lat, lon).
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    try:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS complaints_rtree "
+            "USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+        ))
+    except Exception as e:
+        log.warning(f"⚠️ SQLite собран без R*Tree, пространственный индекс не создан: {e}")
+        return
+    conn.execute(text(
+        "INSERT OR REPLACE INTO complaints_rtree "
+        "SELECT id, lat, lat, lon, lon FROM complaints WHERE lat IS NOT NULL AND lon IS NOT NULL"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS complaints_rtree_insert AFTER INSERT ON complaints "
+        "WHEN new.lat IS NOT NULL AND new.lon IS NOT NULL BEGIN "
+        "INSERT OR REPLACE INTO complaints_rtree VALUES (new.id, new.lat, new.lat, new.lon, new.lon); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS complaints_rtree_update AFTER UPDATE OF lat, lon ON complaints BEGIN "
+        "DELETE FROM complaints_rtree WHERE id = old.id; "
+        "INSERT INTO complaints_rtree SELECT new.id, new.lat, new.lat, new.lon, new.lon "
+        "WHERE new.lat IS NOT NULL AND new.lon IS NOT NULL; END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS complaints_rtree_delete AFTER DELETE ON complaints BEGIN "
+        "DELETE FROM complaints_rtree WHERE id = old.id; END"
+    ))
+
+
+def _complaint_updated_index(conn: Connection):
+    # Дельта-синхронизация карты: updated_at >= since и MAX(updated_at) для ETag
+    _create_index(conn, "ix_complaints_updated", "complaints", ["updated_at"])
+
+
+def _complaint_image_variants_column(conn: Connection):
+    _add_column(conn, "complaints", "image_variants", "JSON")
+
+
+def _complaint_dedup_columns(conn: Connection):
+    _add_column(conn, "complaints", "image_hash", "VARCHAR(16)")
+    _add_column(conn, "complaints", "duplicate_of", "INTEGER REFERENCES complaints(id)")
+    _add_column(conn, "complaints", "cluster_size", "INTEGER NOT NULL DEFAULT 1")
+    # Список админа без дубликатов: duplicate_of IS NULL в порядке keyset-пагинации
+    _create_index(conn, "ix_complaints_duplicate_of", "complaints", ["duplicate_of", "created_at", "id"])
+
+
+def _complaint_jobs_claim_index(conn: Connection):
+    # Выборка воркером: state='queued' в порядке id без сортировки
+    _create_index(conn, "ix_complaint_jobs_state_id", "complaint_jobs", ["state", "id"])
+
+
+def _complaint_jobs_kind_column(conn: Connection):
+    _add_column(conn, "complaint_jobs", "kind", "VARCHAR(16) NOT NULL DEFAULT 'process'")
+
+
+# (версия, описание, функция). Новые миграции добавляются только в конец.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "complaint processing columns", _complaint_processing_columns),
+    (2, "complaint ai_model column", _complaint_ai_model_column),
+    (3, "complaint access path indexes", _complaint_access_path_indexes),
+    (4, "complaint spatial index", _complaint_spatial_index),
+    (5, "complaint updated_at index", _complaint_updated_index),
+    (6, "complaint image variants column", _complaint_image_variants_column),
+    (7, "complaint duplicate detection columns", _complaint_dedup_columns),
+    (8, "complaint jobs claim index", _complaint_jobs_claim_index),
+    (9, "complaint jobs kind column", _complaint_jobs_kind_column),
+]
+
+
+def run_migrations(conn: Connection):
+    """
+    Применяет недостающие миграции (вызывается через conn.run_sync).
+    """
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    current = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        log.info(f"🛠️ Миграция {version}: {description}")
+        migrate(conn)
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": version})
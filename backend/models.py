@@ -1,8 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from sqlalchemy.dialects.sqlite import DATETIME as SQLITE_DATETIME
 from database import Base
 
+# В SQLite CURRENT_TIMESTAMP хранится без микросекунд; параметры запросов
+# (например, курсоры пагинации) должны сравниваться в том же формате
+Timestamp = DateTime(timezone=True).with_variant(SQLITE_DATETIME(truncate_microseconds=True), "sqlite")
+
 class User(Base):
     __tablename__ = "users"
     
@@ -42,8 +47,55 @@ class Complaint(Base):
     status = Column(String(32), default='pending')  # 'pending', 'processing', 'in_progress', 'resolved', 'rejected'
     organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=True)
     ai_confidence = Column(Float, nullable=True)  # Уверенность AI в обнаружении (0.0-1.0)
+    ai_severity = Column(String(16), nullable=True)  # none, medium, high, critical
+    ai_model = Column(String(64), nullable=True)  # версия модели, посчитавшей ai_* поля
+    annotated_image_path = Column(String(255), nullable=True)
+    thumbnail_path = Column(String(255), nullable=True)
+    image_variants = Column(JSON, nullable=True)  # {вариант: {формат: путь}}, см. media.build_image_variants
+    image_hash = Column(String(16), nullable=True)  # dHash в hex, см. dedup.perceptual_hash
+    duplicate_of = Column(Integer, ForeignKey("complaints.id"), nullable=True)  # основное обращение для status='duplicate'
+    cluster_size = Column(Integer, default=1, server_default="1", nullable=False)  # сообщений о проблеме, включая дубликаты
+    created_at = Column(Timestamp, server_default=func.now())
+    updated_at = Column(Timestamp, server_default=func.now(), onupdate=func.now())
+    
+    user = relationship("User", back_populates="complaints")
+    organization = relationship("Organization", back_populates="complaints")
+    
+    # Совпадают с миграциями 3, 5 и 7 (migrations.py); проверка планов: check_query_plans.py
+    __table_args__ = (
+        Index("ix_complaints_status_created", "status", "created_at", "id"),
+        Index("ix_complaints_user_created", "user_id", "created_at", "id"),
+        Index("ix_complaints_created", "created_at", "id"),
+        Index("ix_complaints_geo", "lat", "lon", "status", "category", "created_at"),
+        Index("ix_complaints_updated", "updated_at"),
+        Index("ix_complaints_duplicate_of", "duplicate_of", "created_at", "id"),
+    )
+
+class ComplaintTombstone(Base):
+    """Удаленные обращения - для дельта-синхронизации карты (?since=)"""
+    __tablename__ = "complaint_tombstones"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)  # id удаленного обращения
+    lat = Column(Float)
+    lon = Column(Float)
+    deleted_at = Column(Timestamp, server_default=func.now(), index=True)
+
+class ComplaintJob(Base):
+    """Durable очередь фоновой обработки обращений (AI, миниатюры)"""
+    __tablename__ = "complaint_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    complaint_id = Column(Integer, ForeignKey("complaints.id"), nullable=False, index=True)
+    state = Column(String(16), default='queued', index=True)  # 'queued', 'running', 'done', 'failed'
+    kind = Column(String(16), default='process', server_default='process', nullable=False)  # 'process' (AI + изображения) или 'media' (только изображения)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    run_after = Column(DateTime, nullable=True)  # UTC; повтор не раньше этого времени
+    locked_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
-    user = relationship("User", back_populates="complaints")
-    organization = relationship("Organization", back_populates="complaints")
\ No newline at end of file
+    __table_args__ = (
+        Index("ix_complaint_jobs_state_run_after", "state", "run_after"),
+        Index("ix_complaint_jobs_state_id", "state", "id"),  # миграция 8: FIFO-выборка воркером
+    )
@@ -0,0 +1,82 @@
+"""
+Ограничение частоты запросов в процессе (скользящее окно).
+
+Используется для входа и регистрации: каждая попытка стоит bcrypt-хэширования,
+поэтому без лимита перебор паролей выедает CPU всего API.
+"""
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from config import settings
+
+
+class RateLimited(Exception):
+    """Лимит исчерпан; API отвечает 429 с Retry-After"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too many attempts")
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class SlidingWindowLimiter:
+    """
+    Не больше limit событий за window секунд на ключ.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._events: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def _trim(self, events: Deque[float], now: float):
+        while events and events[0] <= now - self.window:
+            events.popleft()
+
+    def check(self, key: str):
+        """
+        Raises:
+            RateLimited: лимит для key исчерпан.
+        """
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                return
+            self._trim(events, now)
+            if len(events) >= self.limit:
+                raise RateLimited(events[0] + self.window - now)
+
+    def hit(self, key: str):
+        """
+        Учитывает событие; при исчерпанном лимите - RateLimited без учета.
+        """
+        self.check(key)
+        now = time.monotonic()
+        with self._lock:
+            if len(self._events) >= self.max_keys:
+                # Защита памяти при переборе ключей: выбрасываем пустые/старые окна
+                for stale_key in [k for k, v in self._events.items() if not v or v[-1] <= now - self.window]:
+                    del self._events[stale_key]
+            self._events.setdefault(key, deque()).append(now)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._events.pop(key, None)
+
+
+_login_ip_limiter = None
+_login_user_limiter = None
+
+def get_login_limiters():
+    """
+    Синглтоны лимитеров входа: (по IP - все попытки, по пользователю - неудачные).
+    """
+    global _login_ip_limiter, _login_user_limiter
+    if _login_ip_limiter is None:
+        _login_ip_limiter = SlidingWindowLimiter(settings.LOGIN_RATE_PER_IP, settings.LOGIN_RATE_WINDOW)
+        _login_user_limiter = SlidingWindowLimiter(settings.LOGIN_FAILURES_PER_USER, settings.LOGIN_RATE_WINDOW)
+    return _login_ip_limiter, _login_user_limiter
@@ -13,6 +13,7 @@ class ComplaintStatus(str, Enum):
     in_progress = "in_progress"
     resolved = "resolved"
     rejected = "rejected"
+    duplicate = "duplicate"  # повторное сообщение, см. duplicate_of
 
 class ComplaintCategory(str, Enum):
     pothole = "pothole"
@@ -40,6 +41,11 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class UserUpdate(BaseModel):
+    role: Optional[UserRole] = None
+    is_active: Optional[bool] = None
+    language: Optional[str] = None
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -58,6 +64,7 @@ class ComplaintCreate(BaseModel):
     lon: float
     category: Optional[str] = None
     ai_confidence: Optional[float] = None
+    image_hash: Optional[str] = None
 
 class ComplaintResponse(BaseModel):
     id: int
@@ -70,12 +77,30 @@ class ComplaintResponse(BaseModel):
     status: ComplaintStatus
     organization_id: Optional[int]
     ai_confidence: Optional[float]
+    ai_severity: Optional[str] = None
+    annotated_image_path: Optional[str] = None
+    thumbnail_path: Optional[str] = None
+    image_variants: Optional[Dict[str, Dict[str, str]]] = None  # {thumbnail|medium|original: {webp|jpeg: путь}}
+    duplicate_of: Optional[int] = None
+    cluster_size: int = 1
     created_at: datetime
     updated_at: datetime
     
     class Config:
         from_attributes = True
 
+class ComplaintProcessingStatus(BaseModel):
+    complaint_id: int
+    status: ComplaintStatus
+    job_state: Optional[str] = None  # queued, running, done, failed
+    attempts: int = 0
+    last_error: Optional[str] = None
+    category: Optional[str] = None
+    ai_confidence: Optional[float] = None
+    ai_severity: Optional[str] = None
+    annotated_image_path: Optional[str] = None
+    thumbnail_path: Optional[str] = None
+
 class ComplaintUpdate(BaseModel):
     status: Optional[ComplaintStatus] = None
     organization_id: Optional[int] = None
@@ -84,15 +109,35 @@ class ComplaintUpdate(BaseModel):
 class ComplaintListResponse(BaseModel):
     complaints: List[ComplaintResponse]
     total: int
+    next_cursor: Optional[str] = None  # передать как ?cursor= для следующей страницы
 
 class MapPoint(BaseModel):
     id: int
     lat: float
     lon: float
-    category: str
+    category: Optional[str] = None  # None, пока обращение в обработке
     status: str
     created_at: datetime
 
+class MapDeltaResponse(BaseModel):
+    """Ответ /map/complaints?since=: сначала удалить removed, затем применить upserts"""
+    upserts: List[MapPoint] = []
+    removed: List[int] = []
+    sync_token: str  # передать как ?since= при следующем опросе
+    reset: bool = False  # дельта недоступна - загрузить карту заново без since
+
+class MapCluster(BaseModel):
+    lat: float  # центроид
+    lon: float
+    count: int
+    statuses: Dict[str, int]
+    categories: Dict[str, int]
+
+class MapClusterResponse(BaseModel):
+    zoom: int
+    cell_size: float  # размер ячейки сетки в градусах
+    clusters: List[MapCluster]
+
 # AI Detection models
 class Detection(BaseModel):
     id: int
@@ -100,11 +145,22 @@ class Detection(BaseModel):
     bbox: List[float] = Field(..., description="Bounding box coordinates [x1, y1, x2, y2]")
     area: float
 
+class DetectionColumns(BaseModel):
+    """Detections as parallel arrays, sorted by confidence"""
+    confidence: List[float]
+    bbox: List[List[float]]
+    area: List[float]
+    class_id: List[int]
+
 class AIDetectionResponse(BaseModel):
     has_problem: bool
     confidence: float = Field(..., ge=0.0, le=1.0)
     category: str
     annotated_image: Optional[str] = Field(None, description="Base64 encoded annotated image")
+    annotated_image_url: Optional[str] = Field(None, description="URL of the stored annotated image")
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
     detection_count: int = Field(..., ge=0)
     severity: str = Field(..., description="none, medium, high, critical, error")
-    detections: List[Detection] = Field(default_factory=list)
\ No newline at end of file
+    detections: List[Detection] = Field(default_factory=list)
+    columns: Optional[DetectionColumns] = None
\ No newline at end of file
@@ -0,0 +1,369 @@
+"""
+Хранилище файлов (изображения обращений, аннотации, миниатюры).
+
+Бэкенды (STORAGE_BACKEND):
+- local - каталог STORAGE_LOCAL_ROOT (по умолчанию uploads/);
+- s3 - S3-совместимое хранилище (AWS, MinIO), требует опционального boto3;
+- memory - в памяти процесса, замена S3/MinIO для локальных проверок.
+
+В БД хранится логический путь "uploads/<ключ>" (как и раньше), поэтому
+старые записи читаются без миграции; отдает файлы GET /uploads/{key}.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+from config import settings
+
+try:
+    import boto3
+except ImportError:  # опциональная зависимость
+    boto3 = None
+
+log = logging.getLogger(__name__)
+
+PATH_PREFIX = "uploads/"
+_EXTENSION_RE = re.compile(r"^[a-z0-9]{1,8}$")
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File too large (limit {max_bytes} bytes)")
+        self.max_bytes = max_bytes
+
+
+@dataclass
+class ObjectInfo:
+    size: int
+    modified: float  # unix time
+    etag: str
+
+
+def storage_key(path: str) -> str:
+    """
+    Логический путь uploads/... -> ключ хранилища (с проверкой выхода за корень).
+    """
+    key = path[len(PATH_PREFIX):] if path.startswith(PATH_PREFIX) else path
+    key = key.lstrip("/")
+    # Скрытые части пути (в т.ч. .tmp для незавершенных загрузок) не адресуются
+    if not key or any(part == "" or part.startswith(".") for part in key.split("/")):
+        raise ValueError(f"Invalid storage path: {path}")
+    return key
+
+
+def storage_path(key: str) -> str:
+    return PATH_PREFIX + key
+
+
+def safe_extension(filename: Optional[str], default: str = "jpg") -> str:
+    extension = (filename or "").rsplit(".", 1)[-1].lower() if "." in (filename or "") else ""
+    return extension if _EXTENSION_RE.match(extension) else default
+
+
+def content_key(directory: str, digest: str, extension: str) -> str:
+    """Ключ content-addressed файла: <каталог>/<sha256>.<ext>"""
+    return f"{storage_key(directory)}/{digest}.{extension}"
+
+
+def _digest_etag(key: str) -> Optional[str]:
+    # Имя content-addressed файла уже является хэшем содержимого
+    name = key.rsplit("/", 1)[-1].split(".", 1)[0]
+    return name if len(name) == 64 and all(c in "0123456789abcdef" for c in name) else None
+
+
+class Storage:
+    """
+    Синхронный интерфейс бэкенда; из async-кода вызывается через asyncio.to_thread.
+    """
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        raise NotImplementedError
+
+    def put_bytes(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def put_file(self, key: str, local_path: str):
+        """Перемещает/загружает временный файл под ключом key"""
+        raise NotImplementedError
+
+    def get_bytes(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        """Файловый объект с seek (для Pillow), по возможности без чтения в память"""
+        return BytesIO(self.get_bytes(key))
+
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+        """Байты [start, end] включительно, кусками"""
+        raise NotImplementedError
+
+    def spool_dir(self) -> Optional[str]:
+        """Каталог для временных файлов загрузки (тот же диск - атомарный rename)"""
+        return None
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            st = self._path(key).stat()
+        except FileNotFoundError:
+            return None
+        return ObjectInfo(size=st.st_size, modified=st.st_mtime, etag=_digest_etag(key) or f"{st.st_size:x}-{int(st.st_mtime):x}")
+
+    def put_bytes(self, key: str, data: bytes):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as buffer:
+            buffer.write(data)
+        os.replace(tmp_path, path)
+
+    def put_file(self, key: str, local_path: str):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(local_path, path)
+
+    def get_bytes(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def spool_dir(self) -> Optional[str]:
+        path = self.root / ".tmp"
+        path.mkdir(parents=True, exist_ok=True)
+        return str(path)
+
+
+class S3Storage(Storage):
+    """
+    S3-совместимое хранилище; endpoint_url задает MinIO и аналоги.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 access_key: Optional[str] = None, secret_key: Optional[str] = None):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client = boto3.client(
+            "s3", endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key
+        )
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return ObjectInfo(
+            size=head["ContentLength"],
+            modified=head["LastModified"].timestamp(),
+            etag=_digest_etag(key) or head["ETag"].strip('"')
+        )
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def put_bytes(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def put_file(self, key: str, local_path: str):
+        try:
+            self.client.upload_file(local_path, self.bucket, self._key(key))  # multipart для больших файлов
+        finally:
+            os.unlink(local_path)
+
+    def get_bytes(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    def open(self, key: str) -> BinaryIO:
+        # Тело ответа S3 не поддерживает seek: кусками во временный файл
+        spooled = tempfile.SpooledTemporaryFile(max_size=settings.STORAGE_CHUNK_SIZE)
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+        for chunk in body.iter_chunks(settings.STORAGE_CHUNK_SIZE):
+            spooled.write(chunk)
+        spooled.seek(0)
+        return spooled
+
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{end}")["Body"]
+        yield from body.iter_chunks(chunk_size)
+
+
+class MemoryStorage(Storage):
+    """Хранилище в памяти - замена S3/MinIO для локальных проверок"""
+
+    def __init__(self):
+        self._objects: Dict[str, Tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def stat(self, key: str) -> Optional[ObjectInfo]:
+        with self._lock:
+            entry = self._objects.get(key)
+        if entry is None:
+            return None
+        data, modified = entry
+        return ObjectInfo(size=len(data), modified=modified, etag=_digest_etag(key) or hashlib.md5(data).hexdigest())
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            return key in self._objects
+
+    def put_bytes(self, key: str, data: bytes):
+        with self._lock:
+            self._objects[key] = (bytes(data), time.time())
+
+    def put_file(self, key: str, local_path: str):
+        with open(local_path, "rb") as f:
+            self.put_bytes(key, f.read())
+        os.unlink(local_path)
+
+    def get_bytes(self, key: str) -> bytes:
+        with self._lock:
+            entry = self._objects.get(key)
+        if entry is None:
+            raise FileNotFoundError(key)
+        return entry[0]
+
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+        data = self.get_bytes(key)
+        for offset in range(start, end + 1, chunk_size):
+            yield data[offset:min(offset + chunk_size, end + 1)]
+
+
+_storage = None
+
+def get_storage() -> Storage:
+    """
+    Получение синглтона хранилища по STORAGE_BACKEND.
+    """
+    global _storage
+    if _storage is None:
+        backend = settings.STORAGE_BACKEND
+        if backend == "local":
+            _storage = LocalStorage(settings.STORAGE_LOCAL_ROOT)
+        elif backend == "s3":
+            _storage = S3Storage(
+                bucket=settings.S3_BUCKET,
+                prefix=settings.S3_PREFIX,
+                endpoint_url=settings.S3_ENDPOINT_URL,
+                region=settings.S3_REGION,
+                access_key=settings.S3_ACCESS_KEY,
+                secret_key=settings.S3_SECRET_KEY
+            )
+        elif backend == "memory":
+            _storage = MemoryStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+        log.info(f"🗄️ Хранилище файлов: {backend}")
+    return _storage
+
+
+def save_content_addressed(data: bytes, directory: str, extension: str) -> str:
+    """
+    Сохраняет байты один раз под именем-хэшем содержимого (синхронно).
+    
+    Returns:
+        Логический путь вида uploads/annotated/<sha256>.jpg
+    """
+    key = content_key(directory, hashlib.sha256(data).hexdigest(), extension)
+    storage = get_storage()
+    if not storage.exists(key):
+        storage.put_bytes(key, data)
+    return storage_path(key)
+
+
+def read_file(path: str) -> bytes:
+    """Содержимое файла по логическому пути (синхронно)"""
+    return get_storage().get_bytes(storage_key(path))
+
+
+def open_file(path: str) -> BinaryIO:
+    """Файловый объект по логическому пути (синхронно; закрывает вызывающий)"""
+    return get_storage().open(storage_key(path))
+
+
+async def save_upload(upload, directory: str, max_bytes: Optional[int] = None, keep_bytes: bool = False):
+    """
+    Потоково сохраняет загрузку: куски пишутся во временный файл с подсчетом
+    SHA-256 и проверкой размера, затем файл переносится под content-addressed
+    ключ (дубликат не сохраняется повторно).
+    
+    Args:
+        upload: fastapi.UploadFile.
+        directory: логический каталог (например, uploads/originals).
+        max_bytes: лимит размера; превышение - UploadTooLarge сразу при чтении.
+        keep_bytes: вернуть также содержимое (когда оно все равно нужно в памяти).
+    
+    Returns:
+        (логический путь, размер, содержимое или None)
+    """
+    max_bytes = max_bytes or settings.MAX_UPLOAD_BYTES
+    storage = get_storage()
+    digest = hashlib.sha256()
+    size = 0
+    chunks = [] if keep_bytes else None
+    
+    fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, suffix=".upload", dir=storage.spool_dir())
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            while chunk := await upload.read(settings.STORAGE_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(chunk)
+                if keep_bytes:
+                    chunks.append(chunk)
+                await asyncio.to_thread(tmp.write, chunk)
+        
+        key = content_key(directory, digest.hexdigest(), safe_extension(upload.filename))
+        if await asyncio.to_thread(storage.exists, key):
+            await asyncio.to_thread(os.unlink, tmp_path)
+        else:
+            await asyncio.to_thread(storage.put_file, key, tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    
+    return storage_path(key), size, (b"".join(chunks) if keep_bytes else None)
@@ -0,0 +1,89 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from ai_backends import _match_detections, check_parity, main
+from config import settings
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PARITY_IMAGES = [str(BACKEND_DIR / "rfx7azu7wji.jpg"), str(BACKEND_DIR / "zidane.jpg")]
+
+
+def detections(boxes, scores, category="pothole", severity="medium"):
+    boxes = np.array(boxes, dtype=float).reshape(-1, 4)
+    return SimpleNamespace(
+        detection_count=len(boxes),
+        category=category,
+        severity=severity,
+        boxes=boxes,
+        scores=np.array(scores, dtype=float),
+        areas=(boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]),
+    )
+
+
+def test_identical_detections_match():
+    reference = detections([[0, 0, 10, 10], [20, 20, 40, 40]], [0.9, 0.6])
+    assert _match_detections(reference, reference, 0.9, 0.05) == []
+
+
+def test_order_of_candidate_boxes_does_not_matter():
+    reference = detections([[0, 0, 10, 10], [20, 20, 40, 40]], [0.9, 0.6])
+    candidate = detections([[20, 20, 40, 40.2], [0, 0, 10.1, 10]], [0.61, 0.88])
+    assert _match_detections(reference, candidate, 0.9, 0.05) == []
+
+
+def test_count_mismatch_is_reported_alone():
+    reference = detections([[0, 0, 10, 10], [20, 20, 40, 40]], [0.9, 0.6])
+    candidate = detections([[0, 0, 10, 10]], [0.9])
+    problems = _match_detections(reference, candidate, 0.9, 0.05)
+    assert problems == ["count 2 != 1"]
+
+
+def test_shifted_box_and_confidence_drift_are_reported():
+    reference = detections([[0, 0, 10, 10], [20, 20, 40, 40]], [0.9, 0.6])
+    candidate = detections([[5, 5, 15, 15], [20, 20, 40, 40]], [0.9, 0.4])
+    problems = _match_detections(reference, candidate, 0.9, 0.05)
+    assert len(problems) == 2
+    assert problems[0].startswith("box [0.0, 0.0, 10.0, 10.0] has no match")
+    assert "conf 0.600 != 0.400" in problems[1]
+
+
+def test_each_candidate_box_matches_once():
+    reference = detections([[0, 0, 10, 10], [0, 0, 10, 10]], [0.9, 0.9])
+    candidate = detections([[0, 0, 10, 10], [50, 50, 60, 60]], [0.9, 0.9])
+    problems = _match_detections(reference, candidate, 0.9, 0.05)
+    assert len(problems) == 1 and "has no match" in problems[0]
+
+
+def test_category_and_severity_mismatch():
+    reference = detections([[0, 0, 10, 10]], [0.9])
+    candidate = detections([[0, 0, 10, 10]], [0.9], category="possible_pothole", severity="high")
+    assert _match_detections(reference, candidate, 0.9, 0.05) == [
+        "category pothole != possible_pothole",
+        "severity medium != high",
+    ]
+
+
+def test_export_requires_backend_when_default_is_torch(monkeypatch):
+    monkeypatch.setattr("ai_backends.settings.AI_BACKEND", "torch")
+    with pytest.raises(SystemExit):
+        main(["export"])
+
+
+@pytest.mark.parametrize("backend, runtime", [
+    ("onnx", "onnxruntime"),
+    ("openvino", "openvino"),
+    ("torchscript", "torch"),
+])
+def test_exported_backend_matches_torch(backend, runtime, tmp_path, monkeypatch):
+    pytest.importorskip("ultralytics")
+    pytest.importorskip(runtime)
+    model_path = BACKEND_DIR / settings.AI_MODEL_PATH
+    if not model_path.exists():
+        pytest.skip(f"нет файла модели {model_path}")
+    monkeypatch.setattr("ai_backends.settings.AI_EXPORT_DIR", str(tmp_path))
+
+    mismatches = check_parity(backend, PARITY_IMAGES, str(model_path), iou_threshold=0.9, conf_tolerance=0.05)
+    assert mismatches == {}, mismatches
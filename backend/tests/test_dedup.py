@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from database import create_engine_for
+from dedup import hamming
+from migrations import run_migrations
+from models import Base, Complaint, User
+
+LAT, LON = 55.75, 37.61
+PHOTO_HASH = "0f0f0f0f0f0f0f0f"
+SAME_POTHOLE_HASH = "0f0f0f0f0f0f0f0e"  # 1 бит отличия
+OTHER_POTHOLE_HASH = "f0f0f0f0f0f0f0f0"
+
+
+async def _find_in_dense_area(tmp_path, neighbours: int, image_hash: str = PHOTO_HASH):
+    """
+    Старое обращение о той же яме и neighbours более новых о других ямах
+    в нескольких метрах от него.
+    """
+    engine = create_engine_for(f"sqlite+aiosqlite:///{tmp_path / 'dedup.db'}", echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    created = datetime(2024, 1, 1)
+    rows = [dict(id=1, user_id=1, lat=LAT, lon=LON, status="pending", image_hash=SAME_POTHOLE_HASH, created_at=created)]
+    rows += [
+        dict(
+            id=i + 2, user_id=1, lat=LAT + (i % 10) * 1e-5, lon=LON + (i // 10) * 1e-5,
+            status="pending", image_hash=OTHER_POTHOLE_HASH, created_at=created + timedelta(minutes=i + 1)
+        )
+        for i in range(neighbours)
+    ]
+    async with session_factory() as db:
+        db.add(User(id=1, username="user", email="user@example.com", hashed_password="x"))
+        await db.flush()
+        await db.execute(insert(Complaint), rows)
+        await db.commit()
+
+    async with session_factory() as db:
+        found = await crud.find_duplicate(db, LAT, LON, image_hash)
+    await engine.dispose()
+    return found
+
+
+def test_duplicate_found_behind_many_newer_neighbours(tmp_path):
+    assert hamming(PHOTO_HASH, OTHER_POTHOLE_HASH) > 10
+    found = asyncio.run(_find_in_dense_area(tmp_path, neighbours=300))
+    assert found is not None and found.id == 1
+
+
+def test_unrelated_photo_has_no_duplicate(tmp_path):
+    assert asyncio.run(_find_in_dense_area(tmp_path, neighbours=5, image_hash="00ff00ff00ff00ff")) is None
@@ -0,0 +1,87 @@
+import asyncio
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import jobs
+from database import create_engine_for
+from migrations import run_migrations
+from models import Base, Complaint, ComplaintJob, User
+
+
+async def _setup(tmp_path):
+    engine = create_engine_for(f"sqlite+aiosqlite:///{tmp_path / 'jobs.db'}", echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with session_factory() as db:
+        db.add(User(id=1, username="user", email="user@example.com", hashed_password="x"))
+        db.add(Complaint(id=1, user_id=1, image_path="a.jpg", lat=55.75, lon=37.61, status="processing"))
+        db.add(ComplaintJob(id=1, complaint_id=1, state="running", attempts=1))
+        await db.commit()
+    return engine, session_factory
+
+
+async def _status_after_admin_change(tmp_path, monkeypatch, fail: bool) -> tuple:
+    """
+    Админ меняет статус, пока enrich_complaint обрабатывает обращение.
+    """
+    engine, session_factory = await _setup(tmp_path)
+    monkeypatch.setattr(jobs, "AsyncSessionLocal", session_factory)
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def blocking_enrich(complaint, ai=True):
+        started.set()
+        await release.wait()
+        complaint.category = "pothole"
+        if fail:
+            raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(jobs, "enrich_complaint", blocking_enrich)
+    worker = jobs.ComplaintJobWorker(max_attempts=1)
+    task = asyncio.create_task(worker._process(1))
+    await started.wait()
+
+    async with session_factory() as db:
+        await db.execute(update(Complaint).where(Complaint.id == 1).values(status="rejected"))
+        await db.commit()
+    release.set()
+    await task
+
+    async with session_factory() as db:
+        complaint = await db.get(Complaint, 1)
+        job = await db.get(ComplaintJob, 1)
+        result = (complaint.status, complaint.category, job.state)
+    await engine.dispose()
+    return result
+
+
+def test_admin_status_change_during_processing_is_kept(tmp_path, monkeypatch):
+    status, category, state = asyncio.run(_status_after_admin_change(tmp_path, monkeypatch, fail=False))
+    assert (status, category, state) == ("rejected", "pothole", "done")
+
+
+def test_admin_status_change_kept_when_job_fails(tmp_path, monkeypatch):
+    status, _, state = asyncio.run(_status_after_admin_change(tmp_path, monkeypatch, fail=True))
+    assert (status, state) == ("rejected", "failed")
+
+
+def test_processing_becomes_pending_after_job(tmp_path, monkeypatch):
+    async def run():
+        engine, session_factory = await _setup(tmp_path)
+        monkeypatch.setattr(jobs, "AsyncSessionLocal", session_factory)
+
+        async def enrich(complaint, ai=True):
+            pass
+
+        monkeypatch.setattr(jobs, "enrich_complaint", enrich)
+        await jobs.ComplaintJobWorker()._process(1)
+        async with session_factory() as db:
+            status = (await db.get(Complaint, 1)).status
+        await engine.dispose()
+        return status
+
+    assert asyncio.run(run()) == "pending"
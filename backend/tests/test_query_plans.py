@@ -0,0 +1,14 @@
+import asyncio
+
+from check_query_plans import SQLITE_HOT_BAD_PLAN, check
+
+
+def test_crud_and_job_queries_use_indexes(tmp_path):
+    failures = asyncio.run(check(f"sqlite+aiosqlite:///{tmp_path / 'plans.db'}"))
+    assert failures == [], "\n".join(f"{' '.join(statement.split())[:200]}: {bad}" for statement, bad in failures)
+
+
+def test_full_index_scan_counts_as_regression_for_hot_queries():
+    assert any(p.search("SCAN complaints USING INDEX ix_complaints_created") for p in SQLITE_HOT_BAD_PLAN)
+    assert any(p.search("SCAN complaint_jobs") for p in SQLITE_HOT_BAD_PLAN)
+    assert not any(p.search("SCAN complaints_rtree VIRTUAL TABLE INDEX 2:B0D1B2D3") for p in SQLITE_HOT_BAD_PLAN)
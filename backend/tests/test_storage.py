@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+import storage
+from auth import get_current_user
+from storage import LocalStorage, MemoryStorage, UploadTooLarge, save_upload, storage_key
+
+
+class ChunkedUpload:
+    """UploadFile, отдающий содержимое заданными кусками"""
+
+    def __init__(self, chunks, filename="photo.jpg"):
+        self.filename = filename
+        self._chunks = list(chunks)
+        self.reads = 0
+
+    async def read(self, size=-1):
+        self.reads += 1
+        return self._chunks.pop(0) if self._chunks else b""
+
+
+class StreamUpload:
+    """UploadFile без известного размера, запоминающий запрошенные длины"""
+
+    size = None
+
+    def __init__(self, content):
+        self._stream = BytesIO(content)
+        self.requested = []
+
+    async def read(self, size=-1):
+        self.requested.append(size)
+        return self._stream.read(size)
+
+
+@pytest.fixture
+def local_storage(tmp_path, monkeypatch):
+    backend = LocalStorage(str(tmp_path))
+    monkeypatch.setattr(storage, "_storage", backend)
+    return backend
+
+
+@pytest.fixture
+def memory_storage(monkeypatch):
+    backend = MemoryStorage()
+    monkeypatch.setattr(storage, "_storage", backend)
+    return backend
+
+
+def stored_files(root):
+    return [path for path in root.rglob("*") if path.is_file()]
+
+
+def test_upload_over_limit_stops_reading_and_leaves_no_spool_file(local_storage, tmp_path):
+    upload = ChunkedUpload([b"x" * 100] * 10)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(save_upload(upload, "uploads/originals", max_bytes=250))
+    assert upload.reads == 3
+    assert stored_files(tmp_path) == []
+
+
+def test_oversized_complaint_upload_is_rejected_with_413(local_storage, tmp_path, monkeypatch):
+    monkeypatch.setattr("storage.settings.MAX_UPLOAD_BYTES", 1000)
+    monkeypatch.setattr("storage.settings.STORAGE_CHUNK_SIZE", 100)
+    main.app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=1, role="user")
+    try:
+        response = TestClient(main.app).post(
+            "/complaints",
+            data={"lat": "55.75", "lon": "37.61"},
+            files={"image": ("photo.jpg", b"x" * 5000, "image/jpeg")},
+        )
+    finally:
+        main.app.dependency_overrides.pop(get_current_user)
+    assert response.status_code == 413
+    assert stored_files(tmp_path) == []
+
+
+def test_read_upload_never_buffers_past_limit(monkeypatch):
+    monkeypatch.setattr("main.settings.STORAGE_CHUNK_SIZE", 64)
+    upload = StreamUpload(b"x" * 1000)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.read_upload(upload, max_bytes=100))
+    assert error.value.status_code == 413
+    assert sum(upload.requested) == 101
+
+    assert asyncio.run(main.read_upload(StreamUpload(b"x" * 100), max_bytes=100)) == b"x" * 100
+
+
+def test_identical_uploads_are_stored_once(memory_storage):
+    content = b"\xff\xd8" + bytes(range(256)) * 40
+    first, size, _ = asyncio.run(save_upload(ChunkedUpload([content[:5000], content[5000:]]), "uploads/originals"))
+    second, _, _ = asyncio.run(save_upload(ChunkedUpload([content]), "uploads/originals"))
+    assert first == second == f"uploads/originals/{hashlib.sha256(content).hexdigest()}.jpg"
+    assert size == len(content)
+    assert list(memory_storage._objects) == [storage_key(first)]
+
+
+@pytest.mark.parametrize("path", [
+    "",
+    "uploads/",
+    "uploads/../complaints.db",
+    "uploads/originals/../../.env",
+    "uploads/.tmp/tmp123.upload",
+    "uploads/originals/.hidden.jpg",
+    "uploads/originals//photo.jpg",
+])
+def test_storage_key_rejects_traversal_and_hidden_parts(path):
+    with pytest.raises(ValueError):
+        storage_key(path)
+
+
+def test_storage_key_strips_logical_prefix():
+    assert storage_key("uploads/originals/photo.jpg") == "originals/photo.jpg"
+
+
+def test_uploads_range_and_conditional_requests(memory_storage):
+    content = bytes(range(100))
+    key = f"originals/{hashlib.sha256(content).hexdigest()}.jpg"
+    memory_storage.put_bytes(key, content)
+    client = TestClient(main.app)
+
+    response = client.get(f"/uploads/{key}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 10-19/100"
+    assert response.content == content[10:20]
+
+    response = client.get(f"/uploads/{key}", headers={"Range": "bytes=-5"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 95-99/100"
+    assert response.content == content[95:]
+
+    etag = client.get(f"/uploads/{key}").headers["etag"]
+    response = client.get(f"/uploads/{key}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
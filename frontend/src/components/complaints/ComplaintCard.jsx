@@ -19,7 +19,8 @@ const ComplaintCard = ({ complaint, onStatusUpdate }) => {
       processing: 'status-processing',
       in_progress: 'status-processing',
       resolved: 'status-resolved',
-      rejected: 'error-color'
+      rejected: 'error-color',
+      duplicate: 'status-pending'
     };
     return colors[status] || 'status-pending';
   };
@@ -30,7 +31,8 @@ const ComplaintCard = ({ complaint, onStatusUpdate }) => {
       processing: 'В обработке',
       in_progress: 'В работе',
       resolved: 'Решена',
-      rejected: 'Отклонена'
+      rejected: 'Отклонена',
+      duplicate: 'Дубликат'
     };
     return labels[status] || status;
   };
@@ -102,6 +104,22 @@ const ComplaintCard = ({ complaint, onStatusUpdate }) => {
           </div>
         )}
 
+        {complaint.cluster_size > 1 && (
+          <div style={{ display: 'flex', justifyContent: 'space-between', marginBottom: '0.5rem' }}>
+            <span style={{ fontWeight: '500' }}>Сообщений:</span>
+            <span style={{ fontSize: '0.875rem', fontWeight: '600' }}>
+              {complaint.cluster_size}
+            </span>
+          </div>
+        )}
+
+        {complaint.duplicate_of && (
+          <div style={{ display: 'flex', justifyContent: 'space-between', marginBottom: '0.5rem' }}>
+            <span style={{ fontWeight: '500' }}>Дубликат жалобы:</span>
+            <span style={{ fontSize: '0.875rem' }}>#{complaint.duplicate_of}</span>
+          </div>
+        )}
+
         <div style={{ display: 'flex', justifyContent: 'space-between' }}>
           <span style={{ fontWeight: '500' }}>Координаты:</span>
           <span style={{ fontSize: '0.875rem' }}>
@@ -33,8 +33,8 @@ export const complaintsAPI = {
   updateComplaint: (id, updateData) => 
     api.put(`/admin/complaints/${id}`, updateData),
   
-  getComplaintsForMap: () => 
-    api.get('/map/complaints'),
+  getComplaintsForMap: (params = {}) => 
+    api.get('/map/complaints', { params }),
 };
 
 export const analyticsAPI = {